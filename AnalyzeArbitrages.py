@@ -5,6 +5,9 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from collections import Counter
+import ArbitrageStream
+import SwapStore
+from Interning import getInternTable
 
 """
 Information about the collected Data:
@@ -20,6 +23,8 @@ SWAPS_END_BLOCK   = 14050000
 
 WETH_ADDRESS = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
 
+INTERN_TABLE = getInternTable()        # Swaps are counted by interned dex/pool ids
+
 def loadJson(file):
     with open(file, 'r', encoding='utf-8') as json_file:
         return json.load(json_file)
@@ -31,10 +36,12 @@ def loadJson(file):
         exit(-1)
 
 def loadSwapHistory():
-    return loadJson(f'data/swap_history.json')
+    ## The statistics only look at where each swap happened
+    return SwapStore.loadSwapHistory(fields=["dex", "poolAddress"], table=INTERN_TABLE)
 
 def loadArbitrages():
-    return loadJson(f'data/arbitrages.json')
+    ## The newer of data/arbitrages.jsonl and data/arbitrages.json, cycles with their full swaps either way
+    return ArbitrageStream.loadArbitrages()
 
 def loadTokenInfo():
     return loadJson(f'data/token_info.json')
@@ -98,6 +105,9 @@ def getBasicStatistics(swaps, arbitrages, tokens):
                 stats.swaps_in_dexes[swap["dex"]] = stats.swaps_in_dexes.get(swap["dex"], 0) + 1
                 stats.swaps_in_pool[swap["poolAddress"]] = stats.swaps_in_pool.get(swap["poolAddress"], 0) + 1
         stats.transactions_in_block[int(blockNum)] = len(transactions)
+    ## Back to names for the graphs and the per-arbitrage statistics
+    stats.swaps_in_dexes = { INTERN_TABLE.value(k) : v for k, v in stats.swaps_in_dexes.items() }
+    stats.swaps_in_pool = { INTERN_TABLE.value(k) : v for k, v in stats.swaps_in_pool.items() }
     stats.num_total_pools = len(stats.swaps_in_pool.keys())
     return stats
 
@@ -0,0 +1,192 @@
+
+"""
+ Append-only arbitrage output, one JSON record per line, written as the
+ blocks are processed:
+
+   data/arbitrages.jsonl        {"block" : 14020001, "transactions" : [3, 4], "balance" : {...},
+                                 "cycle" : [[14020001, 3, 12], [14020001, 4, 7]]}
+   data/arbitrages.jsonl.idx    one "blockNum offset" line per block with arbitrages, the
+                                byte offset of the block's first record
+
+ A cycle refers to its swaps by [blockNumber, transactionIndex, logIndex]
+ instead of carrying copies of swap_history.json's swap dicts. The index lets
+ a reader seek to a block range without parsing what comes before it.
+ Records of a block are written together, blocks in increasing order.
+ A writer appends to the stream it finds: a partial record left by a crash is
+ cut off and the index is rebuilt from the records it is missing. Writing a
+ block at or before the last one in the stream replaces that block and every
+ later one, so a run over part of the history keeps the records before it.
+
+ loadArbitrages reads either this or the old arbitrages.json, whichever is
+ newer, and resolves the references against the swap history, so analysis
+ gets arbitrages in the arbitrages.json shape either way.
+"""
+
+import bisect
+import json
+import os
+import SwapStore
+from Checkpoints import atomicOpen
+from Interning import externArbitrage
+
+
+ARBITRAGE_STREAM_PATH = 'data/arbitrages.jsonl'
+ARBITRAGES_JSON_PATH = 'data/arbitrages.json'
+
+
+def swapRef(swap):
+    return [swap["blockNumber"], swap["transactionIndex"], swap["logIndex"]]
+
+
+def indexPath(path):
+    return f"{path}.idx"
+
+
+class ArbitrageWriter:
+    """ Appends to the stream and its index. Arbitrages of interned swaps are externed with table. """
+    def __init__(self, path=ARBITRAGE_STREAM_PATH, table=None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.table = table
+        self.file = open(path, 'ab')
+        self.lastBlock = None                        # Last block in the stream
+        self.current = None                          # Block this writer is writing
+        self.numRecords = 0                          # Records written by this writer
+        self.recover()
+        self.index = open(indexPath(path), 'a')
+
+    def recover(self):
+        """ Cut off a partial last record, and index the records the index is missing. """
+        index = readIndex(self.path) if os.path.exists(indexPath(self.path)) else []
+        size = self.file.tell()
+        index = [(blockNum, offset) for blockNum, offset in index if offset < size]
+        ## The last indexed block may have more records than were indexed, it is read again
+        offset = index.pop()[1] if len(index) else 0
+        self.lastBlock = index[-1][0] if len(index) else None
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    blockNum = json.loads(line)["block"] if line.endswith(b"\n") else None
+                except json.JSONDecodeError:
+                    blockNum = None
+                if (blockNum is None):
+                    break
+                if (blockNum != self.lastBlock):
+                    index.append((blockNum, offset))
+                    self.lastBlock = blockNum
+                offset += len(line)
+        if (offset < size):
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.writeIndex(index)
+
+    def writeIndex(self, index):
+        with atomicOpen(indexPath(self.path)) as f:
+            for blockNum, offset in index:
+                f.write(f"{blockNum} {offset}\n")
+
+    def truncate(self, blockNum):
+        """ Drop the records of blockNum and every later block. """
+        if (self.lastBlock is None or blockNum > self.lastBlock):
+            return
+        self.index.close()
+        index = readIndex(self.path)
+        i = bisect.bisect_left(index, (blockNum,))
+        self.file.truncate(index[i][1])
+        self.file.seek(index[i][1])
+        self.writeIndex(index[:i])
+        self.index = open(indexPath(self.path), 'a')
+        self.lastBlock = index[i - 1][0] if i else None
+
+    def write(self, arbitrages):
+        """ Append arbitrages, a block's or several blocks', in block order, and flush them. """
+        for arbitrage in arbitrages:
+            if (self.table is not None):
+                arbitrage = externArbitrage(arbitrage, self.table)
+            blockNum = arbitrage["cycle"][-1]["blockNumber"]
+            if (blockNum != self.current):
+                self.truncate(blockNum)
+                self.index.write(f"{blockNum} {self.file.tell()}\n")
+                self.lastBlock = self.current = blockNum
+            record = { "block" : blockNum }
+            record.update((k, v) for k, v in arbitrage.items() if k != "cycle")
+            record["cycle"] = [swapRef(swap) for swap in arbitrage["cycle"]]
+            self.file.write((json.dumps(record, separators=(',', ':')) + "\n").encode())
+            self.numRecords += 1
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def readIndex(path=ARBITRAGE_STREAM_PATH):
+    """ The (blockNum, offset) pairs of the index, in block order. """
+    ret = []
+    with open(indexPath(path), 'r') as f:
+        for line in f:
+            ## A crash in the middle of an append leaves a partial last line
+            if (line.endswith("\n")):
+                blockNum, offset = line.split()
+                ret.append((int(blockNum), int(offset)))
+    return ret
+
+
+def iterRecords(fromBlock=None, toBlock=None, path=ARBITRAGE_STREAM_PATH):
+    """ Yield the records of blocks fromBlock to toBlock, their cycles still references. """
+    index = readIndex(path)
+    i = bisect.bisect_left(index, (fromBlock,)) if fromBlock is not None else 0
+    if (i == len(index)):
+        return
+    with open(path, 'rb') as f:
+        f.seek(index[i][1])
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                return
+            if (toBlock is not None and record["block"] > toBlock):
+                return
+            yield record
+
+
+def resolveRecords(records, fields=None):
+    """ Arbitrages in the arbitrages.json shape, each reference replaced by its swap from the swap history. """
+    if (not len(records)):
+        return []
+    needed = { ref[0] for record in records for ref in record["cycle"] }
+    swaps = dict()
+    for blockNum, transactions in SwapStore.iterSwapHistory(min(needed), max(needed), fields):
+        if (int(blockNum) in needed):
+            for swapsList in transactions.values():
+                for swap in swapsList:
+                    swaps[(int(blockNum), swap["transactionIndex"], swap["logIndex"])] = swap
+    ret = []
+    for record in records:
+        arbitrage = { k : v for k, v in record.items() if k != "block" }
+        arbitrage["cycle"] = [swaps[tuple(ref)] for ref in record["cycle"]]
+        ret.append(arbitrage)
+    return ret
+
+
+def loadArbitrages(fromBlock=None, toBlock=None, path=ARBITRAGE_STREAM_PATH, jsonPath=ARBITRAGES_JSON_PATH, fields=None):
+    """
+     The arbitrages of blocks fromBlock to toBlock from the newer of the stream and arbitrages.json.
+     The stream seeks to fromBlock through its index. arbitrages.json has no index, so a range read
+     from it still parses the whole file: write the stream to read ranges of a long history.
+    """
+    existing = [x for x in [path, jsonPath] if os.path.exists(x)]
+    if (len(existing) and max(existing, key=os.path.getmtime) == path):
+        return resolveRecords(list(iterRecords(fromBlock, toBlock, path)), fields)
+    with open(jsonPath, 'r') as json_file:
+        arbitrages = json.load(json_file)
+    return [x for x in arbitrages if (fromBlock is None or x["cycle"][-1]["blockNumber"] >= fromBlock) and
+                                     (toBlock is None or x["cycle"][-1]["blockNumber"] <= toBlock)]
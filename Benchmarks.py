@@ -0,0 +1,213 @@
+
+"""
+ Benchmarks of the whole pipeline on GenerateSwaps' seeded histories.
+
+ Each scale gets a fresh working directory with its own data/, and each
+ stage is timed, then run again under tracemalloc for its peak memory:
+   - createSwapsHistory: the swap history file, the store and intern table
+   - generateLegalCycles: the brute force search, on the first LEGAL_CYCLES_BLOCKS blocks
+   - generateCycles: the indexed search, on the same blocks
+   - reduceArbitrages: the covers of every block's elementary arbitrages
+   - extractArbitrages: the detector end to end, reading the store
+   - getBasicStatistics, getArbitrageStatistics: the analysis, when numpy and matplotlib are there
+ The same seed gives the same history, so runs on different commits compare.
+ The report also has the detector's recall of the planted cycles.
+
+   python Benchmarks.py --scales small,medium
+   python Benchmarks.py --output new.json --compare data/benchmark_report.json
+
+ writes a JSON report: { "commit", "python", "scales" : { scale : { "parameters",
+ "blocks", "swaps", "planted", "found", "recall", "stages" : { stage : { "seconds",
+ "peakMB", "count" } } } } }. --compare prints each stage's ratio to an older report.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import ExtractSwaps
+import ProcessSwaps
+import SwapStore
+from CycleSearch import generateCycles, SearchBudget, BudgetExceeded
+from GenerateSwaps import SwapHistoryGenerator
+from Interning import getInternTable, externArbitrage
+try:
+    import AnalyzeArbitrages
+except ImportError:
+    ## numpy/matplotlib missing, the analysis stages are skipped
+    AnalyzeArbitrages = None
+
+
+## Keyword arguments of SwapHistoryGenerator per scale
+SCALES = {
+    "small"  : { "blocks" : 200,  "pools" : 60,   "tokens" : 20,  "swapsPerBlock" : 10, "fanout" : 3, "cyclesPerBlock" : 0.2 },
+    "medium" : { "blocks" : 2000, "pools" : 300,  "tokens" : 80,  "swapsPerBlock" : 20, "fanout" : 3, "cyclesPerBlock" : 0.2 },
+    "large"  : { "blocks" : 5000, "pools" : 1000, "tokens" : 200, "swapsPerBlock" : 40, "fanout" : 4, "cyclesPerBlock" : 0.3 },
+}
+LEGAL_CYCLES_BLOCKS = 50            # Blocks given to the brute force search, it grows too fast for all of them
+BENCHMARK_REPORT_PATH = 'data/benchmark_report.json'
+
+
+def commitHash():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(run, memory=True):
+    """ Time run(), then run it again under tracemalloc. Returns its result and { "seconds", "peakMB" }. """
+    start = time.perf_counter()
+    ret = run()
+    stage = { "seconds" : time.perf_counter() - start, "peakMB" : None }
+    if (memory):
+        tracemalloc.start()
+        run()
+        stage["peakMB"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return ret, stage
+
+
+def resetDetector():
+    for metrics in [ProcessSwaps.BLOCK_METRICS, ProcessSwaps.TOTAL_METRICS, ProcessSwaps.DEGRADED_BLOCKS]:
+        metrics.clear()
+    ProcessSwaps.BLOCK_STATS.update(dict.fromkeys(ProcessSwaps.METRIC_KEYS, 0))
+
+
+def elementaryArbitrages(blocks):
+    """ Each block's profitable cycles, as findInBlockArbitrages hands them to reduceArbitrages. """
+    ret = []
+    for swaps in blocks:
+        arbitrages = []
+        try:
+            ProcessSwaps.findElementaryArbitrages(swaps, arbitrages, SearchBudget(ProcessSwaps.BLOCK_CYCLE_BUDGET,
+                                                  ProcessSwaps.BLOCK_NODE_BUDGET, ProcessSwaps.BLOCK_TIME_BUDGET))
+        except BudgetExceeded:
+            continue
+        if (len(arbitrages)):
+            ret.append(arbitrages)
+    return ret
+
+
+def plantedRecall(planted, arbitrages):
+    """ The planted cycles found, and the arbitrages found that weren't planted. """
+    plantedSets = { frozenset(map(tuple, cycle)) for cycle in planted }
+    foundSets = { frozenset((x["blockNumber"], x["transactionIndex"], x["logIndex"]) for x in arbitrage["cycle"]) for arbitrage in arbitrages }
+    return len(plantedSets & foundSets), len(foundSets - plantedSets)
+
+
+def benchmarkScale(name, parameters, seed=0, memory=True, workers=1):
+    generator = SwapHistoryGenerator(seed, **parameters)
+    history = generator.history()
+    stages = dict()
+    table = getInternTable()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        (numBlocks, numSwaps), stages["createSwapsHistory"] = measure(lambda : ExtractSwaps.createSwapsHistory(history), memory)
+    del history
+    print(f"{name}: {numSwaps} swaps in {numBlocks} blocks, {len(generator.planted)} planted arbitrages")
+
+    blocks = []
+    for _, transactions in SwapStore.iterSwapHistory(table=table):
+        blocks.append(sorted((swap for swapsList in transactions.values() for swap in swapsList),
+                             key=lambda x : (x["transactionIndex"], x["logIndex"])))
+    resetDetector()
+    searched = blocks[:LEGAL_CYCLES_BLOCKS]
+    count, stages["generateLegalCycles"] = measure(lambda : sum(1 for swaps in searched for _ in ProcessSwaps.generateLegalCycles(swaps, [])), memory)
+    stages["generateLegalCycles"]["count"] = count
+    count, stages["generateCycles"] = measure(lambda : sum(1 for swaps in searched for _ in generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION,
+                                                           ProcessSwaps.CANONICAL_CYCLES)), memory)
+    stages["generateCycles"]["count"] = count
+    elementary = elementaryArbitrages(blocks)
+    del blocks, searched
+    count, stages["reduceArbitrages"] = measure(lambda : sum(len(ProcessSwaps.reduceArbitrages(x)[0]) for x in elementary), memory)
+    stages["reduceArbitrages"]["count"] = count
+    del elementary
+
+    def extract():
+        resetDetector()
+        return ProcessSwaps.extractArbitrages(SwapStore.iterSwapHistory(table=table), workers)
+    arbitrages, stages["extractArbitrages"] = measure(extract, memory)
+    arbitrages = [externArbitrage(x, table) for x in arbitrages]
+    stages["extractArbitrages"]["count"] = len(arbitrages)
+    found, spurious = plantedRecall(generator.planted, arbitrages)
+    print(f"{name}: {len(arbitrages)} arbitrages, {found} of {len(generator.planted)} planted ones, {spurious} not planted")
+
+    if (AnalyzeArbitrages is not None):
+        AnalyzeArbitrages.INTERN_TABLE = table
+        swaps = SwapStore.loadSwapHistory(fields=["dex", "poolAddress"], table=table)
+        _, stages["getBasicStatistics"] = measure(lambda : AnalyzeArbitrages.getBasicStatistics(swaps, arbitrages, generator.tokens), memory)
+        _, stages["getArbitrageStatistics"] = measure(lambda : [AnalyzeArbitrages.getArbitrageStatistics(x, generator.tokens) for x in arbitrages], memory)
+        stages["getArbitrageStatistics"]["count"] = len(arbitrages)
+
+    for stage, result in stages.items():
+        peak = f", peak {result['peakMB']:.1f}MB" if result["peakMB"] is not None else ""
+        print(f"{name}: {stage} {result['seconds']:.3f}s{peak}")
+    return { "parameters" : dict(parameters, seed=seed), "blocks" : numBlocks, "swaps" : numSwaps,
+             "planted" : len(generator.planted), "found" : found, "spurious" : spurious,
+             "recall" : found / len(generator.planted) if len(generator.planted) else None, "stages" : stages }
+
+
+def runBenchmarks(scales, seed=0, memory=True, workers=1):
+    ProcessSwaps.configureLogging("WARNING")
+    report = { "commit" : commitHash(), "python" : platform.python_version(), "scales" : dict() }
+    cwd = os.getcwd()
+    for name in scales:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            os.makedirs("data")
+            try:
+                report["scales"][name] = benchmarkScale(name, SCALES[name], seed, memory, workers)
+            finally:
+                os.chdir(cwd)
+    return report
+
+
+def compareReports(report, baseline):
+    """ Print each stage's time and peak memory over the baseline's. """
+    print(f"Against {baseline.get('commit')}:")
+    for name, scale in report["scales"].items():
+        old = baseline["scales"].get(name)
+        if (old is None or old["parameters"] != scale["parameters"]):
+            print(f"{name}: not in the baseline with the same parameters")
+            continue
+        for stage, result in scale["stages"].items():
+            oldResult = old["stages"].get(stage)
+            if (oldResult is None):
+                continue
+            line = f"{name}: {stage} {result['seconds'] / max(oldResult['seconds'], 1e-9):.2f}x time"
+            if (result["peakMB"] is not None and oldResult["peakMB"]):
+                line += f", {result['peakMB'] / oldResult['peakMB']:.2f}x memory"
+            print(line)
+        if (scale["found"] != old["found"]):
+            print(f"{name}: found {scale['found']} planted arbitrages, the baseline {old['found']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on seeded synthetic swap histories")
+    parser.add_argument("--scales", default="small,medium", help=f"comma separated, of {', '.join(SCALES)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="processes for extractArbitrages")
+    parser.add_argument("--no-memory", action="store_true", help="only time the stages, without the tracemalloc runs")
+    parser.add_argument("--output", default=BENCHMARK_REPORT_PATH)
+    parser.add_argument("--compare", help="an older report to compare against")
+    args = parser.parse_args()
+    scales = args.scales.split(",")
+    for name in scales:
+        assert(name in SCALES), f"Unknown scale {name}"
+    report = runBenchmarks(scales, args.seed, not args.no_memory, args.workers)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w') as json_file:
+        json.dump(report, json_file, indent=4)
+    if (args.compare):
+        with open(args.compare, 'r') as json_file:
+            compareReports(report, json.load(json_file))
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,112 @@
+
+"""
+ Persistent cache of ProcessSwaps' per block results.
+
+ A block's entry is keyed by the sha256 of its swaps and of the detector's
+ parameters (ProcessSwaps.detectorParameters, its DETECTOR_VERSION
+ included), so a block whose swaps were refetched differently, or a run with
+ other settings, misses and is searched again. Entries are appended to
+
+   data/block_cache.jsonl       one { "key", "block", "arbitrages", "metrics" } line per block
+
+ as soon as the block is done, so an interrupted run picks up where it
+ stopped. Arbitrages are kept as in ArbitrageStream, their cycles as
+ [blockNumber, transactionIndex, logIndex] references into the block, and
+ with strings, not intern ids, so entries outlive the intern table.
+
+ Only a block's latest entry is kept, an entry of the same block from an
+ earlier run is superseded. Once superseded lines make up more than
+ COMPACT_SHARE of the file, loading rewrites it atomically with the
+ latest entries only.
+"""
+
+import hashlib
+import json
+import os
+from ArbitrageStream import swapRef
+from Checkpoints import atomicOpen
+from Interning import externSwap
+
+
+BLOCK_CACHE_PATH = 'data/block_cache.jsonl'
+COMPACT_SHARE = 0.5                 # Share of superseded lines above which loading compacts the file
+
+
+class BlockCache:
+    def __init__(self, parameters, path=BLOCK_CACHE_PATH, table=None):
+        self.parameters = parameters
+        self.path = path
+        self.table = table                  # The intern table of the swaps looked up, None for plain swaps
+        self.hits = 0
+        self.misses = 0
+        self.entries = dict()
+        self.keys = dict()                  # blockNum -> the key of its latest entry
+        self.partial = False                # Whether the file ends in a partial line
+        lines = 0
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    lines += 1
+                    self.partial = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        ## A crash in the middle of an append leaves a partial last line
+                        continue
+                    self.add(entry)
+        except FileNotFoundError:
+            pass
+        if (lines and (lines - len(self.entries)) / lines > COMPACT_SHARE):
+            self.compact()
+
+    def add(self, entry):
+        old = self.keys.get(entry["block"])
+        if (old is not None and old != entry["key"]):
+            del self.entries[old]
+        self.entries.pop(entry["key"], None)
+        self.entries[entry["key"]] = entry
+        self.keys[entry["block"]] = entry["key"]
+
+    def compact(self):
+        """ Rewrite the file with the latest entry of each block only. """
+        with atomicOpen(self.path) as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        self.partial = False
+
+    def key(self, swaps):
+        if (self.table is not None):
+            swaps = [externSwap(swap, self.table) for swap in swaps]
+        swaps = sorted(swaps, key=lambda x : (x["transactionIndex"], x["logIndex"]))
+        return hashlib.sha256(json.dumps({ "parameters" : self.parameters, "swaps" : swaps }, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        """ The cached arbitrages and metrics of the block, its balances in intern ids if there is a table, None on a miss. """
+        entry = self.entries.get(key)
+        if (entry is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if (self.table is not None):
+            arbitrages = [dict(x, balance={ self.table.id(token) : amount for token, amount in x["balance"].items() })
+                          for x in entry["arbitrages"]]
+            entry = dict(entry, arbitrages=arbitrages)
+        return entry
+
+    def put(self, key, blockNum, arbitrages, metrics):
+        arbitrages = [dict(x, cycle=[swapRef(swap) for swap in x["cycle"]]) for x in arbitrages]
+        if (self.table is not None):
+            arbitrages = [dict(x, balance={ self.table.value(token) : amount for token, amount in x["balance"].items() })
+                          for x in arbitrages]
+        entry = { "key" : key, "block" : int(blockNum), "arbitrages" : arbitrages, "metrics" : metrics }
+        self.add(entry)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(("\n" if self.partial else "") + json.dumps(entry) + "\n")
+        self.partial = False
+
+
+def cachedArbitrages(entry, blockSwaps):
+    """ The arbitrages of a cache entry with their references replaced by the block's swaps. """
+    bySwap = { tuple(swapRef(swap)) : swap for swap in blockSwaps }
+    return [dict(x, cycle=[bySwap[tuple(ref)] for ref in x["cycle"]]) for x in entry["arbitrages"]]
@@ -0,0 +1,103 @@
+
+"""
+ Checkpoint manifest for resumable, incremental extraction.
+
+ data/manifest.json records which block ranges are complete for each key:
+   - "pools" : dex              -> ranges scanned for the factory's pool creations
+   - "swaps" : "dex/poolAddress" -> ranges fetched for the pool's swaps
+ Reruns only fetch what is missing and append it to the existing caches.
+ Caches from before the manifest existed are only assumed complete when
+ there is no manifest at all: once there is one, a key missing from it
+ means nothing is known to be covered.
+ Every file, the manifest included, is written to a temporary file and then
+ renamed over the old one, so a crash never leaves a truncated cache behind.
+"""
+
+import contextlib
+import json
+import os
+import threading
+from RangePlanner import addRange
+
+
+MANIFEST_PATH = 'data/manifest.json'
+SAVE_EVERY = 200                    # Save the manifest after this many updates
+
+
+@contextlib.contextmanager
+def atomicOpen(path):
+    """ Open a temporary file for writing that replaces path once the block completes. """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, 'w') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if (os.path.exists(tmp)):
+            os.remove(tmp)
+
+
+def atomicDumpJson(path, obj, indent=4):
+    with atomicOpen(path) as json_file:
+        json.dump(obj, json_file, indent=indent)
+
+
+class CheckpointManifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = os.path.abspath(path)
+        self.lock = threading.RLock()
+        self.updates = 0
+        try:
+            with open(self.path, 'r') as json_file:
+                self.ranges = json.load(json_file)["ranges"]
+            self.legacy = False
+        except FileNotFoundError:
+            self.ranges = dict()
+            ## No manifest when the run started: the caches around predate it
+            self.legacy = True
+        self.exists = not self.legacy
+
+    def covered(self, kind, key):
+        with self.lock:
+            return [list(x) for x in self.ranges.get(kind, dict()).get(key, [])]
+
+    def has(self, kind, key):
+        with self.lock:
+            return key in self.ranges.get(kind, dict())
+
+    def setCovered(self, kind, key, ranges):
+        with self.lock:
+            merged = []
+            for fromBlock, toBlock in ranges:
+                merged = addRange(merged, fromBlock, toBlock)
+            self.ranges.setdefault(kind, dict())[key] = merged
+            self.updates += 1
+            if (self.updates >= SAVE_EVERY):
+                self.save()
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            atomicDumpJson(self.path, { "version" : 1, "ranges" : self.ranges }, indent=None)
+            self.updates = 0
+            self.exists = True
+
+    def create(self):
+        """ Write the manifest if there is no file yet, before the first cache it doesn't describe. """
+        with self.lock:
+            if (not self.exists):
+                self.save()
+
+
+MANIFESTS = dict()
+MANIFESTS_LOCK = threading.Lock()
+
+def getManifest(path=MANIFEST_PATH):
+    """ One shared manifest per file, so every extraction thread sees the same state. """
+    path = os.path.abspath(path)
+    with MANIFESTS_LOCK:
+        if (path not in MANIFESTS):
+            MANIFESTS[path] = CheckpointManifest(path)
+        return MANIFESTS[path]
@@ -0,0 +1,244 @@
+
+"""
+ Branch and bound search for the best exact cover of a block's arbitrages.
+
+ reduceArbitrages wants the exact cover of the block's swaps by elementary
+ arbitrages that is best by (number of arbitrages, sum of closenessMeasure).
+ Listing every cover with solve() and taking the max grows exponentially
+ with the overlaps, so here the best cover is searched for directly:
+   - Arbitrages sharing no swap never constrain each other, so the swap and
+     arbitrage graph is split into connected components and each one is
+     solved on its own. The objective is a sum, so the best covers of the
+     components make the best cover.
+   - Inside a component it's Algorithm X's search (cover the swap with the
+     fewest candidate arbitrages first), on bitmasks, with shorter and
+     closer arbitrages tried first.
+   - A branch is cut when even its bound can't beat the best cover so far:
+     at most remaining swaps / smallest candidate more arbitrages, each
+     adding at most the largest candidate closeness (which is <= 0).
+ A node or time budget stops the search. The best cover found so far is
+ kept, and the components with no cover, because the budget ran out first
+ or because they have none, are handed back so the caller can settle for
+ packRows on their rows alone instead of searching on.
+
+   python CoverSearch.py          # compare with the exhaustive search on synthetic blocks
+"""
+
+import argparse
+import random
+import time
+
+
+class Budget:
+    def __init__(self, nodes=None, seconds=None):
+        self.nodes = nodes
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.visited = 0
+        self.covers = 0
+        self.exhausted = False
+
+    def spend(self):
+        self.visited += 1
+        if (self.nodes is not None and self.visited > self.nodes):
+            self.exhausted = True
+        elif (self.deadline is not None and not self.visited % 1000 and time.monotonic() > self.deadline):
+            self.exhausted = True
+        return not self.exhausted
+
+
+def components(rows):
+    """ Group row indices whose rows are connected through shared elements. """
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = dict()
+    for i, row in enumerate(rows):
+        for x in row:
+            if (x in owner):
+                parent[find(i)] = find(owner[x])
+            else:
+                owner[x] = i
+    groups = dict()
+    for i in range(len(rows)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def searchComponent(rowIds, rows, weights, budget):
+    """
+     The best exact cover of the elements of the rows rowIds, as (count, weight, [row]),
+     None if there is none or the budget ran out before one was found. Every
+     cover reached is counted in budget.covers.
+    """
+    elements = sorted({ x for r in rowIds for x in rows[r] }, key=str)
+    bit = { x : i for i, x in enumerate(elements) }
+    masks = { r : sum(1 << bit[x] for x in rows[r]) for r in rowIds }
+    sizes = { r : len(rows[r]) for r in rowIds }
+    order = lambda r : (sizes[r], -weights[r], r)
+    elementRows = [sorted((r for r in rowIds if masks[r] >> i & 1), key=order) for i in range(len(elements))]
+    full = (1 << len(elements)) - 1
+    best = None
+    chosen = []
+
+    def dfs(covered, count, weight):
+        nonlocal best
+        if (covered == full):
+            budget.covers += 1
+            if (best is None or (count, weight) > (best[0], best[1])):
+                best = (count, weight, list(chosen))
+            return
+        if (not budget.spend()):
+            return
+        ## The uncovered element with the fewest candidate rows, and every row still usable
+        candidates = None
+        usable = set()
+        for i in range(len(elements)):
+            if (not covered >> i & 1):
+                curr = [r for r in elementRows[i] if not masks[r] & covered]
+                if (not len(curr)):
+                    return
+                usable.update(curr)
+                if (candidates is None or len(curr) < len(candidates)):
+                    candidates = curr
+        if (best is not None):
+            remaining = len(elements) - bin(covered).count("1")
+            minSize = min(sizes[r] for r in usable)
+            maxSize = max(sizes[r] for r in usable)
+            maxWeight = max(weights[r] for r in usable)
+            bound = (count + remaining // minSize, weight + -(-remaining // maxSize) * maxWeight)
+            if (bound <= (best[0], best[1])):
+                return
+        for r in candidates:
+            chosen.append(r)
+            dfs(covered | masks[r], count + 1, weight + weights[r])
+            chosen.pop()
+
+    dfs(0, 0, 0.0)
+    return best
+
+
+def bestCover(rows, weights, nodes=None, seconds=None, stats=None):
+    """
+     The exact cover of the rows' elements that maximizes (number of rows, sum
+     of weights), as a sorted list of row indices, built from the best cover of
+     each component. Also returns whether the search finished within its
+     budget, i.e. whether the cover is known to be the best one, and the sorted
+     row indices of the components left without a cover, because they have
+     none or none was found within the budget; the cover only covers all the
+     elements if there are none. The nodes visited and the covers reached are
+     added to stats["coverNodes"] and stats["coversFound"].
+    """
+    budget = Budget(nodes, seconds)
+    cover, unsolved = [], []
+    try:
+        for rowIds in components(rows):
+            best = searchComponent(rowIds, rows, weights, budget)
+            if (best is None):
+                unsolved += rowIds
+            else:
+                cover += best[2]
+        return sorted(cover), not budget.exhausted, sorted(unsolved)
+    finally:
+        if (stats is not None):
+            stats["coverNodes"] = stats.get("coverNodes", 0) + budget.visited
+            stats["coversFound"] = stats.get("coversFound", 0) + budget.covers
+
+
+def packRows(rows, weights, rowIds=None):
+    """
+     Not a cover: greedily pick disjoint rows, among rowIds if given, smaller
+     and heavier first. For when there is no exact cover and some answer is
+     better than none.
+    """
+    chosen, used = [], set()
+    for i in sorted(range(len(rows)) if rowIds is None else rowIds, key=lambda i : (len(rows[i]), -weights[i], i)):
+        if (used.isdisjoint(rows[i])):
+            chosen.append(i)
+            used.update(rows[i])
+    return sorted(chosen)
+
+
+def exhaustiveCover(rows, weights):
+    """ reduceArbitrages' original search: every cover from solve(), then the max. """
+    import ProcessSwaps
+    X, Y = dict(), dict()
+    for i, row in enumerate(rows):
+        Y[i] = sorted(row, key=str)
+        for x in row:
+            X.setdefault(x, set()).add(i)
+    covers = list(ProcessSwaps.solve(X, Y, []))
+    if (not len(covers)):
+        return None, len(covers)
+    return sorted(max(covers, key=lambda cover : (len(cover), sum(weights[i] for i in cover)))), len(covers)
+
+
+def syntheticRows(rng, numSwaps, clusterSize=10, partitions=4):
+    """
+     Rows over numSwaps swap ids with plenty of exact covers: the swaps are
+     grouped in clusters, and each cluster is cut into rows of 1 to 4 swaps
+     in several random ways, so any mix of cuts of different clusters covers.
+     Weights are random closeness values.
+    """
+    rows, weights = [], []
+    swaps = [f"{i // 100}-{i % 100}" for i in range(numSwaps)]
+    for start in range(0, numSwaps, clusterSize):
+        cluster = swaps[start:start+clusterSize]
+        for _ in range(partitions):
+            rng.shuffle(cluster)
+            i = 0
+            while i < len(cluster):
+                size = rng.randint(1, 4)
+                row = set(cluster[i:i+size])
+                if (row not in rows):
+                    rows.append(row)
+                    weights.append(-rng.uniform(0, 5000))
+                i += size
+    return rows, weights
+
+
+def benchmark(blocks):
+    """ Check bestCover reaches the exhaustive search's objective on (rows, weights) blocks, and time both. """
+    times = { "exhaustive" : 0.0, "branchandbound" : 0.0 }
+    same = True
+    numCovers, numRows = 0, 0
+    for rows, weights in blocks:
+        numRows += len(rows)
+        start = time.perf_counter()
+        expected, count = exhaustiveCover(rows, weights)
+        times["exhaustive"] += time.perf_counter() - start
+        numCovers += count
+        start = time.perf_counter()
+        found, complete, unsolved = bestCover(rows, weights)
+        times["branchandbound"] += time.perf_counter() - start
+        found = found if not len(unsolved) else None
+        if (expected is None or found is None):
+            same = same and expected is None and found is None
+            continue
+        value = lambda cover : (len(cover), sum(weights[i] for i in cover))
+        same = same and complete and value(found)[0] == value(expected)[0] and abs(value(found)[1] - value(expected)[1]) < 1e-6
+    print(f"{len(blocks)} blocks, {numRows} rows, {numCovers} exact covers")
+    for name, t in times.items():
+        print(f"{name}: {t:.3f}s")
+    print(f"Speedup: {times['exhaustive'] / max(times['branchandbound'], 1e-9):.1f}x")
+    print(f"Same objective as the exhaustive search: {same}")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the branch and bound cover search with the exhaustive one")
+    parser.add_argument("--swaps", type=int, default=20, help="swaps per synthetic block")
+    parser.add_argument("--cluster", type=int, default=10, help="swaps per cluster of overlapping rows")
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    benchmark([syntheticRows(rng, args.swaps, args.cluster) for _ in range(args.blocks)])
+
+
+if __name__=='__main__':
+    main()
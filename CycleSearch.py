@@ -0,0 +1,324 @@
+
+"""
+ Indexed search for the legal swap cycles of a block.
+
+ ProcessSwaps.generateLegalCycles tries every remaining swap at every depth
+ and copies the remaining list on each step. Here the swaps are indexed once
+ by (from-token, transactionIndex) and (from-token, sender, transactionIndex),
+ so the swaps that can follow a swap are looked up instead of searched for:
+ the ones of the same transaction taking its to-token, and the ones of the
+ next MAX_CROSS_TRANSACTION transactions by the same sender taking it. Those
+ successor lists are built once per block, and the search itself walks them
+ with the used swaps kept in a bitmask.
+
+ The cycles, and the order they come in, are the same as generateLegalCycles'.
+
+ A cycle whose closing step (last swap to first) is itself a legal extension
+ comes out once per rotation. In canonical mode only the rotation starting at
+ its earliest swap is yielded, the earliest in list order, which is
+ (transactionIndex, logIndex) in findInBlockArbitrages. Without that closing
+ step the cycle has no other legal rotation and is always yielded.
+
+ With balances on, a closed cycle comes with its balance, the dict
+ isProfitableArbitrageCycle would return, folded in one pass instead of one
+ dict per swap. Pruning keeps the start token's balance along the path, undone
+ on backtrack, and stops extending a path once even every unused swap paying
+ the start token back couldn't bring it to zero.
+
+ A SearchBudget bounds the work on one block: the search stops with
+ BudgetExceeded once it has taken too many steps, closed too many cycles or
+ run too long.
+
+   python CycleSearch.py                 # benchmark on synthetic dense blocks
+   python CycleSearch.py --history       # and on the blocks of the swap history
+"""
+
+import argparse
+import random
+import time
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, budget):
+        super().__init__(f"{budget} budget exceeded")
+        self.budget = budget                # "cycles", "nodes" or "seconds"
+
+
+class SearchBudget:
+    """ Limits on one block's search, None for no limit. """
+    def __init__(self, cycles=None, nodes=None, seconds=None):
+        self.cycles = cycles
+        self.nodes = nodes
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.numCycles = 0
+        self.numNodes = 0
+
+    def node(self):
+        self.numNodes += 1
+        if (self.nodes is not None and self.numNodes > self.nodes):
+            raise BudgetExceeded("nodes")
+        if (self.deadline is not None and not self.numNodes & 1023 and time.monotonic() > self.deadline):
+            raise BudgetExceeded("seconds")
+
+    def cycle(self):
+        self.numCycles += 1
+        if (self.cycles is not None and self.numCycles > self.cycles):
+            raise BudgetExceeded("cycles")
+        if (self.deadline is not None and time.monotonic() > self.deadline):
+            raise BudgetExceeded("seconds")
+
+    def remaining(self):
+        """ Seconds left, None without a time limit. """
+        return max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+
+
+def cycleBalance(cycle):
+    """
+     isProfitableArbitrageCycle(cycle) in one pass over the cycle and one dict:
+     the net balance, same values and key order, or None when some token is
+     below zero.
+    """
+    balance = dict()
+    for swap in cycle:
+        (amountFrom, tokenFrom), (amountTo, tokenTo) = swap["from"], swap["to"]
+        ## Like the { from : -amount, to : amount } literal, a swap to its own token only adds its to-amount
+        if (tokenFrom != tokenTo):
+            balance[tokenFrom] = balance.get(tokenFrom, 0) - amountFrom
+        balance[tokenTo] = balance.get(tokenTo, 0) + amountTo
+    for amount in balance.values():
+        if (amount < 0):
+            return None
+    return balance
+
+
+def heldChange(swap, token):
+    """ What swap adds to the path's balance of token. """
+    (amountFrom, tokenFrom), (amountTo, tokenTo) = swap["from"], swap["to"]
+    return (amountTo if tokenTo == token else 0) - (amountFrom if tokenFrom == token and tokenFrom != tokenTo else 0)
+
+
+def successors(swapsList, maxCross):
+    """ For each swap, the indices of the swaps canExtend allows after it, in list order. """
+    sameTx = dict()                  # (from-token, tx) -> indices
+    sameSender = dict()              # (from-token, sender, tx) -> indices
+    for j, swap in enumerate(swapsList):
+        sameTx.setdefault((swap["from"][1], swap["transactionIndex"]), []).append(j)
+        sameSender.setdefault((swap["from"][1], swap["sender"], swap["transactionIndex"]), []).append(j)
+    ret = []
+    for i, swapL in enumerate(swapsList):
+        token, amount, tx = swapL["to"][1], swapL["to"][0], swapL["transactionIndex"]
+        candidates = list(sameTx.get((token, tx), ()))
+        for nextTx in range(tx + 1, tx + maxCross + 1):
+            candidates += sameSender.get((token, swapL["sender"], nextTx), ())
+        ret.append(sorted(j for j in candidates if j != i and amount >= swapsList[j]["from"][0]))
+    return ret
+
+
+def generateCycles(swapsList, maxCross, canonical=False, stats=None, budget=None, maxLength=None, balances=False, prune=False):
+    """
+     Yield every legal cycle of swapsList, like generateLegalCycles(swapsList, []),
+     or in canonical mode each one once. Rotations left out are counted in
+     stats["suppressed"], the successors tried, as canExtend calls, in
+     stats["extendChecks"]. maxLength leaves out longer cycles, a budget
+     raises BudgetExceeded when it runs out.
+     With balances, yield (cycle, balance) pairs instead, balance None when
+     some token is below zero. prune leaves out the cycles below zero and
+     the paths that can only lead to such cycles, counted in stats["pruned"].
+     Only the start token's balance is kept along the path, what pruning
+     needs; a cycle's full balance is folded once it closes, which costs less
+     than keeping every token's balance at every step.
+    """
+    succ = successors(swapsList, maxCross)
+    closing = [set(x) for x in succ] if canonical else None
+    ## Per token, the sum of the to-amounts paying it: the most a path can still get back
+    paying = dict()
+    if (prune):
+        for swap in swapsList:
+            paying[swap["to"][1]] = paying.get(swap["to"][1], 0) + swap["to"][0]
+    suppressed = 0
+    checks = 0
+    pruned = 0
+
+    def closed(path):
+        """ The cycle to yield, None if prune leaves it out. """
+        cycle = [swapsList[k] for k in path]
+        if (not balances and not prune):
+            return cycle
+        balance = cycleBalance(cycle)
+        if (prune and balance is None):
+            return None
+        return (cycle, balance) if balances else cycle
+
+    try:
+        for start, first in enumerate(swapsList):
+            token = first["from"][1]
+            path = [start]
+            used = 1 << start
+            if (prune):
+                ## The start token's balance after each swap of the path
+                held = [heldChange(first, token)]
+                unpaid = paying.get(token, 0) - (first["to"][0] if first["to"][1] == token else 0)
+            if (first["to"][1] == token):
+                if (budget is not None):
+                    budget.cycle()
+                cycle = closed(path)
+                if (cycle is not None):
+                    yield cycle
+            deeper = maxLength is None or maxLength > 1
+            if (prune and deeper and held[-1] + unpaid < 0):
+                pruned += 1
+                deeper = False
+            stack = [iter(succ[start]) if deeper else iter(())]
+            checks += len(succ[start]) if deeper else 0
+            while stack:
+                for j in stack[-1]:
+                    if (not (used >> j) & 1):
+                        if (budget is not None):
+                            budget.node()
+                        path.append(j)
+                        used |= 1 << j
+                        if (prune):
+                            held.append(held[-1] + heldChange(swapsList[j], token))
+                        if (swapsList[j]["to"][1] == token):
+                            if (prune):
+                                unpaid -= swapsList[j]["to"][0]
+                            if (budget is not None):
+                                budget.cycle()
+                            ## All rotations are legal when the closing step is, the one from the earliest swap is kept
+                            if (canonical and start in closing[j] and min(path) < start):
+                                suppressed += 1
+                            else:
+                                cycle = closed(path)
+                                if (cycle is not None):
+                                    yield cycle
+                        deeper = maxLength is None or len(path) < maxLength
+                        if (prune and deeper and held[-1] + unpaid < 0):
+                            pruned += 1
+                            deeper = False
+                        stack.append(iter(succ[j]) if deeper else iter(()))
+                        checks += len(succ[j]) if deeper else 0
+                        break
+                else:
+                    stack.pop()
+                    j = path.pop()
+                    used &= ~(1 << j)
+                    if (prune and stack):
+                        held.pop()
+                        if (swapsList[j]["to"][1] == token):
+                            unpaid += swapsList[j]["to"][0]
+    finally:
+        if (stats is not None):
+            stats["suppressed"] = stats.get("suppressed", 0) + suppressed
+            stats["extendChecks"] = stats.get("extendChecks", 0) + checks
+            if (prune):
+                stats["pruned"] = stats.get("pruned", 0) + pruned
+
+
+def syntheticBlock(rng, numSwaps, numTokens=4, numSenders=2, numTransactions=6):
+    """ A dense block: few tokens, few senders, amounts that mostly chain. """
+    swaps = []
+    for i in range(numSwaps):
+        tokenFrom, tokenTo = rng.sample(range(numTokens), 2)
+        swaps.append({
+            "transactionIndex" : rng.randrange(numTransactions),
+            "logIndex" : i,
+            "sender" : f"0x{rng.randrange(numSenders):040x}",
+            "from" : [rng.randint(90, 105), f"0x{tokenFrom:040x}"],
+            "to" : [rng.randint(100, 110), f"0x{tokenTo:040x}"],
+        })
+    swaps.sort(key=lambda x : (x["transactionIndex"], x["logIndex"]))
+    return swaps
+
+
+def historyBlocks(limit):
+    import SwapStore
+    blocks = []
+    for transactions in SwapStore.loadSwapHistory().values():
+        blocks.append(sorted([swap for swaps in transactions.values() for swap in swaps],
+                             key=lambda x : (x["transactionIndex"], x["logIndex"])))
+        if (len(blocks) >= limit):
+            break
+    return blocks
+
+
+def rotationKey(cycle, position):
+    """ A cycle as the tuple of its swaps' list positions, rotated to start at the earliest. """
+    ids = [position[id(x)] for x in cycle]
+    k = ids.index(min(ids))
+    return tuple(ids[k:] + ids[:k])
+
+
+def benchmark(blocks):
+    """
+     Time generateCycles against generateLegalCycles on the same blocks and
+     check they agree, that canonical mode keeps exactly one rotation of
+     each of their cycles, and that the search's balances, with and without
+     pruning, give the profitable ones with isProfitableArbitrageCycle's balances.
+    """
+    import ProcessSwaps
+    maxCross = ProcessSwaps.MAX_CROSS_TRANSACTION
+    times = { "legacy" : 0.0, "indexed" : 0.0, "canonical" : 0.0, "rescored" : 0.0, "balances" : 0.0, "pruned" : 0.0 }
+    same, sameCanonical, sameBalances = True, True, True
+    numCycles = 0
+    stats, pruneStats = dict(), dict()
+    for swaps in blocks:
+        position = { id(x) : i for i, x in enumerate(swaps) }
+        start = time.perf_counter()
+        expected = [[id(x) for x in cycle] for cycle in ProcessSwaps.generateLegalCycles(swaps, [])]
+        times["legacy"] += time.perf_counter() - start
+        start = time.perf_counter()
+        found = [[id(x) for x in cycle] for cycle in generateCycles(swaps, maxCross)]
+        times["indexed"] += time.perf_counter() - start
+        start = time.perf_counter()
+        canonical = list(generateCycles(swaps, maxCross, canonical=True, stats=stats))
+        times["canonical"] += time.perf_counter() - start
+        start = time.perf_counter()
+        rescored = [(cycle, ProcessSwaps.isProfitableArbitrageCycle(cycle)) for cycle in generateCycles(swaps, maxCross, canonical=True)]
+        rescored = [(cycle, balance) for cycle, balance in rescored if balance]
+        times["rescored"] += time.perf_counter() - start
+        start = time.perf_counter()
+        scored = [(cycle, balance) for cycle, balance in generateCycles(swaps, maxCross, canonical=True, balances=True) if balance]
+        times["balances"] += time.perf_counter() - start
+        start = time.perf_counter()
+        pruned = list(generateCycles(swaps, maxCross, canonical=True, stats=pruneStats, balances=True, prune=True))
+        times["pruned"] += time.perf_counter() - start
+        items = lambda cycles : [([id(x) for x in cycle], list(balance.items())) for cycle, balance in cycles]
+        sameBalances = sameBalances and items(scored) == items(rescored) and items(pruned) == items(rescored)
+        same = same and found == expected
+        distinct = { rotationKey(cycle, position) for cycle in ProcessSwaps.generateLegalCycles(swaps, []) }
+        keys = [rotationKey(cycle, position) for cycle in canonical]
+        sameCanonical = sameCanonical and len(keys) == len(set(keys)) and set(keys) == distinct
+        numCycles += len(found)
+    print(f"{len(blocks)} blocks, {sum(len(x) for x in blocks)} swaps, {numCycles} cycles, "
+          f"{numCycles - stats.get('suppressed', 0)} without rotated duplicates")
+    for name, t in times.items():
+        print(f"{name}: {t:.3f}s")
+    print(f"Speedup: {times['legacy'] / max(times['indexed'], 1e-9):.1f}x")
+    print(f"Same cycles in the same order: {same}")
+    print(f"Canonical mode suppressed {stats.get('suppressed', 0)} rotations, one of each cycle kept: {sameCanonical}")
+    print(f"The search's balances over rescoring each cycle: {times['rescored'] / max(times['balances'], 1e-9):.1f}x, "
+          f"with pruning {times['rescored'] / max(times['pruned'], 1e-9):.1f}x, {pruneStats.get('pruned', 0)} paths pruned, "
+          f"same profitable cycles and balances: {sameBalances}")
+    return same and sameCanonical and sameBalances
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the indexed cycle search against generateLegalCycles")
+    parser.add_argument("--swaps", type=int, default=60, help="swaps per synthetic block")
+    parser.add_argument("--tokens", type=int, default=8, help="tokens per synthetic block")
+    parser.add_argument("--senders", type=int, default=4, help="senders per synthetic block")
+    parser.add_argument("--transactions", type=int, default=20, help="transactions per synthetic block")
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", action="store_true", help="use the first blocks of the swap history instead")
+    args = parser.parse_args()
+    if (args.history):
+        blocks = historyBlocks(args.blocks)
+    else:
+        rng = random.Random(args.seed)
+        blocks = [syntheticBlock(rng, args.swaps, args.tokens, args.senders, args.transactions) for _ in range(args.blocks)]
+    benchmark(blocks)
+
+
+if __name__=='__main__':
+    main()
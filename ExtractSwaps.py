@@ -6,12 +6,27 @@ Cyclic arbitrage on UniSwapV2:
 
 """
 
+import argparse
+import heapq
+import itertools
 import pprint
-import requests
 import json
+import math
+import multiprocessing
 import os
+import tempfile
 import traceback
 from threading import Thread
+from LogFetcher import LogFetcher, LogJob
+from RangePlanner import RangePlanner, addRange, missingRanges
+from Checkpoints import getManifest, atomicDumpJson, atomicOpen
+from SwapStore import SwapStoreWriter
+from Interning import getInternTable, shareStrings
+import SwapDecoder
+from SwapDecoder import decodeSwapLogs, printAnomalies
+from TokenResolver import buildTokenInfo
+from LogSources import EtherscanLogSource, JsonRpcLogSource
+from RawLogCache import CachedLogSource, getRawLogCache, loadEntry
 
 
 MY_API_KEYS = [
@@ -20,6 +35,35 @@ MY_API_KEYS = [
     "KEY3"
 ]
 
+ETHERSCAN_API_URL = "https://api.etherscan.io/api"
+JSON_RPC_URL = "http://127.0.0.1:8545"
+
+## "etherscan" queries one pool per request, "jsonrpc" puts many pools
+## into one eth_getLogs filter and batches the filters
+LOG_SOURCE = "etherscan"
+
+## "pools" queries the swaps of each catalog pool, "topic" scans all Swap
+## logs per block window and keeps the ones emitted by catalog pools
+EXTRACTION_MODE = "pools"
+SCAN_WINDOW = 50                    # Blocks per topic-wide query, split further when full
+
+## "async" spreads every pool over all keys through LogFetcher,
+## "threads" is the original one-thread-per-DEX extraction
+EXTRACTION_ENGINE = "async"
+
+## Keep every raw getLogs answer in data/raw_logs, so decoding can be
+## redone offline with --redecode
+RAW_LOG_CACHE = True
+
+## Pool discovery cuts the factory's unscanned history into this many
+## ranges, fetched in parallel and split further where they are dense
+POOL_DISCOVERY_SHARDS = 32
+
+## "jsonl" writes data/swap_history.jsonl, one block per line, which readers
+## stream; "json" writes the original single-object data/swap_history.json
+SWAP_HISTORY_FORMAT = "jsonl"
+MERGE_CHUNK = 256                   # Swaps read at a time from each pool's spill file while merging
+
 FACTORY_ADDRESS = {
     "uniswapv3" : "0x1F98431c8aD98523631AE4a59f267346ea31F984",
     "uniswapv2" : "0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f",
@@ -124,6 +168,10 @@ SWAPS_END_BLOCK   = 14050000
 
 HISTORY_END_BLOCK = SWAPS_END_BLOCK
 
+## Window of the data/ caches written before the checkpoint manifest existed,
+## assumed only when there is no manifest at all
+LEGACY_SWAPS_RANGE = [14020000, 14050000]
+
 def getSigned(value):
     return -(value & 0x8000000000000000000000000000000000000000000000000000000000000000) | \
             (value & 0x7FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
@@ -133,143 +181,190 @@ def getInt(value):
         return int(value, 16)
     return 0
 
-def getCreatedPools(dex, fromBlock, toBlock, keyIdx):
-    print(f"{dex}: fromBlock = {fromBlock}, toBlock = {toBlock}")
+def decodeCreatedPools(dex, logs):
+    r = [ { "blockNumber" : getInt(x["blockNumber"]), 
+            "token0" : "0x" + x["topics"][1][-40:],
+            "token1" : "0x" + x["topics"][2][-40:],
+            "poolContract" : FACTORY_POOLCREATED_EVENT_CONTRACT[dex](x)
+            } for x in logs]
+    return { x["poolContract"] : x for x in r }
+
+
+def decodeSwaps(dex, token0, token1, logs):
+    return decodeSwapLogs(dex, token0, token1, logs)
+
+
+POOL_DISCOVERY_TAG = "pools"        # LogJob tag of factory PoolCreated queries
+
+LOG_SOURCES = dict()
+
+def getLogSource(keyIdx):
+    if (keyIdx not in LOG_SOURCES):
+        if (LOG_SOURCE == "jsonrpc"):
+            source, endpoint = JsonRpcLogSource(JSON_RPC_URL), JSON_RPC_URL
+        else:
+            source, endpoint = EtherscanLogSource(MY_API_KEYS[keyIdx], ETHERSCAN_API_URL), ETHERSCAN_API_URL
+        if (RAW_LOG_CACHE):
+            source = CachedLogSource(source, endpoint, getRawLogCache())
+        LOG_SOURCES[keyIdx] = source
+    return LOG_SOURCES[keyIdx]
+
+
+def getCreatedPoolsBatch(dex, ranges, keyIdx):
+    """ The pools created in each [fromBlock, toBlock] of ranges, None where the provider found a range too large. """
+    print(f"{dex}: Getting pools for {len(ranges)} block ranges")
     try:
-        r = requests.get(
-            f"https://api.etherscan.io/api",
-            params = {
-                "module" : "logs",
-                "action" : "getLogs",
-                "address" : FACTORY_ADDRESS[dex],
-                "topic0" : FACTORY_POOLCREATED_EVENT[dex],
-                "fromBlock" : fromBlock,
-                "toBlock" : toBlock,
-                "apikey" : MY_API_KEYS[keyIdx]
-            }
-        ).json()
-        assert(r["message"] == "OK")
-        r = r["result"]
-        r = [ { "blockNumber" : getInt(x["blockNumber"]), 
-                "token0" : "0x" + x["topics"][1][-40:],
-                "token1" : "0x" + x["topics"][2][-40:],
-                "poolContract" : FACTORY_POOLCREATED_EVENT_CONTRACT[dex](x)
-                } for x in r]
-        r = { x["poolContract"] : x for x in r }
-        return r
+        queries = [([FACTORY_ADDRESS[dex]], FACTORY_POOLCREATED_EVENT[dex], fromBlock, toBlock) for fromBlock, toBlock in ranges]
+        return [decodeCreatedPools(dex, r) if r is not None else None for r in getLogSource(keyIdx).getLogsBatch(queries)]
     except:
-        print(f"{dex}: FAILED getting pools from {fromBlock} to {toBlock}")
+        print(f"{dex}: FAILED getting pools for {ranges}")
         traceback.print_exc()
-        pprint.pprint(r)
         exit(-1)
 
 
-def getPools(dex, keyIdx):
-    print(f"{dex}: Getting pools")
+def loadPoolCatalog(dex):
+    """ The known pools of a DEX keyed by poolContract, and the block ranges already scanned for them. """
+    manifest = getManifest()
     try:
         with open(f'data/{dex}_pools.json', 'r') as json_file:
-            return json.load(json_file)
+            allPools = { x["poolContract"] : x for x in json.load(json_file) }
+        if (manifest.has("pools", dex)):
+            covered = manifest.covered("pools", dex)
+        elif (manifest.legacy):
+            covered = [[0, LEGACY_SWAPS_RANGE[1]]]
+            manifest.setCovered("pools", dex, covered)
+        else:
+            covered = []
     except:
         print(f"{dex}: Can't load pools from existing file")
+        allPools, covered = dict(), []
+    return allPools, covered
 
-    allPools = dict()
-    startBlock = 0
-    endBlock = HISTORY_END_BLOCK
-    while True:
-        curr = getCreatedPools(dex, startBlock, endBlock, keyIdx)
-        prevNum = len(allPools)
-        allPools.update(curr)
-        afterNum = len(allPools)
-        print(f"{dex}: prevNum = {prevNum}, afterNum = {afterNum}")
-        if (prevNum == afterNum):
-            break
-        else:
-            startBlock = max(x["blockNumber"] for x in curr.values())
-            
-    allPools = list(allPools.values())
-    with open(f'data/{dex}_pools.json', 'w') as json_file:
-        json.dump(allPools, json_file, indent=4)
 
+def storePoolCatalog(dex, allPools, covered):
+    allPools = list(allPools.values())
+    manifest = getManifest()
+    ## A crash before the save below must not leave a catalog that looks like it predates the manifest
+    manifest.create()
+    atomicDumpJson(f'data/{dex}_pools.json', allPools)
+    manifest.setCovered("pools", dex, covered)
+    manifest.save()
     return allPools
 
 
+def addCreatedPools(allPools, planner, fromBlock, toBlock, curr):
+    """ Record a discovery page. Returns the pools it added and the follow-up ranges. """
+    keepBelow, newRanges = planner.complete(fromBlock, toBlock, [x["blockNumber"] for x in curr.values()])
+    added = [x for k, x in sorted(curr.items(), key=lambda x: x[1]["blockNumber"])
+             if (keepBelow is None or x["blockNumber"] < keepBelow) and k not in allPools]
+    allPools.update({ x["poolContract"] : x for x in added })
+    return added, newRanges
+
+
+def getPools(dex, keyIdx):
+    """
+     Discover the pools of a DEX. The unscanned part of the factory's history
+     is cut into POOL_DISCOVERY_SHARDS ranges, and every round sends all
+     pending ranges as one batch, splitting the ones that came back full.
+    """
+    print(f"{dex}: Getting pools")
+    allPools, covered = loadPoolCatalog(dex)
+    planner = RangePlanner(0, HISTORY_END_BLOCK, getLogSource(keyIdx).resultCap or math.inf, covered)
+    ranges = planner.start(shards=POOL_DISCOVERY_SHARDS)
+    if (not len(ranges)):
+        return list(allPools.values())
+    while len(ranges):
+        batch, ranges = ranges, []
+        for (fromBlock, toBlock), curr in zip(batch, getCreatedPoolsBatch(dex, batch, keyIdx)):
+            if (curr is None):
+                ranges += planner.split(fromBlock, toBlock)
+                continue
+            _, newRanges = addCreatedPools(allPools, planner, fromBlock, toBlock, curr)
+            ranges += newRanges
+        print(f"{dex}: Num Pools = {len(allPools)}")
+    return storePoolCatalog(dex, allPools, planner.covered)
+
+
 def getTokensFromPools(dex, pools):
-    try:
-        with open(f'data/{dex}_tokens.json', 'r') as json_file:
-            return json.load(json_file)
-    except:
-        print(f"{dex}: Can't load tokens from existing file for")
+    ## Cheap to rebuild, and the pool catalog may have grown since the last run
     tokens = list(set([x[s] for s in ["token0", "token1"] for x in pools]))
-    with open(f'data/{dex}_tokens.json', 'w') as json_file:
-        json.dump(tokens, json_file, indent=4)
+    atomicDumpJson(f'data/{dex}_tokens.json', tokens)
     return tokens
-    
+
+
+def swapKey(swap):
+    return f'{swap["blockNumber"]}-{swap["transactionIndex"]}-{swap["logIndex"]}'
+
+
+def windowSwaps(swaps):
+    return [x for x in swaps if SWAPS_START_BLOCK <= x["blockNumber"] <= SWAPS_END_BLOCK]
+
+
+def loadPoolSwaps(dex, poolAddress, createdBlock=0):
+    """
+     The cached swaps of a pool keyed by swapKey, and the block ranges they
+     cover. Blocks before the pool was created are covered by definition.
+     A cache is { "covered", "swaps" }, so its ranges are written with it in
+     one atomic write; an older plain list of swaps goes by the manifest.
+    """
+    manifest = getManifest()
+    key = f'{dex}/{poolAddress}'
+    try:
+        with open(f'data/{dex}_swaps/{poolAddress}.json', 'r') as json_file:
+            cache = json.load(json_file)
+        if (isinstance(cache, dict)):
+            swaps = { swapKey(x) : x for x in cache["swaps"] }
+            covered = [list(x) for x in cache["covered"]]
+        else:
+            swaps = { swapKey(x) : x for x in cache }
+            if (manifest.has("swaps", key)):
+                covered = manifest.covered("swaps", key)
+            elif (manifest.legacy):
+                covered = [LEGACY_SWAPS_RANGE]
+                manifest.setCovered("swaps", key, covered)
+            else:
+                covered = []
+    except:
+        swaps, covered = dict(), []
+    if (createdBlock > 0):
+        covered = addRange(covered, 0, createdBlock - 1)
+    return swaps, covered
+
+
+def storePoolSwaps(dex, poolAddress, swaps, covered):
+    """ Write all swaps of a pool and record the ranges they cover. Returns the ones inside the window. """
+    allSwaps = sorted(swaps.values(), key=lambda x: (x["blockNumber"], x["transactionIndex"], x["logIndex"]))
+    atomicDumpJson(f'data/{dex}_swaps/{poolAddress}.json', { "covered" : covered, "swaps" : allSwaps })
+    getManifest().setCovered("swaps", f'{dex}/{poolAddress}', covered)
+    return windowSwaps(allSwaps)
+
 
 def getSwapsFromPoolForBlocks(dex, poolAddress, token0, token1, fromBlock, toBlock, keyIdx):
     print(f"{dex}: pool = {poolAddress}, fromBlock = {fromBlock}, toBlock = {toBlock}")
     try:
-        r = requests.get(
-                f"https://api.etherscan.io/api",
-                params = {
-                    "module" : "logs",
-                    "action" : "getLogs",
-                    "address" : poolAddress,
-                    "topic0" : POOL_SWAP_EVENT[dex],
-                    "fromBlock" : fromBlock,
-                    "toBlock" : toBlock,
-                    "apikey" : MY_API_KEYS[keyIdx]
-                }
-            ).json()
-        assert(r["message"] == "OK" or r["message"] == "No records found")
-        r = r["result"]
-        r = [ { "blockNumber" : getInt(x["blockNumber"]), 
-                "transactionIndex" : getInt(x["transactionIndex"]), 
-                "logIndex" : getInt(x["logIndex"]),
-                "transactionHash" : x["transactionHash"],
-                "sender" : "0x" + x["topics"][1][-40:],
-                "recipient" : "0x" + x["topics"][2][-40:],
-                "timeStamp" : x["timeStamp"],
-                "gasPrice" : x["gasPrice"],
-                "gasUsed" : x["gasUsed"],
-                "from" : POOL_SWAP_FROM[dex](token0, token1, x),
-                "to" : POOL_SWAP_TO[dex](token0, token1, x),
-                } for x in r]
-        r = { f'{x["blockNumber"]}-{x["transactionIndex"]}-{x["logIndex"]}' : x for x in r }
-        return r
+        r = getLogSource(keyIdx).getLogs([poolAddress], POOL_SWAP_EVENT[dex], fromBlock, toBlock)
+        return decodeSwaps(dex, token0, token1, r)
     except:
         print(f"{dex}: FAILED getting swaps for {poolAddress} from {fromBlock} to {toBlock}")
         traceback.print_exc()
-        pprint.pprint(r)
 
 
-def getSwapsFromPool(dex, poolAddress, token0, token1, keyIdx):
+def getSwapsFromPool(dex, poolAddress, token0, token1, keyIdx, createdBlock=0):
     while True:
         try:
-            try:
-                with open(f'data/{dex}_swaps/{poolAddress}.json', 'r') as json_file:
-                    return json.load(json_file)
-            except:
-                print(f"{dex}: Can't load swaps for {poolAddress} from existing file")
-
-            allSwaps = dict()
-            startBlock = SWAPS_START_BLOCK
-            endBlock =  SWAPS_END_BLOCK
-            while True:
-                curr = getSwapsFromPoolForBlocks(dex, poolAddress, token0, token1, startBlock, endBlock, keyIdx)
-                prevNum = len(allSwaps)
-                allSwaps.update(curr)
-                afterNum = len(allSwaps)
-                print(f"{dex}: prevNum = {prevNum}, afterNum = {afterNum}")
-                if (prevNum == afterNum):
-                    break
-                else:
-                    startBlock = max(x["blockNumber"] for x in curr.values())
-                    
-            allSwaps = list(allSwaps.values())
-            with open(f'data/{dex}_swaps/{poolAddress}.json', 'w') as json_file:
-                json.dump(allSwaps, json_file, indent=4)
-
-            return allSwaps
+            allSwaps, covered = loadPoolSwaps(dex, poolAddress, createdBlock)
+            planner = RangePlanner(SWAPS_START_BLOCK, SWAPS_END_BLOCK, getLogSource(keyIdx).resultCap or math.inf, covered)
+            ranges = planner.start()
+            if (not len(ranges)):
+                return windowSwaps(list(allSwaps.values()))
+            while len(ranges):
+                fromBlock, toBlock = ranges.pop()
+                curr = getSwapsFromPoolForBlocks(dex, poolAddress, token0, token1, fromBlock, toBlock, keyIdx)
+                keepBelow, newRanges = planner.complete(fromBlock, toBlock, [x["blockNumber"] for x in curr.values()])
+                allSwaps.update({ k : x for k, x in curr.items() if keepBelow is None or x["blockNumber"] < keepBelow })
+                ranges += newRanges
+
+            return storePoolSwaps(dex, poolAddress, allSwaps, planner.covered)
         except:
             print(f"{dex}: FAILED getting swaps for {poolAddress}. Will retry..")
 
@@ -283,6 +378,50 @@ def getSwapsFromPool(dex, poolAddress, token0, token1, keyIdx):
 ##     "0x7ce01885a13c652241ae02ea7369ee8d466802eb"
 ## ]
 
+def getSwapsFromPools(dex, pools, keyIdx):
+    """
+     Like getSwapsFromPool for many pools at once, for log sources that accept
+     several addresses per query. Pools missing the same block ranges share
+     queries. Returns a map of poolAddress to its swaps.
+    """
+    source = getLogSource(keyIdx)
+    swaps = dict()
+    groups = dict()
+    for pool in pools:
+        current, covered = loadPoolSwaps(dex, pool["poolContract"], pool.get("blockNumber", 0))
+        missing = missingRanges(covered, SWAPS_START_BLOCK, SWAPS_END_BLOCK)
+        if (not len(missing)):
+            swaps[pool["poolContract"]] = windowSwaps(list(current.values()))
+            continue
+        groups.setdefault(json.dumps(missing), []).append((pool, current, covered))
+    print(f"{dex}: Fetching swaps for {sum(len(x) for x in groups.values())} pools ({len(swaps)} already complete)")
+    chunks = [members[i:i+source.maxAddresses] for members in groups.values() for i in range(0, len(members), source.maxAddresses)]
+    for chunk in chunks:
+        pages = { pool["poolContract"].lower() : [] for pool, _, _ in chunk }
+        planner = RangePlanner(SWAPS_START_BLOCK, SWAPS_END_BLOCK, source.resultCap or math.inf, chunk[0][2])
+        ranges = planner.start()
+        while len(ranges):
+            queries = [(list(pages), POOL_SWAP_EVENT[dex], fromBlock, toBlock) for fromBlock, toBlock in ranges]
+            ranges = []
+            for (_, _, fromBlock, toBlock), logs in zip(queries, source.getLogsBatch(queries)):
+                if (logs is None):
+                    ranges += planner.split(fromBlock, toBlock)
+                    continue
+                keepBelow, newRanges = planner.complete(fromBlock, toBlock, [getInt(x["blockNumber"]) for x in logs])
+                for log in logs:
+                    if (keepBelow is None or getInt(log["blockNumber"]) < keepBelow):
+                        pages[log["address"].lower()].append(log)
+                ranges += newRanges
+        for pool, current, covered in chunk:
+            current.update(decodeSwaps(dex, pool["token0"], pool["token1"], pages[pool["poolContract"].lower()]))
+            for fromBlock, toBlock in planner.covered:
+                covered = addRange(covered, fromBlock, toBlock)
+            swaps[pool["poolContract"]] = storePoolSwaps(dex, pool["poolContract"], current, covered)
+        print(f"{dex}: Got swaps for {len(swaps)} of {len(pools)} pools")
+    getManifest().save()
+    return swaps
+
+
 def extractData(dex, keyIdx, results):
     os.makedirs(f"data/{dex}_swaps", exist_ok=True)
     print(f"{dex}: Extracting data")
@@ -290,47 +429,467 @@ def extractData(dex, keyIdx, results):
     print(f"{dex}: Num Pools is {len(pools)}")
     tokens = getTokensFromPools(dex, pools)
     print(f"{dex}: Num Tokens is {len(tokens)}")
+    if (getLogSource(keyIdx).maxAddresses > 1):
+        results.append((dex, getSwapsFromPools(dex, pools, keyIdx)))
+        return
     swaps = dict()
     for pool in pools:
         poolAddress = pool["poolContract"]
         ## ## For specific Arbitrage Transaction
         ## if not poolAddress in SPECIAL_POOLS:
         ##     continue
-        swaps[poolAddress] = getSwapsFromPool(dex, poolAddress, pool["token0"], pool["token1"], keyIdx)
+        swaps[poolAddress] = getSwapsFromPool(dex, poolAddress, pool["token0"], pool["token1"], keyIdx, pool.get("blockNumber", 0))
         print(f"{dex}: Num Swaps for {poolAddress} is {len(swaps[poolAddress])}")
     results.append((dex, swaps))
 
-def createSwapsHistory(allSwaps):
-    ret = dict()
+def extractAllSwapsAsync(dexPools, discover=()):
+    """
+     Fetch the swaps of every pool of every DEX through one LogFetcher run.
+     dexPools is a list of (dex, pools). The pools of the DEXes in discover
+     are found in the same run, and each new pool's swaps are queued as soon
+     as its creation log comes in. Returns the same [(dex, swaps)] list the
+     extractData threads produce.
+    """
+    dexes = [dex for dex, _ in dexPools] + [dex for dex in discover]
+    swaps = { dex : dict() for dex in dexes }
+    pages = dict()
+    planners = dict()
+    discoveries = dict()
+    jobs = []
+
+    def poolJobs(dex, pool):
+        poolAddress = pool["poolContract"]
+        current, covered = loadPoolSwaps(dex, poolAddress, pool.get("blockNumber", 0))
+        planner = RangePlanner(SWAPS_START_BLOCK, SWAPS_END_BLOCK, getLogSource(0).resultCap or math.inf, covered)
+        ranges = planner.start()
+        if (not len(ranges)):
+            swaps[dex][poolAddress] = windowSwaps(list(current.values()))
+            return []
+        pages[(dex, poolAddress)] = current
+        planners[(dex, poolAddress)] = planner
+        return [LogJob(dex, poolAddress, POOL_SWAP_EVENT[dex], fromBlock, toBlock, pool) for fromBlock, toBlock in ranges]
+
+    for dex in dexes:
+        os.makedirs(f"data/{dex}_swaps", exist_ok=True)
+    for dex in discover:
+        jobs += startDiscovery(dex, discoveries)
+        dexPools = dexPools + [(dex, list(discoveries[dex][0].values()))]
+    for dex, pools in dexPools:
+        for pool in pools:
+            jobs += poolJobs(dex, pool)
+    print(f"Fetching swaps for {len(pages)} pools ({sum(len(x) for x in swaps.values())} already complete)")
+
+    def onDiscovery(job, logs):
+        allPools, planner = discoveries[job.dex]
+        added, newRanges = addCreatedPools(allPools, planner, job.fromBlock, job.toBlock, decodeCreatedPools(job.dex, logs))
+        newJobs = [job._replace(fromBlock = fromBlock, toBlock = toBlock) for fromBlock, toBlock in newRanges]
+        for pool in added:
+            newJobs += poolJobs(job.dex, pool)
+        if (planner.done()):
+            finishDiscovery(job.dex, allPools, planner)
+        return newJobs
+
+    def onResult(job, logs):
+        if (job.tag == POOL_DISCOVERY_TAG):
+            return onDiscovery(job, logs)
+        pool = job.tag
+        planner = planners[(job.dex, job.address)]
+        allSwaps = pages[(job.dex, job.address)]
+        curr = decodeSwaps(job.dex, pool["token0"], pool["token1"], logs)
+        keepBelow, newRanges = planner.complete(job.fromBlock, job.toBlock, [x["blockNumber"] for x in curr.values()])
+        allSwaps.update({ k : x for k, x in curr.items() if keepBelow is None or x["blockNumber"] < keepBelow })
+        if (not planner.done()):
+            return [job._replace(fromBlock = fromBlock, toBlock = toBlock) for fromBlock, toBlock in newRanges]
+        swaps[job.dex][job.address] = storePoolSwaps(job.dex, job.address, allSwaps, planner.covered)
+        del pages[(job.dex, job.address)]
+        del planners[(job.dex, job.address)]
+        print(f"{job.dex}: Num Swaps for {job.address} is {len(swaps[job.dex][job.address])}")
+        return []
+
+    fetcher = LogFetcher(MY_API_KEYS, ETHERSCAN_API_URL, cache=getRawLogCache() if RAW_LOG_CACHE else None)
+    failed = fetcher.run(jobs, onResult)
+    fetcher.printStats()
+    ## The pages of an unfinished pool are kept with the ranges they cover, a rerun only asks for the rest
+    for (dex, poolAddress), allSwaps in pages.items():
+        storePoolSwaps(dex, poolAddress, allSwaps, planners[(dex, poolAddress)].covered)
+        print(f"{dex}: FAILED getting swaps for {poolAddress}")
+    getManifest().save()
+    failDiscoveries(discoveries)
+    if (len(failed) or len(pages)):
+        print(f"FAILED {len(failed)} getLogs jobs, rerun to fetch the missing ranges")
+        exit(-1)
+    return [(dex, swaps[dex]) for dex in dexes]
+
+
+def failDiscoveries(discoveries):
+    """ Keep the pools found by unfinished discoveries and exit if there are any. """
+    unfinished = [dex for dex, (_, planner) in discoveries.items() if not planner.done()]
+    for dex in unfinished:
+        allPools, planner = discoveries[dex]
+        storePoolCatalog(dex, allPools, planner.covered)
+        print(f"{dex}: FAILED discovering pools, {len(allPools)} found so far")
+    if (len(unfinished)):
+        exit(-1)
+
+
+def startDiscovery(dex, discoveries):
+    """ Load the catalog of a DEX into discoveries and return the LogJobs for its unscanned factory history. """
+    allPools, covered = loadPoolCatalog(dex)
+    planner = RangePlanner(0, HISTORY_END_BLOCK, getLogSource(0).resultCap or math.inf, covered)
+    discoveries[dex] = (allPools, planner)
+    jobs = [LogJob(dex, FACTORY_ADDRESS[dex], FACTORY_POOLCREATED_EVENT[dex], fromBlock, toBlock, POOL_DISCOVERY_TAG)
+            for fromBlock, toBlock in planner.start(shards=POOL_DISCOVERY_SHARDS)]
+    if (planner.done()):
+        finishDiscovery(dex, allPools, planner)
+    return jobs
+
+
+def discoverPoolsAsync(dexes):
+    """ Discover the pools of every DEX through one LogFetcher run. Returns [(dex, pools)]. """
+    discoveries = dict()
+    jobs = [job for dex in dexes for job in startDiscovery(dex, discoveries)]
+
+    def onResult(job, logs):
+        allPools, planner = discoveries[job.dex]
+        _, newRanges = addCreatedPools(allPools, planner, job.fromBlock, job.toBlock, decodeCreatedPools(job.dex, logs))
+        if (planner.done()):
+            finishDiscovery(job.dex, allPools, planner)
+        return [job._replace(fromBlock = fromBlock, toBlock = toBlock) for fromBlock, toBlock in newRanges]
+
+    if (len(jobs)):
+        fetcher = LogFetcher(MY_API_KEYS, ETHERSCAN_API_URL, cache=getRawLogCache() if RAW_LOG_CACHE else None)
+        fetcher.run(jobs, onResult)
+        fetcher.printStats()
+    failDiscoveries(discoveries)
+    return [(dex, list(discoveries[dex][0].values())) for dex in dexes]
+
+
+def finishDiscovery(dex, allPools, planner):
+    """ Write the catalog and token list of a DEX whose discovery just completed. """
+    pools = storePoolCatalog(dex, allPools, planner.covered)
+    print(f"{dex}: Num Pools is {len(pools)}")
+    tokens = getTokensFromPools(dex, pools)
+    print(f"{dex}: Num Tokens is {len(tokens)}")
+
+
+def buildPoolIndex(dexPools):
+    """ Map the address of every catalog pool to its (dex, pool). """
+    return { pool["poolContract"].lower() : (dex, pool) for dex, pools in dexPools for pool in pools }
+
+
+def scanSwapsByTopic(dexPools, keyIdx=0):
+    """
+     Fetch every Swap log of the window without an address filter and route
+     each one to its pool through the catalog index, so the cost follows the
+     number of swaps rather than the number of pools. DEXes sharing a Swap
+     event (uniswapv2 and sushiswap) share the scan. Logs from addresses
+     outside the catalogs are dropped. Returns [(dex, swaps)] like extractData.
+    """
+    index = buildPoolIndex(dexPools)
+    current = dict()
+    missing = dict()
+    for address, (dex, pool) in index.items():
+        current[address] = loadPoolSwaps(dex, pool["poolContract"], pool.get("blockNumber", 0))
+        for fromBlock, toBlock in missingRanges(current[address][1], SWAPS_START_BLOCK, SWAPS_END_BLOCK):
+            missing[POOL_SWAP_EVENT[dex]] = addRange(missing.get(POOL_SWAP_EVENT[dex], []), fromBlock, toBlock)
+
+    pages = dict()
+    dropped = [0]
+    def route(topic0, logs, keepBelow):
+        for log in logs:
+            if (keepBelow is not None and getInt(log["blockNumber"]) >= keepBelow):
+                continue
+            address = log["address"].lower()
+            if (address not in index or POOL_SWAP_EVENT[index[address][0]] != topic0):
+                dropped[0] += 1
+                continue
+            pages.setdefault(address, []).append(log)
+
+    ## Scan only the blocks some pool of the topic is still missing
+    resultCap = getLogSource(keyIdx).resultCap or math.inf
+    planners = { topic0 : RangePlanner(SWAPS_START_BLOCK, SWAPS_END_BLOCK, resultCap,
+                                       missingRanges(missing.get(topic0, []), SWAPS_START_BLOCK, SWAPS_END_BLOCK))
+                 for topic0 in sorted({ POOL_SWAP_EVENT[dex] for dex, _ in dexPools }) }
+    if (LOG_SOURCE == "etherscan" and EXTRACTION_ENGINE == "async"):
+        jobs = [LogJob("topic", None, topic0, fromBlock, toBlock)
+                for topic0, planner in planners.items() for fromBlock, toBlock in planner.start(SCAN_WINDOW)]
+        def onResult(job, logs):
+            keepBelow, newRanges = planners[job.topic0].complete(job.fromBlock, job.toBlock, [getInt(x["blockNumber"]) for x in logs])
+            route(job.topic0, logs, keepBelow)
+            return [job._replace(fromBlock = fromBlock, toBlock = toBlock) for fromBlock, toBlock in newRanges]
+        fetcher = LogFetcher(MY_API_KEYS, ETHERSCAN_API_URL, cache=getRawLogCache() if RAW_LOG_CACHE else None)
+        failed = fetcher.run(jobs, onResult)
+        fetcher.printStats()
+    else:
+        failed = []
+        source = getLogSource(keyIdx)
+        queries = [(topic0, r) for topic0, planner in planners.items() for r in planner.start(SCAN_WINDOW)]
+        while len(queries):
+            print(f"Scanning {len(queries)} block windows")
+            results = source.getLogsBatch([(None, topic0, fromBlock, toBlock) for topic0, (fromBlock, toBlock) in queries])
+            nextQueries = []
+            for (topic0, (fromBlock, toBlock)), logs in zip(queries, results):
+                if (logs is None):
+                    nextQueries += [(topic0, r) for r in planners[topic0].split(fromBlock, toBlock)]
+                    continue
+                keepBelow, newRanges = planners[topic0].complete(fromBlock, toBlock, [getInt(x["blockNumber"]) for x in logs])
+                route(topic0, logs, keepBelow)
+                nextQueries += [(topic0, r) for r in newRanges]
+            queries = nextQueries
+    print(f"Routed swaps to {len(pages)} of {len(index)} pools, dropped {dropped[0]} logs from unknown addresses")
+
+    swaps = { dex : dict() for dex, _ in dexPools }
+    for address, (dex, pool) in index.items():
+        poolSwaps, covered = current.pop(address)
+        logs = pages.pop(address, [])
+        if (not len(missingRanges(covered, SWAPS_START_BLOCK, SWAPS_END_BLOCK))):
+            swaps[dex][pool["poolContract"]] = windowSwaps(list(poolSwaps.values()))
+            continue
+        poolSwaps.update(decodeSwaps(dex, pool["token0"], pool["token1"], logs))
+        for fromBlock, toBlock in planners[POOL_SWAP_EVENT[dex]].covered:
+            covered = addRange(covered, fromBlock, toBlock)
+        os.makedirs(f"data/{dex}_swaps", exist_ok=True)
+        swaps[dex][pool["poolContract"]] = storePoolSwaps(dex, pool["poolContract"], poolSwaps, covered)
+    getManifest().save()
+    if (len(failed)):
+        ## The windows scanned are stored above, a rerun only scans the failed ones
+        print(f"FAILED {len(failed)} getLogs jobs, rerun to fetch the missing ranges")
+        exit(-1)
+    return [(dex, swaps[dex]) for dex, _ in dexPools]
+
+
+def poolSwapsStream(dex, poolAddress, swaps):
+    """ The swaps of a pool tagged with their dex and pool, checking they come in (block, tx, log) order. """
+    last = None
+    for swap in swaps:
+        swap["dex"] = dex
+        swap["poolAddress"] = poolAddress
+        curr = (swap["blockNumber"], swap["transactionIndex"], swap["logIndex"])
+        assert(last is None or last < curr), f"{dex}: swaps of {poolAddress} are out of order at {curr}"
+        last = curr
+        yield swap
+
+
+def poolSwapsList(dex, poolAddress, swaps):
+    """ The swaps of a pool in the window, read from its data/{dex}_swaps cache when swaps is None. """
+    if (swaps is None):
+        cached = loadPoolSwaps(dex, poolAddress)[0].values()
+        swaps = windowSwaps(sorted(cached, key=lambda x: (x["blockNumber"], x["transactionIndex"], x["logIndex"])))
+    return swaps
+
+
+def spillPoolSwaps(dex, poolAddress, swaps, path):
+    """ Write a pool's tagged swaps to path, one per line, checking their order. """
+    with open(path, 'w') as f:
+        for swap in poolSwapsStream(dex, poolAddress, swaps):
+            f.write(json.dumps(swap) + "\n")
+
+
+def readSpill(path):
+    """ Yield the swaps of a spill file, MERGE_CHUNK lines at a time, the file only open while a chunk is read. """
+    offset = 0
+    while True:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            lines = list(itertools.islice(f, MERGE_CHUNK))
+            offset = f.tell()
+        if (not len(lines)):
+            return
+        for line in lines:
+            yield json.loads(line)
+
+
+def iterSwapsHistory(allSwaps, spillDir):
+    """
+     Merge the ordered swap lists of every pool into one stream of
+     (blockNumber, { transactionIndex : swaps }), in block order. allSwaps
+     is [(dex, swaps)], swaps mapping each pool to its list, or to None to
+     read the pool's cache. Each pool is spilled to spillDir one at a time,
+     then the merge holds MERGE_CHUNK swaps of each pool and the current block.
+    """
+    streams = []
     for dex, swaps in allSwaps:
         for poolAddress in swaps:
-            for swap in swaps[poolAddress]:
-                swap["dex"] = dex
-                swap["poolAddress"] = poolAddress
-                ## Add to dict
-                if (swap["blockNumber"] not in ret):
-                    ret[swap["blockNumber"]] = dict()
-                if (swap["transactionIndex"] not in ret[swap["blockNumber"]]):
-                    ret[swap["blockNumber"]][swap["transactionIndex"]] = []
-                ret[swap["blockNumber"]][swap["transactionIndex"]].append(swap)
-                ret[swap["blockNumber"]][swap["transactionIndex"]].sort(key=lambda x:x["logIndex"])
-    with open(f'data/swap_history.json', 'w') as json_file:
-        json.dump(ret, json_file, indent=4)
-    return ret
+            path = os.path.join(spillDir, f"{len(streams)}.jsonl")
+            spillPoolSwaps(dex, poolAddress, poolSwapsList(dex, poolAddress, swaps[poolAddress]), path)
+            streams.append(readSpill(path))
+    merged = heapq.merge(*streams, key=lambda x: (x["blockNumber"], x["transactionIndex"], x["logIndex"]))
+    for blockNum, blockSwaps in itertools.groupby(merged, key=lambda x: x["blockNumber"]):
+        transactions = dict()
+        for swap in blockSwaps:
+            transactions.setdefault(swap["transactionIndex"], []).append(swap)
+        yield blockNum, transactions
 
 
+def createSwapsHistory(allSwaps):
+    """
+     Write the swap history file and the swap store block by block. In
+     "json" format the text is the same as json.dump(..., indent=4) of the
+     whole history, in "jsonl" format each line is one block's entry.
+     Every address, pool, token and dex gets its id in the intern table
+     here, in block order. Pools given as None are read from their caches,
+     so the lists needn't be in memory, see iterSwapsHistory.
+    """
+    table = getInternTable()
+    writer = SwapStoreWriter()
+    numBlocks, numSwaps = 0, 0
+    lines = SWAP_HISTORY_FORMAT == "jsonl"
+    with atomicOpen(f'data/swap_history.{SWAP_HISTORY_FORMAT}') as json_file, tempfile.TemporaryDirectory(dir="data") as spillDir:
+        json_file.write("" if lines else "{")
+        for blockNum, transactions in iterSwapsHistory(allSwaps, spillDir):
+            for swaps in transactions.values():
+                for swap in swaps:
+                    shareStrings(swap, table)
+            if (lines):
+                json_file.write(json.dumps({ blockNum : transactions }) + "\n")
+            else:
+                ## Indent the block's entry as it would be inside the outer object
+                entry = json.dumps({ blockNum : transactions }, indent=4)[1:-2]
+                json_file.write(("," if numBlocks else "") + entry)
+            writer.appendBlock(blockNum, [swap for swaps in transactions.values() for swap in swaps])
+            numBlocks += 1
+            numSwaps += sum(len(swaps) for swaps in transactions.values())
+        if (not lines):
+            json_file.write("\n}" if numBlocks else "}")
+    writer.close()
+    table.save()
+    print(f"Swap history has {numSwaps} swaps in {numBlocks} blocks, {len(table)} interned names")
+    return numBlocks, numSwaps
+
+
+REDECODE_STATE = dict()             # Set in every --redecode worker process
+
+def initRedecode(cachePath, index):
+    REDECODE_STATE["cachePath"] = cachePath
+    REDECODE_STATE["index"] = index
+
+
+def redecodeEntry(h):
+    """
+     Decode one raw cache entry in a worker process. Returns the pools created
+     and the swaps found in it, keyed by (dex, poolContract), plus the
+     anomalies counted while decoding.
+    """
+    index = REDECODE_STATE["index"]
+    factories = { FACTORY_ADDRESS[dex].lower() : dex for dex in FACTORY_ADDRESS }
+    created, pages = dict(), dict()
+    for log in loadEntry(REDECODE_STATE["cachePath"], h):
+        address = log["address"].lower()
+        if (address in factories and log["topics"][0] == FACTORY_POOLCREATED_EVENT[factories[address]]):
+            created.setdefault(factories[address], []).append(log)
+        elif (address in index and log["topics"][0] == POOL_SWAP_EVENT[index[address][0]]):
+            pages.setdefault(address, []).append(log)
+    pools = { dex : decodeCreatedPools(dex, logs) for dex, logs in created.items() }
+    swaps = dict()
+    for address, logs in pages.items():
+        dex, pool = index[address]
+        swaps[(dex, pool["poolContract"])] = decodeSwaps(dex, pool["token0"], pool["token1"], logs)
+    anomalies = dict(SwapDecoder.ANOMALIES)
+    SwapDecoder.ANOMALIES.clear()
+    return pools, swaps, anomalies
+
+
+def redecodeRawLogs(dexes, workers=None):
+    """
+     Rebuild the pool catalogs and per-pool swap caches from data/raw_logs
+     alone, decoding the entries in parallel worker processes. Ranges already
+     recorded in the manifest stay as they are, every swap found in the raw
+     cache replaces its decoded copy. Returns [(dex, swaps)] like extractData.
+    """
+    cache = getRawLogCache()
+    factories = { FACTORY_ADDRESS[dex].lower() for dex in dexes }
+    entries = list(cache.entries())
+    ## Catalogs first, so the swap entries can be routed to every pool
+    isPoolEntry = lambda x: x["key"]["addresses"] is not None and set(x["key"]["addresses"]) <= factories
+    poolEntries = [x["hash"] for x in entries if isPoolEntry(x)]
+    swapEntries = [x["hash"] for x in entries if not isPoolEntry(x)]
+    print(f"Re-decoding {len(poolEntries)} pool and {len(swapEntries)} swap entries")
+
+    def run(hashes, index):
+        with multiprocessing.Pool(workers, initializer=initRedecode, initargs=(cache.path, index)) as pool:
+            for result in pool.imap_unordered(redecodeEntry, hashes, chunksize=16):
+                SwapDecoder.ANOMALIES.update(result[2])
+                yield result
+
+    catalogs = { dex : loadPoolCatalog(dex) for dex in dexes }
+    for pools, _, _ in run(poolEntries, dict()):
+        for dex, curr in pools.items():
+            if (dex in catalogs):
+                catalogs[dex][0].update(curr)
+    for dex, (allPools, covered) in catalogs.items():
+        if (len(poolEntries)):
+            storePoolCatalog(dex, allPools, covered)
+        getTokensFromPools(dex, list(allPools.values()))
+
+    index = buildPoolIndex([(dex, list(allPools.values())) for dex, (allPools, _) in catalogs.items()])
+    decoded = dict()
+    for _, swaps, _ in run(swapEntries, index):
+        for key, curr in swaps.items():
+            decoded.setdefault(key, dict()).update(curr)
+
+    results = []
+    for dex, (allPools, _) in catalogs.items():
+        os.makedirs(f"data/{dex}_swaps", exist_ok=True)
+        swaps = dict()
+        for poolAddress, pool in allPools.items():
+            current, covered = loadPoolSwaps(dex, poolAddress, pool.get("blockNumber", 0))
+            if ((dex, poolAddress) in decoded):
+                current.update(decoded.pop((dex, poolAddress)))
+                swaps[poolAddress] = storePoolSwaps(dex, poolAddress, current, covered)
+            else:
+                swaps[poolAddress] = windowSwaps(list(current.values()))
+        print(f"{dex}: Re-decoded {len(swaps)} pools")
+        results.append((dex, swaps))
+    getManifest().save()
+    return results
+
 
 def main():
+    global SWAPS_START_BLOCK, SWAPS_END_BLOCK, HISTORY_END_BLOCK
+    parser = argparse.ArgumentParser(description="Extract the swaps of the DEX pools in a block window. "
+                                     "Reruns only fetch the ranges missing from data/manifest.json.")
+    parser.add_argument("--start-block", type=int, default=SWAPS_START_BLOCK)
+    parser.add_argument("--end-block", type=int, default=SWAPS_END_BLOCK)
+    parser.add_argument("--redecode", action="store_true", help="rebuild every decoded cache from data/raw_logs without the network")
+    args = parser.parse_args()
+    SWAPS_START_BLOCK, SWAPS_END_BLOCK = args.start_block, args.end_block
+    HISTORY_END_BLOCK = SWAPS_END_BLOCK
     os.makedirs("data", exist_ok=True)
     dexes = ["uniswapv3", "uniswapv2", "sushiswap"]
     results = []
-    threads = []
-    for i, dex in enumerate(dexes):
-        thread = Thread(target = extractData, args = (dex, i, results, ))
-        thread.start()
-        threads.append(thread)
-    for thread in threads:
-        thread.join()
+    asyncEtherscan = LOG_SOURCE == "etherscan" and EXTRACTION_ENGINE == "async"
+    if (args.redecode):
+        results = redecodeRawLogs(dexes)
+    elif (EXTRACTION_MODE == "topic"):
+        if (asyncEtherscan):
+            dexPools = discoverPoolsAsync(dexes)
+        else:
+            dexPools = []
+            for i, dex in enumerate(dexes):
+                pools = getPools(dex, i % len(MY_API_KEYS))
+                print(f"{dex}: Num Pools is {len(pools)}")
+                tokens = getTokensFromPools(dex, pools)
+                print(f"{dex}: Num Tokens is {len(tokens)}")
+                dexPools.append((dex, pools))
+        results = scanSwapsByTopic(dexPools)
+    elif (asyncEtherscan):
+        ## Swaps of each pool are fetched as soon as the pool is discovered
+        results = extractAllSwapsAsync([], discover=dexes)
+    else:
+        threads = []
+        for i, dex in enumerate(dexes):
+            thread = Thread(target = extractData, args = (dex, i, results, ))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    getManifest().save()
+    printAnomalies()
+    if (LOG_SOURCE == "jsonrpc" and not args.redecode):
+        ## Etherscan has no batched eth_call, run TokenResolver.py against a node instead
+        buildTokenInfo(dexes, JSON_RPC_URL)
+    ## The pools' swaps are read back from their caches, the extracted lists are dropped first
+    results = [(dex, dict.fromkeys(swaps)) for dex, swaps in results]
     createSwapsHistory(results)
 
 if __name__=='__main__':
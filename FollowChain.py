@@ -0,0 +1,208 @@
+
+"""
+ Live follow mode: watch a node for new blocks and look for arbitrages in
+ each one as it arrives.
+
+ For every new block one JSON-RPC batch fetches the Swap logs of all DEXes
+ and the factories' PoolCreated logs. Swaps of catalog pools are decoded and
+ handed to ProcessSwaps.findInBlockArbitrages. Pools created on the way are
+ added to the in-memory catalog. Arbitrages are appended to
+ data/live_arbitrages.jsonl, one JSON object per line in the arbitrages.json
+ shape, as soon as their block is done. A block whose logs can't be fetched
+ after FETCH_ATTEMPTS tries, or whose detection is degraded or fails, is
+ counted and the follower goes on with the next one. Nothing
+ kept per block outlives the block, so memory stays flat however long it runs.
+
+   python FollowChain.py --url http://127.0.0.1:8545
+
+ MockChain.py --block-time 1 serves a chain that grows by one block a second.
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import time
+import traceback
+import ExtractSwaps
+import ProcessSwaps
+from ExtractSwaps import FACTORY_ADDRESS, FACTORY_POOLCREATED_EVENT, POOL_SWAP_EVENT
+from LogSources import JsonRpcLogSource
+from ProcessSwaps import findInBlockArbitrages
+
+
+POLL_INTERVAL = 1.0                 # Seconds between eth_blockNumber polls
+LATENCY_WINDOW = 10000              # Latest blocks the latency percentiles are over
+FETCH_ATTEMPTS = 3                  # Tries at a block's logs before it is counted as failed
+FETCH_BACKOFF = 0.5                 # Seconds, doubled on every retry
+LIVE_ARBITRAGES_PATH = 'data/live_arbitrages.jsonl'
+DEXES = ["uniswapv3", "uniswapv2", "sushiswap"]
+
+
+def loadCatalog(dexes):
+    dexPools = []
+    for dex in dexes:
+        try:
+            with open(f'data/{dex}_pools.json', 'r') as json_file:
+                dexPools.append((dex, json.load(json_file)))
+        except FileNotFoundError:
+            print(f"{dex}: No pool catalog, only pools created from now on are followed")
+            dexPools.append((dex, []))
+    return dexPools
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class ChainFollower:
+    def __init__(self, url, dexes=DEXES, outputPath=LIVE_ARBITRAGES_PATH, confirmations=0, verbose=False):
+        self.source = JsonRpcLogSource(url)
+        self.dexes = dexes
+        self.index = ExtractSwaps.buildPoolIndex(loadCatalog(dexes))
+        self.outputPath = outputPath
+        self.confirmations = confirmations           # Blocks to stay behind the head, to sit out reorgs
+        self.verbose = verbose
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)   # Seconds from seeing each block to its results being written
+        self.numBlocks = 0
+        self.numSwaps = 0
+        self.numArbitrages = 0
+        self.degraded = collections.Counter()        # Why blocks were degraded ("failed" for an error) -> blocks
+
+    def head(self):
+        r = self.source.call([("eth_blockNumber", [])])[0]
+        assert("error" not in r), r
+        return int(r["result"], 16)
+
+    def fetchBlock(self, block):
+        """ The swaps of catalog pools in a block, in the swap_history.json format. """
+        swapTopics = sorted({ POOL_SWAP_EVENT[dex] for dex in self.dexes })
+        queries = [(None, topic0, block, block) for topic0 in swapTopics] + \
+                  [([FACTORY_ADDRESS[dex]], FACTORY_POOLCREATED_EVENT[dex], block, block) for dex in self.dexes]
+        results = self.source.getLogsBatch(queries)
+        assert(all(r is not None for r in results)), f"Block {block} alone is too large for the provider"
+        for dex, logs in zip(self.dexes, results[len(swapTopics):]):
+            for pool in ExtractSwaps.decodeCreatedPools(dex, logs).values():
+                print(f"{dex}: New pool {pool['poolContract']} in block {block}")
+                self.index[pool["poolContract"].lower()] = (dex, pool)
+        pages = dict()
+        for log in [log for logs in results[:len(swapTopics)] for log in logs]:
+            if (log["address"].lower() in self.index):
+                pages.setdefault(log["address"].lower(), []).append(log)
+        swaps = []
+        for address, logs in pages.items():
+            dex, pool = self.index[address]
+            for swap in ExtractSwaps.decodeSwaps(dex, pool["token0"], pool["token1"], logs).values():
+                swap["dex"] = dex
+                swap["poolAddress"] = pool["poolContract"]
+                swaps.append(swap)
+        return swaps
+
+    def fetchBlockRetrying(self, block):
+        """ fetchBlock, tried FETCH_ATTEMPTS times. None if every attempt failed. """
+        for attempt in range(FETCH_ATTEMPTS):
+            try:
+                return self.fetchBlock(block)
+            except Exception:
+                print(f"Block {block}: FAILED fetching swaps, attempt {attempt + 1} of {FETCH_ATTEMPTS}")
+                traceback.print_exc()
+                if (attempt + 1 < FETCH_ATTEMPTS):
+                    time.sleep(FETCH_BACKOFF * 2**attempt)
+        return None
+
+    def processBlock(self, block, seen):
+        start = time.monotonic()
+        swaps = self.fetchBlockRetrying(block)
+        fetched = time.monotonic()
+        degraded = None
+        if (swaps is None):
+            swaps, arbitrages, degraded = [], [], "failed"
+        else:
+            try:
+                with (contextlib.redirect_stdout(io.StringIO()) if not self.verbose else contextlib.nullcontext()):
+                    arbitrages = findInBlockArbitrages(block, swaps) if len(swaps) else []
+            except Exception:
+                print(f"Block {block}: FAILED detecting arbitrages")
+                traceback.print_exc()
+                arbitrages, degraded = [], "failed"
+        ## The batch run's per block records would grow with every block followed
+        metrics = ProcessSwaps.BLOCK_METRICS.pop(block, None)
+        ProcessSwaps.DEGRADED_BLOCKS.pop(block, None)
+        if (metrics is not None):
+            degraded = degraded or metrics["degraded"]
+        if (degraded is not None):
+            self.degraded[degraded] += 1
+        detected = time.monotonic()
+        if (len(arbitrages)):
+            with open(self.outputPath, 'a') as f:
+                for arbitrage in arbitrages:
+                    f.write(json.dumps(arbitrage) + "\n")
+        done = time.monotonic()
+        self.latencies.append(done - seen)
+        self.numBlocks += 1
+        self.numSwaps += len(swaps)
+        self.numArbitrages += len(arbitrages)
+        print(f"Block {block}: {len(swaps)} swaps, {len(arbitrages)} arbitrages, "
+              f"{f'degraded({degraded}), ' if degraded is not None else ''}"
+              f"fetch({1000 * (fetched - start):.0f}ms), detect({1000 * (detected - fetched):.0f}ms), "
+              f"total({1000 * (done - seen):.0f}ms)")
+
+    def follow(self, fromBlock=None, numBlocks=None):
+        """ Process blocks from fromBlock (the current head by default) as they appear, numBlocks of them or forever. """
+        os.makedirs(os.path.dirname(self.outputPath) or ".", exist_ok=True)
+        nextBlock = fromBlock if fromBlock is not None else self.head() - self.confirmations
+        processed = 0
+        try:
+            while numBlocks is None or processed < numBlocks:
+                try:
+                    target = self.head() - self.confirmations
+                except Exception:
+                    print(f"FAILED getting the head, polling again")
+                    traceback.print_exc()
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                seen = time.monotonic()
+                while nextBlock <= target and (numBlocks is None or processed < numBlocks):
+                    ## Blocks found behind the head were already waiting when this poll saw them
+                    self.processBlock(nextBlock, seen)
+                    nextBlock += 1
+                    processed += 1
+                if (nextBlock > target):
+                    time.sleep(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        self.printStats()
+
+    def printStats(self):
+        if (not len(self.latencies)):
+            print(f"No blocks processed")
+            return
+        print(f"Processed {self.numBlocks} blocks, {self.numSwaps} swaps, {self.numArbitrages} arbitrages")
+        if (len(self.degraded)):
+            print(f"Degraded blocks: {', '.join(f'{reason}({count})' for reason, count in sorted(self.degraded.items()))}")
+        print(f"Latency per block over the last {len(self.latencies)}: mean({1000 * sum(self.latencies) / len(self.latencies):.0f}ms), "
+              f"p50({1000 * percentile(self.latencies, 0.5):.0f}ms), p95({1000 * percentile(self.latencies, 0.95):.0f}ms), "
+              f"max({1000 * max(self.latencies):.0f}ms)")
+
+
+def main():
+    global POLL_INTERVAL
+    parser = argparse.ArgumentParser(description="Follow a node and report arbitrages block by block")
+    parser.add_argument("--url", default=ExtractSwaps.JSON_RPC_URL, help="JSON-RPC endpoint")
+    parser.add_argument("--from-block", type=int, default=None, help="first block, the current head by default")
+    parser.add_argument("--blocks", type=int, default=None, help="stop after this many blocks")
+    parser.add_argument("--confirmations", type=int, default=0)
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--output", default=LIVE_ARBITRAGES_PATH)
+    parser.add_argument("--verbose", action="store_true", help="show findInBlockArbitrages' output")
+    args = parser.parse_args()
+    POLL_INTERVAL = args.poll_interval
+    follower = ChainFollower(args.url, outputPath=args.output, confirmations=args.confirmations, verbose=args.verbose)
+    follower.follow(args.from_block, args.blocks)
+
+
+if __name__=='__main__':
+    main()
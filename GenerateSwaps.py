@@ -0,0 +1,235 @@
+
+"""
+ Seeded synthetic swap history, to measure the detector without the real
+ data.
+
+ Tokens get a USD price and decimals, and pools a dex and a token pair. The
+ first HUB_TOKENS tokens, WETH among them, are paired with each other on
+ every dex, like the big tokens of the real chain, and every other token
+ gets pools against hub tokens and against each other. Each block holds:
+   - router transactions: one sender swapping through up to fanout pools,
+     each swap's output the next one's input, at the market price less a fee;
+   - planted arbitrages: cycles of hub tokens that end with more of the start
+     token than they began with, in one transaction or spread over a few
+     transactions of the same sender.
+ Swaps are decoded swaps as SwapDecoder makes them, so createSwapsHistory
+ takes the generator's output like ExtractSwaps' results.
+
+   python GenerateSwaps.py --blocks 1000 --swaps 20 --output /tmp/synthetic
+
+ writes data/swap_history.*, the swap store and intern table, token_info.json,
+ the {dex}_pools.json catalogs and planted_arbitrages.json, the planted cycles'
+ [blockNumber, transactionIndex, logIndex] references, under the output directory.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+
+
+WETH_ADDRESS = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+DEXES = ["uniswapv3", "uniswapv2", "sushiswap"]
+FIRST_BLOCK = 14020000
+HUB_TOKENS = 6                      # Tokens paired with each other on every dex
+FEE = (0.990, 0.997)                # Output over market value of a router swap
+EDGE = (1.001, 1.010)               # Output over market value of a planted swap
+SPLIT_CYCLES = 0.3                  # Planted cycles spread over several transactions of their sender
+MAX_SPLIT_GAP = 3                   # Transactions between the parts of a split cycle, within MAX_CROSS_TRANSACTION
+
+
+def address(rng):
+    return f"0x{rng.getrandbits(160):040x}"
+
+
+class SwapHistoryGenerator:
+    def __init__(self, seed=0, blocks=1000, pools=200, tokens=50, swapsPerBlock=20, fanout=3,
+                 cycleLengths=(2, 3, 4), cyclesPerBlock=0.2, senders=200, fromBlock=FIRST_BLOCK):
+        self.rng = random.Random(seed)
+        self.numBlocks = blocks
+        self.swapsPerBlock = swapsPerBlock
+        self.fanout = fanout
+        self.cycleLengths = [x for x in cycleLengths if 2 <= x <= HUB_TOKENS]
+        self.cyclesPerBlock = cyclesPerBlock
+        self.fromBlock = fromBlock
+        self.tokens = dict()                # address -> { "symbol", "decimals", "USD" }
+        for i in range(max(tokens, HUB_TOKENS)):
+            token = WETH_ADDRESS if i == 0 else address(self.rng)
+            self.tokens[token] = { "symbol" : "WETH" if i == 0 else f"TK{i}",
+                                   "decimals" : 18 if i == 0 else self.rng.choice([6, 8, 18]),
+                                   "USD" : 3000.0 if i == 0 else round(10 ** self.rng.uniform(-3, 3), 6) }
+        self.tokenList = list(self.tokens)
+        self.hubs = self.tokenList[:HUB_TOKENS]
+        self.pools = []                     # (dex, poolAddress, token0, token1)
+        self.pairPools = dict()             # (token, token) -> pools of the pair, both orders
+        for i, tokenA in enumerate(self.hubs):
+            for tokenB in self.hubs[i+1:]:
+                for dex in DEXES:
+                    self.addPool(dex, tokenA, tokenB)
+        while len(self.pools) < pools:
+            tokenA = self.rng.choice(self.hubs) if self.rng.random() < 0.7 else self.rng.choice(self.tokenList)
+            tokenB = self.rng.choice(self.tokenList)
+            if (tokenA != tokenB):
+                self.addPool(self.rng.choice(DEXES), tokenA, tokenB)
+        self.tokenPools = dict()            # token -> pools it is in
+        for pool in self.pools:
+            for token in pool[2:]:
+                self.tokenPools.setdefault(token, []).append(pool)
+        self.senders = [address(self.rng) for _ in range(senders)]
+        self.bots = self.senders[:max(1, senders // 20)]
+        self.planted = []                   # Per planted cycle, its swaps' [blockNumber, transactionIndex, logIndex]
+
+    def addPool(self, dex, tokenA, tokenB):
+        token0, token1 = sorted([tokenA, tokenB])
+        pool = (dex, address(self.rng), token0, token1)
+        self.pools.append(pool)
+        self.pairPools.setdefault((tokenA, tokenB), []).append(pool)
+        self.pairPools.setdefault((tokenB, tokenA), []).append(pool)
+
+    def amount(self, token, usd):
+        """ usd worth of token, in its smallest unit. """
+        info = self.tokens[token]
+        return max(1, int(usd / info["USD"] * 10 ** info["decimals"]))
+
+    def value(self, token, amount):
+        info = self.tokens[token]
+        return amount * info["USD"] / 10 ** info["decimals"]
+
+    def swap(self, pool, tokenIn, amountIn, factor):
+        tokenOut = pool[3] if tokenIn == pool[2] else pool[2]
+        amountOut = self.amount(tokenOut, self.value(tokenIn, amountIn) * factor)
+        ret = { "pool" : pool, "from" : [amountIn, tokenIn], "to" : [amountOut, tokenOut] }
+        if (pool[0] == "uniswapv3"):
+            ret.update({ "sqrtPriceX96" : self.rng.getrandbits(96), "liquidity" : self.rng.getrandbits(80),
+                         "tick" : self.rng.randint(-887272, 887272) })
+        return ret
+
+    def routerTransaction(self):
+        """ A sender's chain of up to fanout swaps, each losing the fee. """
+        token = self.rng.choice(self.tokenList)
+        while token not in self.tokenPools:
+            token = self.rng.choice(self.tokenList)
+        amount = self.amount(token, 10 ** self.rng.uniform(1, 5))
+        legs = []
+        for _ in range(self.rng.randint(1, self.fanout)):
+            leg = self.swap(self.rng.choice(self.tokenPools[token]), token, amount, self.rng.uniform(*FEE))
+            legs.append(leg)
+            amount, token = leg["to"]
+        return self.rng.choice(self.senders), legs
+
+    def plantedTransactions(self):
+        """ A bot's profitable cycle through hub tokens, as the swaps of one or more of its transactions. """
+        length = self.rng.choice(self.cycleLengths)
+        tokens = self.rng.sample(self.hubs, length) if length > 2 else self.rng.sample(self.hubs, 2)
+        start = tokens[0]
+        amount = self.amount(start, 10 ** self.rng.uniform(3, 6))
+        legs, used = [], set()
+        token = start
+        for nextToken in tokens[1:] + [start]:
+            ## A 2-cycle goes out and back through two pools of the same pair
+            pool = self.rng.choice([x for x in self.pairPools[(token, nextToken)] if x not in used])
+            used.add(pool)
+            leg = self.swap(pool, token, amount, self.rng.uniform(*EDGE))
+            legs.append(leg)
+            amount, token = leg["to"]
+        parts = [legs]
+        if (len(legs) > 1 and self.rng.random() < SPLIT_CYCLES):
+            cut = self.rng.randint(1, len(legs) - 1)
+            parts = [legs[:cut], legs[cut:]]
+        return self.rng.choice(self.bots), parts, legs
+
+    def blocks(self):
+        """ Yield (blockNumber, [(pool, swap)]) for each block, the swaps in (transactionIndex, logIndex) order. """
+        for blockNumber in range(self.fromBlock, self.fromBlock + self.numBlocks):
+            ## Each entry is a transaction, as its sender and its legs
+            transactions = []
+            numSwaps = 0
+            while numSwaps < self.swapsPerBlock:
+                sender, legs = self.routerTransaction()
+                transactions.append((sender, legs))
+                numSwaps += len(legs)
+            numCycles = int(self.cyclesPerBlock) + (self.rng.random() < self.cyclesPerBlock % 1)
+            split, cycles = [], []
+            for _ in range(numCycles):
+                sender, parts, legs = self.plantedTransactions()
+                cycles.append(legs)
+                at = self.rng.randint(0, len(transactions))
+                transactions.insert(at, (sender, parts[0]))
+                if (len(parts) > 1):
+                    split.append((sender, parts[0], parts[1]))
+            for sender, first, rest in split:
+                at = next(i for i, (_, legs) in enumerate(transactions) if legs is first)
+                transactions.insert(min(len(transactions), at + self.rng.randint(1, MAX_SPLIT_GAP)), (sender, rest))
+            swaps = []
+            logIndex = 0
+            timeStamp = hex(1642381657 + 13 * (blockNumber - FIRST_BLOCK))
+            for transactionIndex, (sender, legs) in enumerate(transactions):
+                transactionHash = f"0x{self.rng.getrandbits(256):064x}"
+                gasPrice, gasUsed = hex(self.rng.randint(30, 300) * 10 ** 9), hex(self.rng.randint(100000, 400000))
+                for leg in legs:
+                    logIndex += self.rng.randint(1, 3)
+                    swap = { "blockNumber" : blockNumber, "transactionIndex" : transactionIndex, "logIndex" : logIndex,
+                             "transactionHash" : transactionHash, "sender" : sender, "recipient" : sender,
+                             "timeStamp" : timeStamp, "gasPrice" : gasPrice, "gasUsed" : gasUsed,
+                             "from" : leg["from"], "to" : leg["to"] }
+                    swap.update((k, leg[k]) for k in ["sqrtPriceX96", "liquidity", "tick"] if k in leg)
+                    leg["ref"] = [blockNumber, transactionIndex, logIndex]
+                    swaps.append((leg["pool"], swap))
+            self.planted += [[leg["ref"] for leg in legs] for legs in cycles]
+            yield blockNumber, swaps
+
+    def history(self):
+        """ Every swap, as ExtractSwaps' results: [(dex, { poolAddress : [swap] })], each pool's swaps in order. """
+        byPool = { dex : dict() for dex in DEXES }
+        for _, swaps in self.blocks():
+            for (dex, poolAddress, _, _), swap in swaps:
+                byPool[dex].setdefault(poolAddress, []).append(swap)
+        return list(byPool.items())
+
+    def poolCatalogs(self):
+        """ The { dex : [pool] } catalogs in the {dex}_pools.json format. """
+        ret = { dex : [] for dex in DEXES }
+        for dex, poolAddress, token0, token1 in self.pools:
+            ret[dex].append({ "blockNumber" : self.fromBlock - 1, "token0" : token0, "token1" : token1, "poolContract" : poolAddress })
+        return ret
+
+
+def writeDataset(generator):
+    """ Write the generator's swap history and its side files under data/ of the current directory. """
+    import ExtractSwaps
+    os.makedirs("data", exist_ok=True)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        numBlocks, numSwaps = ExtractSwaps.createSwapsHistory(generator.history())
+    with open('data/token_info.json', 'w') as json_file:
+        json.dump(generator.tokens, json_file, indent=4)
+    for dex, pools in generator.poolCatalogs().items():
+        with open(f'data/{dex}_pools.json', 'w') as json_file:
+            json.dump(pools, json_file, indent=4)
+    with open('data/planted_arbitrages.json', 'w') as json_file:
+        json.dump(generator.planted, json_file)
+    return numBlocks, numSwaps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic swap history")
+    parser.add_argument("--output", required=True, help="directory to write data/ in")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--blocks", type=int, default=1000)
+    parser.add_argument("--pools", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--swaps", type=int, default=20, help="router swaps per block")
+    parser.add_argument("--fanout", type=int, default=3, help="most swaps per router transaction")
+    parser.add_argument("--cycle-lengths", default="2,3,4", help="lengths of the planted cycles")
+    parser.add_argument("--cycles", type=float, default=0.2, help="planted cycles per block")
+    args = parser.parse_args()
+    generator = SwapHistoryGenerator(args.seed, args.blocks, args.pools, args.tokens, args.swaps, args.fanout,
+                                     [int(x) for x in args.cycle_lengths.split(",")], args.cycles)
+    os.makedirs(args.output, exist_ok=True)
+    os.chdir(args.output)
+    numBlocks, numSwaps = writeDataset(generator)
+    print(f"Wrote {numSwaps} swaps in {numBlocks} blocks, {len(generator.planted)} planted arbitrages, to {os.path.join(args.output, 'data')}")
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,113 @@
+
+"""
+ Shared interning table: every address, pool, token and DEX name gets a
+ small integer id, the same in every stage and every run.
+
+ Swaps held in memory carry the ids instead of their own copies of the hex
+ strings, so a string is stored once however many swaps mention it, and the
+ comparisons in canExtend and isProfitableArbitrageCycle are integer ones.
+ Ids are turned back into strings only where data leaves the program
+ (arbitrages.json, statistics labels). The table only grows and is saved in
+ data/intern_table.json.
+"""
+
+import json
+import os
+import threading
+from Checkpoints import atomicDumpJson
+
+
+INTERN_TABLE_PATH = 'data/intern_table.json'
+
+## Swap fields holding an internable string, and the [amount, token] legs
+INTERNED_FIELDS = ["sender", "recipient", "dex", "poolAddress"]
+INTERNED_LEGS = ["from", "to"]
+
+
+class InternTable:
+    def __init__(self, path=INTERN_TABLE_PATH):
+        self.path = path
+        try:
+            with open(path, 'r') as json_file:
+                self.values = json.load(json_file)["values"]
+        except FileNotFoundError:
+            self.values = []
+        self.ids = { x : i for i, x in enumerate(self.values) }
+        self.saved = len(self.values)
+
+    def id(self, value):
+        if (value not in self.ids):
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+        return self.ids[value]
+
+    def value(self, id):
+        return self.values[id]
+
+    def __len__(self):
+        return len(self.values)
+
+    def save(self):
+        if (self.saved == len(self.values)):
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        atomicDumpJson(self.path, { "version" : 1, "values" : self.values }, indent=None)
+        self.saved = len(self.values)
+
+
+def internSwap(swap, table):
+    """ Replace the strings of a swap dict with their ids, in place. """
+    for key in INTERNED_FIELDS:
+        if (key in swap):
+            swap[key] = table.id(swap[key])
+    for key in INTERNED_LEGS:
+        if (key in swap):
+            swap[key] = [swap[key][0], table.id(swap[key][1])]
+    return swap
+
+
+def shareStrings(swap, table):
+    """
+     Give a swap dict's strings ids without changing its format: each string
+     is replaced by the table's own copy, so equal strings are one object.
+    """
+    values = table.values
+    for key in INTERNED_FIELDS:
+        if (key in swap):
+            swap[key] = values[table.id(swap[key])]
+    for key in INTERNED_LEGS:
+        if (key in swap):
+            swap[key] = [swap[key][0], values[table.id(swap[key][1])]]
+    return swap
+
+
+def externSwap(swap, table):
+    """ A copy of an interned swap dict with the strings back. """
+    ret = dict(swap)
+    for key in INTERNED_FIELDS:
+        if (key in ret):
+            ret[key] = table.value(ret[key])
+    for key in INTERNED_LEGS:
+        if (key in ret):
+            ret[key] = [ret[key][0], table.value(ret[key][1])]
+    return ret
+
+
+def externArbitrage(arbitrage, table):
+    """ An arbitrage of interned swaps in the arbitrages.json shape. """
+    ret = dict(arbitrage)
+    ret["balance"] = { table.value(token) : amount for token, amount in arbitrage["balance"].items() }
+    ret["cycle"] = [externSwap(swap, table) for swap in arbitrage["cycle"]]
+    return ret
+
+
+TABLES = dict()
+TABLES_LOCK = threading.Lock()
+
+def getInternTable(path=INTERN_TABLE_PATH):
+    """ One shared table per file, like Checkpoints.getManifest. """
+    path = os.path.abspath(path)
+    with TABLES_LOCK:
+        if (path not in TABLES):
+            TABLES[path] = InternTable(path)
+        return TABLES[path]
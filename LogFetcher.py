@@ -0,0 +1,177 @@
+
+"""
+ Asyncio ingestion engine for Etherscan's logs/getLogs endpoint.
+
+ Every (dex, address, block-range) job is put on one shared queue and served
+ by whichever API key has budget left, so a DEX with many pools no longer
+ keeps a single key busy while the others sit idle.
+ Each key has its own token bucket and all requests go through one pooled
+ keep-alive aiohttp session.
+"""
+
+import asyncio
+import collections
+import time
+import traceback
+import aiohttp
+
+
+REQUESTS_PER_SECOND = 5             # Etherscan free tier limit per key
+BURST = 1                           # Requests a key may send back to back
+CONNECTIONS_PER_KEY = 2             # Concurrent requests in flight per key
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5                 # Seconds, doubled on every retry
+REQUEST_TIMEOUT = 60
+
+
+"""
+ A getLogs job. address is None for a topic-wide query, tag is carried
+ untouched to the result callback.
+"""
+LogJob = collections.namedtuple("LogJob", ["dex", "address", "topic0", "fromBlock", "toBlock", "tag"], defaults=[None])
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if (self.tokens >= 1):
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class KeyStatistics:
+    def __init__(self):
+        self.requests = 0                            # Requests sent with this key
+        self.failures = 0                            # Requests that failed and were retried
+        self.logs = 0                                # Logs received
+        self.busy_time = 0                           # Seconds spent waiting on responses
+
+
+class LogFetcher:
+    def __init__(self, apiKeys, apiUrl, rate=REQUESTS_PER_SECOND, connectionsPerKey=CONNECTIONS_PER_KEY,
+                 maxRetries=MAX_RETRIES, cache=None):
+        self.apiKeys = list(apiKeys)
+        self.apiUrl = apiUrl
+        self.cache = cache                           # RawLogCache answering repeated jobs without a request
+        self.rate = rate
+        self.connectionsPerKey = connectionsPerKey
+        self.maxRetries = maxRetries
+        self.stats = { key : KeyStatistics() for key in self.apiKeys }
+        self.failed = []
+        self.elapsed = 0
+
+    def run(self, jobs, onResult):
+        """
+         Fetch every job. onResult(job, logs) is called with the raw log list
+         of each finished job and may return follow-up jobs, which go on the
+         same queue.
+        """
+        start = time.monotonic()
+        asyncio.run(self._run(jobs, onResult))
+        self.elapsed = time.monotonic() - start
+        return self.failed
+
+    async def _run(self, jobs, onResult):
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait((job, 0))
+        connector = aiohttp.TCPConnector(limit=len(self.apiKeys) * self.connectionsPerKey, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            workers = []
+            for key in self.apiKeys:
+                bucket = TokenBucket(self.rate)
+                for _ in range(self.connectionsPerKey):
+                    workers.append(asyncio.create_task(self._worker(session, queue, key, bucket, onResult)))
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self, session, queue, key, bucket, onResult):
+        stats = self.stats[key]
+        while True:
+            job, attempt = await queue.get()
+            try:
+                ## The cache's gzip and disk I/O runs in a thread, not on the event loop
+                logs = await asyncio.to_thread(self._cached, job)
+                if (logs is None):
+                    await bucket.acquire()
+                    start = time.monotonic()
+                    stats.requests += 1
+                    try:
+                        logs = await self._getLogs(session, key, job)
+                    finally:
+                        stats.busy_time += time.monotonic() - start
+                    stats.logs += len(logs)
+                    if (self.cache is not None):
+                        await asyncio.to_thread(self.cache.put, self.apiUrl, self._addresses(job), job.topic0, job.fromBlock, job.toBlock, logs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stats.failures += 1
+                if (attempt + 1 < self.maxRetries):
+                    print(f"{job.dex}: Retrying {job.address} from {job.fromBlock} to {job.toBlock} ({e!r})")
+                    await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+                    queue.put_nowait((job, attempt + 1))
+                else:
+                    print(f"{job.dex}: FAILED getting logs for {job.address} from {job.fromBlock} to {job.toBlock}")
+                    self.failed.append(job)
+            else:
+                try:
+                    newJobs = onResult(job, logs) or []
+                except Exception:
+                    print(f"{job.dex}: FAILED handling logs for {job.address} from {job.fromBlock} to {job.toBlock}")
+                    traceback.print_exc()
+                    self.failed.append(job)
+                    newJobs = []
+                for newJob in newJobs:
+                    queue.put_nowait((newJob, 0))
+            finally:
+                queue.task_done()
+
+    def _addresses(self, job):
+        return [job.address] if job.address is not None else None
+
+    def _cached(self, job):
+        if (self.cache is None):
+            return None
+        return self.cache.get(self.apiUrl, self._addresses(job), job.topic0, job.fromBlock, job.toBlock)
+
+    async def _getLogs(self, session, key, job):
+        params = {
+            "module" : "logs",
+            "action" : "getLogs",
+            "topic0" : job.topic0,
+            "fromBlock" : job.fromBlock,
+            "toBlock" : job.toBlock,
+            "apikey" : key
+        }
+        if (job.address is not None):
+            params["address"] = job.address
+        async with session.get(self.apiUrl, params=params) as response:
+            r = await response.json(content_type=None)
+        assert(r["message"] == "OK" or r["message"] == "No records found"), r
+        return r["result"]
+
+    def printStats(self):
+        total = sum(x.requests for x in self.stats.values())
+        print(f"Sent {total} requests in {self.elapsed:.1f} seconds ({total / max(self.elapsed, 1e-9):.1f} per second)")
+        for i, (key, stats) in enumerate(self.stats.items()):
+            print(f"Key {i}: requests({stats.requests}), failures({stats.failures}), logs({stats.logs}), busy({stats.busy_time:.1f}s)")
+        if (len(self.failed)):
+            print(f"{len(self.failed)} jobs failed after {self.maxRetries} attempts")
+        if (self.cache is not None):
+            self.cache.printStats()
@@ -0,0 +1,177 @@
+
+"""
+ Log sources behind getCreatedPools and getSwapsFromPoolForBlocks.
+
+ A log source answers getLogs(addresses, topic0, fromBlock, toBlock) with raw
+ logs in Etherscan's shape (hex strings for blockNumber, logIndex, timeStamp,
+ gasPrice, gasUsed, ...), so the decoders in ExtractSwaps work on either.
+   - EtherscanLogSource: Etherscan's logs/getLogs, one address per request.
+   - JsonRpcLogSource: a node's eth_getLogs. Hundreds of addresses go into one
+     filter, many filters go into one JSON-RPC batch array, and the fields
+     Etherscan adds to every log are filled from batched block and receipt
+     lookups.
+"""
+
+import abc
+import time
+import requests
+from RangePlanner import GETLOGS_RESULT_CAP
+
+
+ADDRESSES_PER_FILTER = 200
+REQUESTS_PER_BATCH = 500
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5
+RECEIPT_CACHE_SIZE = 100000
+## How providers word a refused eth_getLogs, other errors mentioning a range (an invalid one) aren't split
+TOO_MANY_RESULTS_MESSAGES = ["query returned more than", "block range is too large", "block range too large",
+                             "exceed maximum block range", "response size exceeded", "too many results"]
+
+
+class TooManyResults(Exception):
+    """ The provider refused a query because its result would be too large. """
+    pass
+
+
+class LogSource(abc.ABC):
+    resultCap = None                                 # Max logs per query, None if the provider errors out instead
+    maxAddresses = 1                                 # Addresses accepted by one query
+
+    @abc.abstractmethod
+    def getLogs(self, addresses, topic0, fromBlock, toBlock):
+        """ addresses is a list, or None for a topic-wide query. """
+
+    def getLogsBatch(self, queries):
+        """
+         Run several (addresses, topic0, fromBlock, toBlock) queries. Returns
+         one log list per query, or None where the provider raised TooManyResults.
+        """
+        results = []
+        for query in queries:
+            try:
+                results.append(self.getLogs(*query))
+            except TooManyResults:
+                results.append(None)
+        return results
+
+
+class EtherscanLogSource(LogSource):
+    resultCap = GETLOGS_RESULT_CAP
+    maxAddresses = 1
+
+    def __init__(self, apiKey, apiUrl):
+        self.apiKey = apiKey
+        self.apiUrl = apiUrl
+        self.session = requests.Session()
+        self.requests = 0
+
+    def getLogs(self, addresses, topic0, fromBlock, toBlock):
+        params = {
+            "module" : "logs",
+            "action" : "getLogs",
+            "topic0" : topic0,
+            "fromBlock" : fromBlock,
+            "toBlock" : toBlock,
+            "apikey" : self.apiKey
+        }
+        if (addresses is not None):
+            assert(len(addresses) == 1), addresses
+            params["address"] = addresses[0]
+        self.requests += 1
+        r = self.session.get(self.apiUrl, params = params).json()
+        assert(r["message"] == "OK" or r["message"] == "No records found"), r
+        return r["result"]
+
+
+class JsonRpcLogSource(LogSource):
+    resultCap = None
+    maxAddresses = ADDRESSES_PER_FILTER
+
+    def __init__(self, url, addressesPerFilter=ADDRESSES_PER_FILTER, requestsPerBatch=REQUESTS_PER_BATCH):
+        self.url = url
+        self.maxAddresses = addressesPerFilter
+        self.requestsPerBatch = requestsPerBatch
+        self.session = requests.Session()
+        self.requests = 0
+        self.blockTimes = dict()                     # Map block number to its timestamp
+        self.receipts = dict()                       # Map transaction hash to (gasPrice, gasUsed)
+
+    def call(self, calls):
+        """
+         Send (method, params) calls as JSON-RPC batch arrays of at most
+         requestsPerBatch entries. Returns one result or error dict per call.
+        """
+        results = []
+        for i in range(0, len(calls), self.requestsPerBatch):
+            chunk = calls[i:i+self.requestsPerBatch]
+            payload = [{ "jsonrpc" : "2.0", "id" : j, "method" : method, "params" : params }
+                       for j, (method, params) in enumerate(chunk)]
+            for attempt in range(MAX_RETRIES):
+                try:
+                    self.requests += 1
+                    r = self.session.post(self.url, json = payload)
+                    r.raise_for_status()
+                    r = r.json()
+                    break
+                except Exception:
+                    if (attempt + 1 == MAX_RETRIES):
+                        raise
+                    print(f"Retrying JSON-RPC batch of {len(chunk)} calls")
+                    time.sleep(RETRY_BACKOFF * 2**attempt)
+            if (isinstance(r, dict)):
+                ## Some nodes answer a rejected batch with a single error object
+                r = [dict(r, id=j) for j in range(len(chunk))]
+            byId = { x["id"] : x for x in r }
+            results += [byId[j] for j in range(len(chunk))]
+        return results
+
+    def getLogs(self, addresses, topic0, fromBlock, toBlock):
+        result = self.getLogsBatch([(addresses, topic0, fromBlock, toBlock)])[0]
+        if (result is None):
+            raise TooManyResults(addresses, topic0, fromBlock, toBlock)
+        return result
+
+    def getLogsBatch(self, queries):
+        calls = []
+        for addresses, topic0, fromBlock, toBlock in queries:
+            logFilter = { "topics" : [topic0], "fromBlock" : hex(fromBlock), "toBlock" : hex(toBlock) }
+            if (addresses is not None):
+                assert(len(addresses) <= self.maxAddresses), len(addresses)
+                logFilter["address"] = addresses
+            calls.append(("eth_getLogs", [logFilter]))
+        results = []
+        for query, r in zip(queries, self.call(calls)):
+            if ("error" in r):
+                if (isTooManyResults(r["error"])):
+                    results.append(None)
+                    continue
+                assert(0), (query, r["error"])
+            results.append(r["result"])
+        self.addEtherscanFields([log for logs in results if logs is not None for log in logs])
+        return results
+
+    def addEtherscanFields(self, logs):
+        """ Fill timeStamp, gasPrice and gasUsed the way Etherscan reports them. """
+        if (len(self.receipts) > RECEIPT_CACHE_SIZE):
+            self.receipts.clear()
+        blocks = sorted({ log["blockNumber"] for log in logs } - self.blockTimes.keys())
+        txs = sorted({ log["transactionHash"] for log in logs } - self.receipts.keys())
+        calls = [("eth_getBlockByNumber", [block, False]) for block in blocks] + \
+                [("eth_getTransactionReceipt", [tx]) for tx in txs]
+        results = self.call(calls)
+        for block, r in zip(blocks, results[:len(blocks)]):
+            assert("error" not in r and r["result"]), (block, r)
+            self.blockTimes[block] = r["result"]["timestamp"]
+        for tx, r in zip(txs, results[len(blocks):]):
+            assert("error" not in r and r["result"]), (tx, r)
+            receipt = r["result"]
+            self.receipts[tx] = (receipt.get("effectiveGasPrice", "0x"), receipt["gasUsed"])
+        for log in logs:
+            log["timeStamp"] = self.blockTimes[log["blockNumber"]]
+            log["gasPrice"], log["gasUsed"] = self.receipts[log["transactionHash"]]
+
+
+def isTooManyResults(error):
+    ## -32005 is the common "limit exceeded" code, the message varies between providers
+    message = str(error.get("message", "")).lower()
+    return error.get("code") == -32005 or any(x in message for x in TOO_MANY_RESULTS_MESSAGES)
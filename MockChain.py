@@ -0,0 +1,422 @@
+
+"""
+ Local stand-in for the chain data provider used by ExtractSwaps.
+
+ Serves an in-memory set of raw logs two ways, so the fetchers can be run
+ and benchmarked offline:
+   - GET /api: Etherscan's logs/getLogs, with the same result cap,
+     "No records found" answer and per-key rate limit message.
+   - POST /: a node's JSON-RPC (eth_getLogs with address lists,
+     eth_getBlockByNumber, eth_getTransactionReceipt, eth_blockNumber, and
+     eth_call for ERC20 symbol() and decimals()), single calls or batch arrays.
+
+   python MockChain.py --pools 200 --port 8545
+
+ then point ExtractSwaps.ETHERSCAN_API_URL at http://127.0.0.1:8545/api or
+ ExtractSwaps.JSON_RPC_URL at http://127.0.0.1:8545.
+ python MockChain.py --benchmark compares both ExtractSwaps paths instead.
+"""
+
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import ExtractSwaps
+from ExtractSwaps import FACTORY_ADDRESS, FACTORY_POOLCREATED_EVENT, POOL_SWAP_EVENT
+from TokenResolver import SYMBOL_SELECTOR, DECIMALS_SELECTOR
+
+
+RESULT_CAP = 1000                   # Etherscan returns at most 1000 logs per getLogs call
+RPC_RESULT_CAP = 10000              # Nodes refuse eth_getLogs queries matching more logs
+
+
+def toHex(value):
+    ## Etherscan encodes zero as a bare "0x"
+    return hex(value) if value else "0x"
+
+def fromHex(value):
+    return int(value, 16) if value != "0x" else 0
+
+def word(value):
+    return format(value % 2**256, "064x")
+
+def addressTopic(address):
+    return "0x" + "0" * 24 + address[2:]
+
+def randomAddress(rng):
+    return "0x" + format(rng.getrandbits(160), "040x")
+
+
+class MockChain:
+    def __init__(self, logs, resultCap=RESULT_CAP, rateLimit=None, latency=0.0, rpcResultCap=RPC_RESULT_CAP):
+        self.resultCap = resultCap
+        self.rpcResultCap = rpcResultCap
+        self.rateLimit = rateLimit                   # Requests per second per key, None for unlimited
+        self.latency = latency                       # Seconds added to every response
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.calls = dict()                          # Map key to recent request times
+        self.head = None                             # Latest block the node has, None for all of them
+        self.setLogs(logs)
+
+    def setLogs(self, logs):
+        self.logs = sorted(logs, key=lambda x: (fromHex(x["blockNumber"]), fromHex(x["logIndex"])))
+        self.byTopic = dict()
+        for log in self.logs:
+            for address in [log["address"], None]:
+                self.byTopic.setdefault((address, log["topics"][0]), []).append(log)
+        self.blocks = { key : [fromHex(x["blockNumber"]) for x in value] for key, value in self.byTopic.items() }
+        self.blockTimes = { fromHex(x["blockNumber"]) : x["timeStamp"] for x in self.logs }
+        self.transactions = { x["transactionHash"] : x for x in self.logs }
+
+    def getLogs(self, address, topic0, fromBlock, toBlock):
+        key = (address.lower() if address else None, topic0.lower())
+        logs = self.byTopic.get(key, [])
+        blocks = self.blocks.get(key, [])
+        return logs[bisect.bisect_left(blocks, fromBlock):bisect.bisect_right(blocks, toBlock)]
+
+    def rpcGetLogs(self, logFilter):
+        fromBlock, toBlock = int(logFilter["fromBlock"], 16), int(logFilter["toBlock"], 16)
+        if (self.head is not None):
+            toBlock = min(toBlock, self.head)
+        addresses = logFilter.get("address")
+        if (isinstance(addresses, str)):
+            addresses = [addresses]
+        logs = []
+        for address in (addresses if addresses else [None]):
+            logs += self.getLogs(address, logFilter["topics"][0], fromBlock, toBlock)
+        if (len(logs) > self.rpcResultCap):
+            raise MockRpcError(-32005, f"query returned more than {self.rpcResultCap} results")
+        logs.sort(key=lambda x: (fromHex(x["blockNumber"]), fromHex(x["logIndex"])))
+        return [{
+            "address" : x["address"],
+            "topics" : x["topics"],
+            "data" : x["data"],
+            "blockNumber" : hex(fromHex(x["blockNumber"])),
+            "blockHash" : blockHash(fromHex(x["blockNumber"])),
+            "transactionHash" : x["transactionHash"],
+            "transactionIndex" : hex(fromHex(x["transactionIndex"])),
+            "logIndex" : hex(fromHex(x["logIndex"])),
+            "removed" : False
+        } for x in logs]
+
+    def rpcGetBlockByNumber(self, block, fullTransactions):
+        block = int(block, 16)
+        if (block not in self.blockTimes):
+            return None
+        return { "number" : hex(block), "hash" : blockHash(block), "timestamp" : hex(fromHex(self.blockTimes[block])) }
+
+    def rpcGetTransactionReceipt(self, txHash):
+        if (txHash not in self.transactions):
+            return None
+        x = self.transactions[txHash]
+        return {
+            "transactionHash" : txHash,
+            "blockNumber" : hex(fromHex(x["blockNumber"])),
+            "transactionIndex" : hex(fromHex(x["transactionIndex"])),
+            "gasUsed" : hex(fromHex(x["gasUsed"])),
+            "effectiveGasPrice" : hex(fromHex(x["gasPrice"])),
+            "status" : "0x1"
+        }
+
+    def rpcCall(self, tx, block="latest"):
+        """ ERC20 symbol() and decimals() of any address, see tokenMetadata. """
+        symbol, decimals, encoding = tokenMetadata(tx["to"])
+        if (encoding == "none"):
+            raise MockRpcError(3, "execution reverted")
+        if (tx.get("data", tx.get("input")) == SYMBOL_SELECTOR):
+            raw = symbol.encode()
+            if (encoding == "bytes32"):
+                return "0x" + raw.ljust(32, b"\0").hex()
+            return "0x" + word(32) + word(len(raw)) + raw.ljust((len(raw) + 31) // 32 * 32, b"\0").hex()
+        if (tx.get("data", tx.get("input")) == DECIMALS_SELECTOR):
+            return "0x" + word(decimals)
+        raise MockRpcError(3, "execution reverted")
+
+    def rpc(self, request):
+        with self.lock:
+            self.requests += 1
+        methods = {
+            "eth_getLogs" : self.rpcGetLogs,
+            "eth_getBlockByNumber" : self.rpcGetBlockByNumber,
+            "eth_getTransactionReceipt" : self.rpcGetTransactionReceipt,
+            "eth_call" : self.rpcCall,
+            "eth_blockNumber" : lambda: hex(self.head if self.head is not None else max(self.blockTimes)),
+            "eth_chainId" : lambda: "0x1"
+        }
+        ret = { "jsonrpc" : "2.0", "id" : request.get("id") }
+        try:
+            if (request.get("method") not in methods):
+                raise MockRpcError(-32601, f"the method {request.get('method')} does not exist/is not available")
+            ret["result"] = methods[request["method"]](*request.get("params", []))
+        except MockRpcError as e:
+            ret["error"] = { "code" : e.args[0], "message" : e.args[1] }
+        return ret
+
+    def advanceHead(self, fromBlock, toBlock, blockTime):
+        """ Produce one block every blockTime seconds from fromBlock to toBlock, in a background thread. """
+        def run():
+            for block in range(fromBlock, toBlock + 1):
+                self.head = block
+                time.sleep(blockTime)
+        self.head = fromBlock
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def isRateLimited(self, apiKey):
+        if (self.rateLimit is None):
+            return False
+        with self.lock:
+            now = time.monotonic()
+            recent = [x for x in self.calls.get(apiKey, []) if now - x < 1]
+            limited = len(recent) >= self.rateLimit
+            if (not limited):
+                recent.append(now)
+            self.calls[apiKey] = recent
+            return limited
+
+    def etherscan(self, params):
+        with self.lock:
+            self.requests += 1
+        if (params.get("module") != "logs" or params.get("action") != "getLogs"):
+            return { "status" : "0", "message" : "NOTOK", "result" : "Error! Missing Or invalid Module name" }
+        if (self.isRateLimited(params.get("apikey"))):
+            return { "status" : "0", "message" : "NOTOK", "result" : "Max rate limit reached" }
+        logs = self.getLogs(params.get("address"), params["topic0"], int(params["fromBlock"]), int(params["toBlock"]))
+        logs = logs[:self.resultCap]
+        if (not len(logs)):
+            return { "status" : "0", "message" : "No records found", "result" : [] }
+        return { "status" : "1", "message" : "OK", "result" : logs }
+
+
+class MockRpcError(Exception):
+    pass
+
+
+def tokenMetadata(address):
+    """
+     Made up ERC20 metadata of a mock token: (symbol, decimals, encoding).
+     Most symbols are ABI strings, some are bytes32 like MKR's, and some
+     contracts revert on both calls.
+    """
+    h = int(address[-8:], 16)
+    symbol = "T" + address[2:6].upper()
+    decimals = [18, 6, 8, 0][h % 4]
+    encoding = ["string", "string", "string", "bytes32", "none"][(h // 4) % 5]
+    return symbol, decimals, encoding
+
+
+def blockHash(block):
+    return "0x" + format(block, "064x")
+
+
+class MockChainHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def sendJson(self, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        chain = self.server.chain
+        url = urlparse(self.path)
+        if (url.path != "/api"):
+            self.send_error(404)
+            return
+        params = { key : value[0] for key, value in parse_qs(url.query).items() }
+        if (chain.latency):
+            time.sleep(chain.latency)
+        self.sendJson(chain.etherscan(params))
+
+    def do_POST(self):
+        chain = self.server.chain
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if (chain.latency):
+            time.sleep(chain.latency)
+        if (isinstance(request, list)):
+            self.sendJson([chain.rpc(x) for x in request])
+        else:
+            self.sendJson(chain.rpc(request))
+
+
+def startMockChain(chain, host="127.0.0.1", port=0):
+    """ Serve chain in a background thread. Returns the server and its base url. """
+    server = ThreadingHTTPServer((host, port), MockChainHandler)
+    server.daemon_threads = True
+    server.chain = chain
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def generatePools(rng, dex, numPools, tokens, creationBlock):
+    pools = []
+    logs = []
+    for i in range(numPools):
+        token0, token1 = sorted(rng.sample(tokens, 2))
+        poolContract = randomAddress(rng)
+        if (dex == "uniswapv3"):
+            topics = [FACTORY_POOLCREATED_EVENT[dex], addressTopic(token0), addressTopic(token1), "0x" + word(3000)]
+            data = "0x" + word(60) + word(int(poolContract, 16))
+        else:
+            topics = [FACTORY_POOLCREATED_EVENT[dex], addressTopic(token0), addressTopic(token1)]
+            data = "0x" + word(int(poolContract, 16)) + word(i + 1)
+        block = creationBlock + i
+        logs.append({
+            "address" : FACTORY_ADDRESS[dex].lower(),
+            "topics" : topics,
+            "data" : data,
+            "blockNumber" : toHex(block),
+            "timeStamp" : toHex(1640000000 + 13 * block),
+            "gasPrice" : toHex(50 * 10**9),
+            "gasUsed" : toHex(3000000),
+            "logIndex" : toHex(0),
+            "transactionHash" : "0x" + format(rng.getrandbits(256), "064x"),
+            "transactionIndex" : toHex(0)
+        })
+        pools.append({ "dex" : dex, "poolContract" : poolContract, "token0" : token0, "token1" : token1 })
+    return pools, logs
+
+
+def swapLog(rng, pool, block, txIndex, logIndex, txHash, sender, gasPrice, gasUsed):
+    amountIn = rng.randrange(1, 10**20)
+    amountOut = rng.randrange(1, 10**20)
+    zeroForOne = rng.random() < 0.5
+    if (pool["dex"] == "uniswapv3"):
+        amount0, amount1 = (amountIn, -amountOut) if zeroForOne else (-amountOut, amountIn)
+        data = "0x" + word(amount0) + word(amount1) + word(rng.getrandbits(96)) + word(rng.getrandbits(64)) + word(rng.randrange(-887272, 887272))
+    else:
+        amounts = [amountIn, 0, 0, amountOut] if zeroForOne else [0, amountIn, amountOut, 0]
+        data = "0x" + "".join(word(x) for x in amounts)
+    return {
+        "address" : pool["poolContract"],
+        "topics" : [POOL_SWAP_EVENT[pool["dex"]], addressTopic(sender), addressTopic(randomAddress(rng))],
+        "data" : data,
+        "blockNumber" : toHex(block),
+        "timeStamp" : toHex(1640000000 + 13 * block),
+        "gasPrice" : toHex(gasPrice),
+        "gasUsed" : toHex(gasUsed),
+        "logIndex" : toHex(logIndex),
+        "transactionHash" : txHash,
+        "transactionIndex" : toHex(txIndex)
+    }
+
+
+def generateChain(seed=0, numPools=100, numTokens=50, fromBlock=14020000, toBlock=14020999, swapsPerBlock=10,
+                  dexes=("uniswapv3", "uniswapv2", "sushiswap"), activePools=0.2, foreignPools=5):
+    """
+     Build a reproducible set of PoolCreated and Swap logs. Only a fraction
+     activePools of the pools ever trade, like on mainnet. foreignPools more
+     pools per DEX emit the same Swap events without a PoolCreated log from
+     our factories, like forks do.
+     Returns (pools, logs), pools being the factory catalog.
+    """
+    rng = random.Random(seed)
+    tokens = [randomAddress(rng) for _ in range(numTokens)]
+    pools = []
+    logs = []
+    for i, dex in enumerate(dexes):
+        dexPools, dexLogs = generatePools(rng, dex, numPools, tokens, 10000000 + i * numPools)
+        pools += dexPools
+        logs += dexLogs
+    active = rng.sample(pools, max(1, int(len(pools) * activePools)))
+    for dex in dexes:
+        active += generatePools(rng, dex, foreignPools, tokens, 0)[0]
+    for block in range(fromBlock, toBlock + 1):
+        logIndex = 0
+        for txIndex in range(rng.randrange(1, swapsPerBlock + 1)):
+            txHash = "0x" + format(rng.getrandbits(256), "064x")
+            sender = randomAddress(rng)
+            gasPrice, gasUsed = rng.randrange(10, 200) * 10**9, rng.randrange(100000, 500000)
+            for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                logs.append(swapLog(rng, rng.choice(active), block, txIndex, logIndex, txHash, sender, gasPrice, gasUsed))
+                logIndex += rng.randrange(1, 4)
+    return pools, logs
+
+
+def benchmark(chain, fromBlock, toBlock, sources=("etherscan", "jsonrpc")):
+    """
+     Run ExtractSwaps' pool discovery and swap extraction for every DEX against
+     chain, once per log source, each in a fresh working directory.
+    """
+    server, url = startMockChain(chain)
+    ExtractSwaps.ETHERSCAN_API_URL = url + "/api"
+    ExtractSwaps.JSON_RPC_URL = url
+    ExtractSwaps.SWAPS_START_BLOCK = fromBlock
+    ExtractSwaps.SWAPS_END_BLOCK = toBlock
+    ExtractSwaps.HISTORY_END_BLOCK = toBlock
+    cwd = os.getcwd()
+    swaps = dict()
+    for source in sources:
+        ExtractSwaps.LOG_SOURCE = source
+        ExtractSwaps.LOG_SOURCES.clear()
+        results = []
+        start = time.monotonic()
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            os.makedirs("data")
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    for dex in ["uniswapv3", "uniswapv2", "sushiswap"]:
+                        ExtractSwaps.extractData(dex, 0, results)
+            finally:
+                os.chdir(cwd)
+        elapsed = time.monotonic() - start
+        requests = sum(x.requests for x in ExtractSwaps.LOG_SOURCES.values())
+        swaps[source] = { (dex, pool) : poolSwaps for dex, dexSwaps in results for pool, poolSwaps in dexSwaps.items() }
+        numSwaps = sum(len(x) for x in swaps[source].values())
+        print(f"{source}: {numSwaps} swaps in {len(swaps[source])} pools, {requests} HTTP requests, {elapsed:.2f} seconds")
+    server.shutdown()
+    if (len(swaps) > 1):
+        first, *rest = swaps.values()
+        print(f"Same swaps from every source: {all(x == first for x in rest)}")
+    return swaps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic chain through a local getLogs endpoint")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pools", type=int, default=100, help="pools per DEX")
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--from-block", type=int, default=14020000)
+    parser.add_argument("--to-block", type=int, default=14020999)
+    parser.add_argument("--swaps-per-block", type=int, default=10)
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests per second per key")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--benchmark", action="store_true", help="time ExtractSwaps against each log source and exit")
+    parser.add_argument("--block-time", type=float, default=None, help="reveal one block every this many seconds, for FollowChain")
+    args = parser.parse_args()
+    pools, logs = generateChain(args.seed, args.pools, args.tokens, args.from_block, args.to_block, args.swaps_per_block)
+    chain = MockChain(logs, rateLimit=args.rate_limit, latency=args.latency)
+    if (args.benchmark):
+        benchmark(chain, args.from_block, args.to_block)
+        return
+    if (args.block_time is not None):
+        chain.advanceHead(args.from_block, args.to_block, args.block_time)
+    server, url = startMockChain(chain, port=args.port)
+    print(f"Serving {len(pools)} pools and {len(logs)} logs on {url}/api")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__=='__main__':
+    main()
@@ -1,16 +1,67 @@
 
+import argparse
+import collections
+import contextlib
+import io
 import json
+import logging
+import multiprocessing
+import os
 import pprint
 import itertools
 import functools
+import sys
+import time
+import SwapStore
+from CycleSearch import generateCycles, SearchBudget, BudgetExceeded
+from CoverSearch import bestCover, packRows
+from ArbitrageStream import ArbitrageWriter, ARBITRAGE_STREAM_PATH
+from BlockCache import BlockCache, cachedArbitrages, BLOCK_CACHE_PATH
+from Checkpoints import atomicDumpJson
+from Interning import getInternTable, externArbitrage
 
 
-def loadSwapHistory():
+## "INFO" logs each block and arbitrage, "DEBUG" adds every cycle found and
+## the arbitrages' pprint, "WARNING" only degraded blocks and errors
+LOG_LEVEL = "INFO"
+log = logging.getLogger("ProcessSwaps")
+
+
+class CurrentStdout:
+    """ Writes to whatever sys.stdout is at the time, so redirect_stdout still captures the log. """
+    def write(self, text):
+        return sys.stdout.write(text)
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+def configureLogging(level=None):
+    if (not len(log.handlers)):
+        handler = logging.StreamHandler(CurrentStdout())
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.propagate = False
+    log.setLevel(level or LOG_LEVEL)
+
+configureLogging()
+
+
+def loadSwapHistory(table=None):
+    ## With a table, addresses/tokens/pools are its integer ids and every comparison below is an int compare
     try:
-        with open(f'data/swap_history.json', 'r') as json_file:
-            return json.load(json_file)
+        return SwapStore.loadSwapHistory(table=table)
     except:
-        print(f"Couldn't load Swaps!!")
+        log.error(f"Couldn't load Swaps!!")
+        exit(-1)
+
+
+def streamSwapHistory(table=None):
+    ## Blocks are read as they are processed, so memory holds about one block
+    try:
+        yield from SwapStore.iterSwapHistory(table=table)
+    except (OSError, ValueError):
+        log.error(f"Couldn't load Swaps!!")
         exit(-1)
 
 
@@ -19,6 +70,31 @@ def isCycleClosed(currList):
 
 
 MAX_CROSS_TRANSACTION = 5
+CYCLE_ENGINE = "indexed"            # "indexed" (CycleSearch.generateCycles) or "bruteforce" (generateLegalCycles)
+CANONICAL_CYCLES = True             # Indexed engine only: each cycle once, from its earliest swap, not once per rotation
+INCREMENTAL_BALANCES = True         # Indexed engine only: balances folded by the search as cycles close, not rescored per cycle
+## Indexed engine only: stop extending paths that can't close with a non-negative balance. Off, CycleSearch's
+## benchmark has it slower than the search it saves on all but dense blocks
+PRUNE_CYCLES = False
+
+## Counters and phase times of every block, and their sums, written to the metrics file
+METRICS_PATH = 'data/process_metrics.json'
+METRIC_KEYS = ["swaps", "extendChecks", "searchNodes", "cyclesClosed", "suppressed", "pruned", "profitableCycles",
+               "coverNodes", "coversFound", "arbitrages", "searchSeconds", "scoringSeconds", "coverSeconds", "totalSeconds"]
+BLOCK_STATS = dict.fromkeys(METRIC_KEYS, 0)     # The block being processed
+BLOCK_METRICS = dict()              # blockNum -> its BLOCK_STATS and "degraded"
+TOTAL_METRICS = dict()              # Sums over BLOCK_METRICS and "blocks"
+SLOWEST_BLOCKS = 20                 # Blocks listed by total time in the metrics file
+
+## Per block limits, None for no limit. A block that runs out of one is
+## degraded: searched again for short single-transaction cycles only, with
+## fresh limits, keeping whatever it finds before they run out too.
+BLOCK_CYCLE_BUDGET = 1000000        # Cycles closed
+BLOCK_NODE_BUDGET = 20000000        # Search steps
+BLOCK_TIME_BUDGET = 120             # Seconds, cover search included
+DEGRADED_MAX_CROSS_TRANSACTION = 0  # 0 keeps a degraded block's cycles inside one transaction
+DEGRADED_MAX_LENGTH = 4             # Swaps per cycle in a degraded block
+DEGRADED_BLOCKS = dict()            # blockNum -> the budget it ran out of ("cycles", "nodes", "seconds" or "cover"), or "nocover"
 ADDRESSES_KEYS = ["sender", "recipient"]
 ADDRESSES_KEYS_AND_POOL = ["sender", "recipient", "poolAddress"]
 
@@ -30,20 +106,24 @@ def canExtend(swapL, swapR):
            (swapR["transactionIndex"] <= (swapL["transactionIndex"] + MAX_CROSS_TRANSACTION)) and \
            ((swapL["sender"] == swapR["sender"]) if swapL["transactionIndex"] != swapR["transactionIndex"] else True)
 
-def generateLegalCycles(swapsList, currList):
+def generateLegalCycles(swapsList, currList, budget=None):
     # print(len(currList))
+    if (budget is not None):
+        ## Every step is charged, a wide block can go a long way without closing a cycle
+        budget.node()
     if (len(currList) == 0):
         # If current list empty, try start from each swap
         for i, swap in enumerate(swapsList):
-            yield from generateLegalCycles([x for j,x in enumerate(swapsList) if j!=i], [swap])
+            yield from generateLegalCycles([x for j,x in enumerate(swapsList) if j!=i], [swap], budget)
     else:
         # If already a cycle - return it
         if (isCycleClosed(currList)):
             yield currList[:]
         # Try to extend it with swaps from the list
+        BLOCK_STATS["extendChecks"] += len(swapsList)
         for i, swap in enumerate(swapsList):
             if (canExtend(currList[-1], swap)):
-                yield from generateLegalCycles([x for j,x in enumerate(swapsList) if j!=i], currList + [swap])
+                yield from generateLegalCycles([x for j,x in enumerate(swapsList) if j!=i], currList + [swap], budget)
 
 
 def consolidateBalances(b0, b1):
@@ -61,8 +141,29 @@ def isProfitableArbitrageCycle(cycle):
 
 
 
+COVER_ENGINE = "branchandbound"     # "branchandbound" (CoverSearch.bestCover) or "exhaustive" (every cover from solve())
+COVER_NODE_BUDGET = 1000000         # Search nodes per block before settling for the best cover so far, None for no limit
+COVER_TIME_BUDGET = None            # Seconds per block, likewise
+
+WORKERS = 1                         # Processes for extractArbitrages, 1 runs in this process, 0 one per core
+PARALLEL_WINDOW = 2000              # Blocks read ahead and scheduled together when running in parallel
+CHUNKS_PER_WORKER = 4               # Chunks each window is cut into, per worker
+## The settings workers need, passed explicitly so any start method gets them
+WORKER_SETTINGS = ["LOG_LEVEL", "MAX_CROSS_TRANSACTION", "CYCLE_ENGINE", "CANONICAL_CYCLES", "INCREMENTAL_BALANCES", "PRUNE_CYCLES", "COVER_ENGINE", "COVER_NODE_BUDGET", "COVER_TIME_BUDGET",
+                   "BLOCK_CYCLE_BUDGET", "BLOCK_NODE_BUDGET", "BLOCK_TIME_BUDGET", "DEGRADED_MAX_CROSS_TRANSACTION", "DEGRADED_MAX_LENGTH"]
+
 TRANSACTION_MULTIPLIER = 1000
 LOG_MULTIPLIER = 1
+
+DETECTOR_VERSION = 1                # Bump when a change to the search or the reduction changes their results
+BLOCK_CACHE = True                  # Serve blocks whose swaps and parameters are unchanged from BLOCK_CACHE_PATH
+
+def detectorParameters():
+    """ Everything a block's results depend on besides its swaps, the block cache's key. """
+    ret = { k : globals()[k] for k in WORKER_SETTINGS if k != "LOG_LEVEL" }
+    ret.update({ "TRANSACTION_MULTIPLIER" : TRANSACTION_MULTIPLIER, "LOG_MULTIPLIER" : LOG_MULTIPLIER, "DETECTOR_VERSION" : DETECTOR_VERSION })
+    return ret
+
 def realTimeOrderQuantity(swap):
     return swap["transactionIndex"] * TRANSACTION_MULTIPLIER + swap["logIndex"] * LOG_MULTIPLIER
 
@@ -110,8 +211,12 @@ def closenessMeasure(cycle):
  We want to try and reduce duplicates as much as possible.
  We first favor order: longer is better.
  Then we try to get real-time order.
+ Also returns whether no swap is in two of them, and why the reduction is
+ degraded: None, "cover" when the cover search ran out of budget, or
+ "nocover" when the block has no exact cover and disjoint arbitrages are kept
+ where it has none.
 """
-def reduceArbitrages(arbitrages):
+def reduceArbitrages(arbitrages, seconds=None, partial=False):
 
     allSwaps = set() 
     Y = dict()
@@ -129,23 +234,80 @@ def reduceArbitrages(arbitrages):
     ## pprint.pprint(X)
     ## pprint.pprint(Y)
 
-    covers = [cover for cover in solve(X, Y)]
-    if (not len(covers)):
-        print(f"Couldn't find a cover!!")
-        pprint.pprint(allSwaps)
-        pprint.pprint(X)
-        pprint.pprint(Y)
-        pprint.pprint(arbitrages)
-        exit(-1)
+    rows = [set(Y[i]) for i in range(len(arbitrages))]
+    weights = [closenessMeasure(arbitrage) for arbitrage, _ in arbitrages]
+    if (COVER_ENGINE == "branchandbound"):
+        ## Whichever is shorter, the cover's own limit or what's left of the block's
+        limits = [x for x in [COVER_TIME_BUDGET, seconds] if x is not None]
+        cover, complete, unsolved = bestCover(rows, weights, COVER_NODE_BUDGET, min(limits) if len(limits) else None, BLOCK_STATS)
+        if (not complete):
+            log.warning(f"Cover search ran out of budget, using the best cover found")
     else:
-        maximal = max(covers, key=lambda cover : (len(cover), 
-            sum(closenessMeasure(arbitrage) for i, (arbitrage,_) in enumerate(arbitrages) if i in cover)))
-        retArbitrages = [arbitrage for i, arbitrage in enumerate(arbitrages) if i in maximal]
-        sumSwaps = sum(len(s[0]) for s in retArbitrages)
-        swapIds = len({swapId(x) for s in retArbitrages for x in s[0]})
-        pure = swapIds == sumSwaps
-        return [(x[0], x[1], list({s["transactionIndex"] for s in x[0]})) for x in retArbitrages], pure
-
+        covers = [cover for cover in solve(X, Y)]
+        BLOCK_STATS["coversFound"] += len(covers)
+        complete = True
+        if (len(covers)):
+            cover, unsolved = max(covers, key=lambda cover : (len(cover), sum(weights[i] for i in cover))), []
+        else:
+            cover, unsolved = [], list(range(len(arbitrages)))
+    outcome = None if complete else "cover"
+    if (len(unsolved)):
+        ## A degraded block only has some of its cycles, an exact cover is often missing then,
+        ## and a cover search out of budget leaves the components it didn't get to without one.
+        ## Otherwise the block has none, which degrades it rather than stopping the run
+        if (complete and not partial):
+            outcome = "nocover"
+            log.warning(f"Couldn't find a cover!!")
+            if (log.isEnabledFor(logging.DEBUG)):
+                for x in [allSwaps, X, Y, arbitrages]:
+                    log.debug(pprint.pformat(x))
+        packed = packRows(rows, weights, unsolved)
+        cover = sorted(cover + packed)
+        log.warning(f"No exact cover{'' if complete else ' within the budget'} for {len(unsolved)} arbitrages, keeping {len(packed)} non-overlapping ones")
+    maximal = set(cover)
+    retArbitrages = [arbitrage for i, arbitrage in enumerate(arbitrages) if i in maximal]
+    sumSwaps = sum(len(s[0]) for s in retArbitrages)
+    swapIds = len({swapId(x) for s in retArbitrages for x in s[0]})
+    pure = swapIds == sumSwaps
+    return [(x[0], x[1], list({s["transactionIndex"] for s in x[0]})) for x in retArbitrages], pure, outcome
+
+
+
+def findElementaryArbitrages(blockSwapsList, arbitrages, budget, degraded=False):
+    """ Append the profitable cycles of a sorted block to arbitrages, as (cycle, balance). Raises BudgetExceeded. """
+    indexed = degraded or CYCLE_ENGINE == "indexed"
+    scored = indexed and INCREMENTAL_BALANCES
+    if (indexed):
+        maxCross, maxLength = (DEGRADED_MAX_CROSS_TRANSACTION, DEGRADED_MAX_LENGTH) if degraded else (MAX_CROSS_TRANSACTION, None)
+        cycles = generateCycles(blockSwapsList, maxCross, CANONICAL_CYCLES, BLOCK_STATS, budget, maxLength,
+                                balances=scored, prune=PRUNE_CYCLES)
+    else:
+        cycles = generateLegalCycles(blockSwapsList, [], budget)
+    debug = log.isEnabledFor(logging.DEBUG)
+    start = time.perf_counter()
+    scoring = 0.0
+    try:
+        for cycle in cycles:
+            if (not indexed):
+                budget.cycle()
+            if (scored):
+                ## The search's balance, already in the arbitrages.json shape
+                cycle, b = cycle
+            else:
+                scoreStart = time.perf_counter()
+                b = isProfitableArbitrageCycle(cycle)
+                scoring += time.perf_counter() - scoreStart
+            if (debug):
+                log.debug(f"Found cycle with {len(cycle)} swaps")
+            if (b):
+                if (debug):
+                    log.debug(f"Found elementary arbitrage cycle with {len(cycle)} swaps!")
+                arbitrages.append((cycle, b))
+    finally:
+        BLOCK_STATS["searchSeconds"] += time.perf_counter() - start - scoring
+        BLOCK_STATS["scoringSeconds"] += scoring
+        BLOCK_STATS["searchNodes"] += budget.numNodes
+        BLOCK_STATS["cyclesClosed"] += budget.numCycles
 
 
 def findInBlockArbitrages(blockNum, blockSwapsList):
@@ -165,69 +327,282 @@ def findInBlockArbitrages(blockNum, blockSwapsList):
           We will check if it produced an arbitrage. Meaning the net balance of doing the swaps actually
           produced non-negative values on all tokens. If yes, we return it as a possible arbitrage.
     """
+    start = time.perf_counter()
+    BLOCK_STATS.update(dict.fromkeys(METRIC_KEYS, 0))
+    BLOCK_STATS["swaps"] = len(blockSwapsList)
     ret = []
-    print(f"Started in block {blockNum} with {len(blockSwapsList)} swaps")
+    log.info(f"Started in block {blockNum} with {len(blockSwapsList)} swaps")
     arbitrages = []
-    for cycle in generateLegalCycles(blockSwapsList, []):
-        print(f"Found cycle with {len(cycle)} swaps")
-        b = isProfitableArbitrageCycle(cycle)
-        if (b):
-            print(f"Found elementary arbitrage cycle with {len(cycle)} swaps!")
-            arbitrages.append((cycle, b))
+    degraded = None
+    budget = SearchBudget(BLOCK_CYCLE_BUDGET, BLOCK_NODE_BUDGET, BLOCK_TIME_BUDGET)
+    try:
+        findElementaryArbitrages(blockSwapsList, arbitrages, budget)
+    except BudgetExceeded as e:
+        degraded = e.budget
+        log.warning(f"Block {blockNum} ran out of its {degraded} budget, looking only for cycles of up to "
+                    f"{DEGRADED_MAX_LENGTH} swaps, at most {DEGRADED_MAX_CROSS_TRANSACTION} transactions apart")
+        arbitrages = []
+        budget = SearchBudget(BLOCK_CYCLE_BUDGET, BLOCK_NODE_BUDGET, BLOCK_TIME_BUDGET)
+        try:
+            findElementaryArbitrages(blockSwapsList, arbitrages, budget, degraded=True)
+        except BudgetExceeded as e:
+            log.warning(f"Block {blockNum} ran out of its {e.budget} budget again, keeping the {len(arbitrages)} elementary arbitrages found")
+    BLOCK_STATS["profitableCycles"] = len(arbitrages)
+    if (BLOCK_STATS["suppressed"]):
+        log.info(f"Block {blockNum} had {BLOCK_STATS['suppressed']} rotated duplicate cycles")
     if (len(arbitrages)):
         ## Reduce duplicates
-        print(f"Block {blockNum} has {len(arbitrages)} elementary arbitrages")
-        reducedArbitrages, pure = reduceArbitrages(arbitrages)
-        print(f"Block {blockNum} has {len(reducedArbitrages)} reduced arbitrages")
+        log.info(f"Block {blockNum} has {len(arbitrages)} elementary arbitrages")
+        coverStart = time.perf_counter()
+        reducedArbitrages, pure, outcome = reduceArbitrages(arbitrages, budget.remaining(), partial=degraded is not None)
+        BLOCK_STATS["coverSeconds"] = time.perf_counter() - coverStart
+        log.info(f"Block {blockNum} has {len(reducedArbitrages)} reduced arbitrages")
         if (not pure):
-            print(f"Reduction isn't pure")
+            log.warning(f"Reduction isn't pure")
+        if (outcome is not None):
+            degraded = degraded or outcome
         for cycle, balance, transactions in reducedArbitrages:
-            print(f"Found arbitrage in block {blockNum} with: #swaps({len(cycle)}), #transactions({len(transactions)}), multiTransaction({len(transactions) > 1})")
-            pprint.pprint(transactions)
-            pprint.pprint(balance)
-            pprint.pprint(cycle)
+            log.info(f"Found arbitrage in block {blockNum} with: #swaps({len(cycle)}), #transactions({len(transactions)}), multiTransaction({len(transactions) > 1})")
+            if (log.isEnabledFor(logging.DEBUG)):
+                for x in [transactions, balance, cycle]:
+                    log.debug(pprint.pformat(x))
             ret.append({"transactions" : transactions, "balance" : balance, "cycle" : cycle})
+    if (degraded is not None):
+        for arbitrage in ret:
+            arbitrage["degraded"] = degraded
+    BLOCK_STATS["arbitrages"] = len(ret)
+    BLOCK_STATS["totalSeconds"] = time.perf_counter() - start
+    recordBlockMetrics(blockNum, dict(BLOCK_STATS, degraded=degraded))
     return ret
 
 
-def extractArbitrages(swaps):
-    print(f"Started Processing")
-    arbitrages = []
-    numBlocks = len(swaps)
-    numTransactions = 0
+def recordBlockMetrics(blockNum, metrics):
+    BLOCK_METRICS[blockNum] = metrics
+    if (metrics["degraded"] is not None):
+        DEGRADED_BLOCKS[blockNum] = metrics["degraded"]
+    TOTAL_METRICS["blocks"] = TOTAL_METRICS.get("blocks", 0) + 1
+    TOTAL_METRICS["cached"] = TOTAL_METRICS.get("cached", 0) + metrics.get("cached", False)
+    for key in METRIC_KEYS:
+        TOTAL_METRICS[key] = TOTAL_METRICS.get(key, 0) + metrics[key]
+
+
+def extractBlockArbitrages(blockNum, transactions, cached=None):
+    """
+     One block of extractArbitrages. Returns its arbitrages and its number of
+     swaps. cached is the block's BlockCache entry, if it has one.
+    """
+    blockSwaps = []
+    log.info(f"Block {blockNum} has {len(transactions)} transactions")
+    for txNum, swapsList in transactions.items():
+        blockSwaps += swapsList
+        log.debug(f"Transaction {txNum} of block {blockNum} has {len(swapsList)} swaps")
+    log.info(f"Block {blockNum} has {len(blockSwaps)} swaps")
+    if (cached is not None):
+        log.info(f"Block {blockNum} is unchanged, {len(cached['arbitrages'])} arbitrages from the block cache")
+        ## Its counters still describe the block, no time was spent on it this run
+        recordBlockMetrics(blockNum, dict(cached["metrics"], cached=True, **{ k : 0 for k in METRIC_KEYS if k.endswith("Seconds") }))
+        return cachedArbitrages(cached, blockSwaps), len(blockSwaps)
+    return findInBlockArbitrages(blockNum, blockSwaps), len(blockSwaps)
+
+
+def initWorker(settings):
+    globals().update(settings)
+    configureLogging()
+
+
+def extractChunk(chunk):
+    """
+     Run a chunk of blocks in a worker process. Each block's output is kept
+     for the parent to print in block order.
+    """
+    start = time.perf_counter()
+    ret = []
+    for blockNum, transactions, cached in chunk:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            arbitrages, numSwaps = extractBlockArbitrages(blockNum, transactions, cached)
+        ret.append((blockNum, arbitrages, numSwaps, output.getvalue(), BLOCK_METRICS.pop(blockNum, None)))
+    return os.getpid(), time.perf_counter() - start, ret
+
+
+def blockCost(transactions, cached=None):
+    ## The cycle search grows faster than the number of swaps, a cached block needs none
+    return max(1, sum(len(x) for x in transactions.values())) ** 2 if cached is None else 1
+
+def scheduleChunks(blocks, numChunks):
+    """
+     Longest processing time first: the blocks by estimated cost, largest
+     first, packed into chunks of about equal cost. Big blocks end up alone
+     in the first chunks and small ones share the last.
+    """
+    costs = { blockNum : blockCost(transactions, cached) for blockNum, transactions, cached in blocks }
+    target = sum(costs.values()) / numChunks
+    chunks, curr, currCost = [], [], 0
+    for block in sorted(blocks, key=lambda x : costs[x[0]], reverse=True):
+        curr.append(block)
+        currCost += costs[block[0]]
+        if (currCost >= target):
+            chunks.append(curr)
+            curr, currCost = [], 0
+    if (len(curr)):
+        chunks.append(curr)
+    return chunks
+
+
+def parallelBlockArbitrages(blocks, workers):
+    """
+     Yield (arbitrages, numSwaps) of each (blockNum, transactions, cached) of
+     blocks, in their order, running the blocks in a process pool a window at a time.
+    """
+    workerStats = dict()            # pid -> [blocks, swaps, seconds]
+    settings = { k : globals()[k] for k in WORKER_SETTINGS }
+    ## configureLogging(level) only sets the parent's logger, the workers log at its level
+    settings["LOG_LEVEL"] = logging.getLevelName(log.getEffectiveLevel())
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=(settings,)) as pool:
+        while True:
+            window = list(itertools.islice(blocks, PARALLEL_WINDOW))
+            if (not len(window)):
+                break
+            results = dict()
+            for pid, elapsed, chunkResults in pool.imap_unordered(extractChunk, scheduleChunks(window, workers * CHUNKS_PER_WORKER)):
+                curr = workerStats.setdefault(pid, [0, 0, 0.0])
+                curr[0] += len(chunkResults)
+                curr[1] += sum(x[2] for x in chunkResults)
+                curr[2] += elapsed
+                for result in chunkResults:
+                    results[result[0]] = result
+            for blockNum, _, _ in window:
+                _, arbitrages, numSwaps, output, metrics = results.pop(blockNum)
+                sys.stdout.write(output)
+                recordBlockMetrics(blockNum, metrics)
+                yield arbitrages, numSwaps
+    for i, (pid, (numBlocks, numSwaps, seconds)) in enumerate(sorted(workerStats.items())):
+        log.info(f"Worker {i} (pid {pid}): {numBlocks} blocks, {numSwaps} swaps in {seconds:.1f}s, "
+                 f"{numSwaps / max(seconds, 1e-9):.0f} swaps per second")
+
+
+def cacheLookups(blocks, cache, pending):
+    """ blocks with each one's cache entry, None on a miss. The keys to store, None for hits, are queued in pending. """
+    for blockNum, transactions in blocks:
+        entry = None
+        if (cache is not None):
+            key = cache.key([swap for swapsList in transactions.values() for swap in swapsList])
+            entry = cache.get(key)
+            pending.append((blockNum, key if entry is None else None))
+        yield blockNum, transactions, entry
+
+
+def extractArbitrages(swaps, workers=None, writer=None, cache=None):
+    """
+     swaps is a block -> transactions mapping or an iterable of (blockNum, transactions), consumed as it goes.
+     Each block's arbitrages are handed to writer, an ArbitrageWriter, as soon as the block is done.
+     With a BlockCache, unchanged blocks are taken from it and the others added to it as they are done.
+     Returns the arbitrages, or with a writer only their number, so a streamed run keeps none of them.
+    """
+    workers = WORKERS if workers is None else workers
+    workers = workers or os.cpu_count()
+    log.info(f"Started Processing")
+    arbitrages = [] if writer is None else None
+    numArbitrages = 0
     numSwaps = 0
-    print(f"Has {numBlocks} blocks")
-    for blockNum, transactions in swaps.items():
-        currNumTransactions = len(transactions)
-        numTransactions += currNumTransactions
-        blockSwaps = []
-        print(f"Block {blockNum} has {currNumTransactions} transactions")
-        for txNum, swapsList in transactions.items():
-            blockSwaps += swapsList
-            currNumSwaps = len(swapsList)
-            numSwaps += currNumSwaps
-            print(f"Transaction {txNum} of block {blockNum} has {currNumSwaps} swaps")
-        print(f"Block {blockNum} has {len(blockSwaps)} swaps")
-        arbitrages.extend(findInBlockArbitrages(blockNum, blockSwaps))
-    print(f"There are {numSwaps} swaps in total")
-    return arbitrages
-
-
-def dumpArbitrages(arb):
+    if (hasattr(swaps, "items")):
+        log.info(f"Has {len(swaps)} blocks")
+        blocks = iter(swaps.items())
+    else:
+        blocks = iter(swaps)
+    if (writer is not None):
+        ## The stream's records from the run's first block on are replaced, the earlier ones kept
+        first = next(blocks, None)
+        if (first is not None):
+            writer.truncate(int(first[0]))
+            blocks = itertools.chain([first], blocks)
+    pending = collections.deque()
+    blocks = cacheLookups(blocks, cache, pending)
+    if (workers == 1):
+        results = (extractBlockArbitrages(*block) for block in blocks)
+    else:
+        results = parallelBlockArbitrages(blocks, workers)
+    for blockArbitrages, blockSwaps in results:
+        if (cache is not None):
+            blockNum, key = pending.popleft()
+            ## Results cut short by a time limit could come out better on another run
+            if (key is not None and BLOCK_METRICS[blockNum]["degraded"] not in ["seconds", "cover"]):
+                cache.put(key, blockNum, blockArbitrages, BLOCK_METRICS[blockNum])
+        if (writer is None):
+            arbitrages.extend(blockArbitrages)
+        elif (len(blockArbitrages)):
+            writer.write(blockArbitrages)
+        numArbitrages += len(blockArbitrages)
+        numSwaps += blockSwaps
+    log.info(f"There are {numSwaps} swaps in total")
+    if (cache is not None):
+        log.info(f"Block cache: {cache.hits} blocks unchanged, {cache.misses} searched")
+    if (TOTAL_METRICS.get("suppressed", 0)):
+        log.info(f"Suppressed {TOTAL_METRICS['suppressed']} rotated duplicate cycles in total")
+    printDegradedBlocks()
+    return arbitrages if writer is None else numArbitrages
+
+
+def printDegradedBlocks():
+    if (not len(DEGRADED_BLOCKS)):
+        return
+    byBudget = dict()
+    for blockNum, budget in DEGRADED_BLOCKS.items():
+        byBudget.setdefault(budget, []).append(blockNum)
+    log.warning(f"{len(DEGRADED_BLOCKS)} blocks were degraded:")
+    for budget, blocks in sorted(byBudget.items()):
+        log.warning(f"  {budget}: {len(blocks)} blocks, {', '.join(str(x) for x in blocks[:20])}{', ...' if len(blocks) > 20 else ''}")
+
+
+## "jsonl" streams the arbitrages to data/arbitrages.jsonl as blocks are done,
+## see ArbitrageStream. "json" writes the whole data/arbitrages.json at the end.
+ARBITRAGE_OUTPUT = "jsonl"
+
+
+def dumpMetrics(path=METRICS_PATH):
+    """ Per block counters and phase times, their totals, and the slowest blocks. """
+    slowest = sorted(BLOCK_METRICS, key=lambda x : BLOCK_METRICS[x]["totalSeconds"], reverse=True)[:SLOWEST_BLOCKS]
+    atomicDumpJson(path, { "total" : TOTAL_METRICS, "slowest" : [str(x) for x in slowest],
+                           "blocks" : { str(k) : v for k, v in BLOCK_METRICS.items() } })
+    log.info(f"Wrote the metrics of {len(BLOCK_METRICS)} blocks to {path}")
+
+
+def dumpArbitrages(arb, table=None):
+    if (table is not None):
+        arb = [externArbitrage(x, table) for x in arb]
     try:
         with open(f'data/arbitrages.json', 'w') as json_file:
             json.dump(arb, json_file, indent=4)
     except:
-        print(f"Couldn't dump arbitrages!!")
+        log.error(f"Couldn't dump arbitrages!!")
         exit(-1)
 
 
 def main():
-    print(f"Loading Swaps")
-    swaps = loadSwapHistory()
-    arbitrages = extractArbitrages(swaps)
-    print(f"There are {len(arbitrages)} arbitrages in total")
-    dumpArbitrages(arbitrages)
+    global LOG_LEVEL
+    parser = argparse.ArgumentParser(description="Find the arbitrages of the swap history")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="processes to spread the blocks over, 0 for one per core")
+    parser.add_argument("--log-level", default=LOG_LEVEL, choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--metrics", default=METRICS_PATH, help="where to write the per block metrics")
+    parser.add_argument("--output-format", default=ARBITRAGE_OUTPUT, choices=["jsonl", "json"])
+    parser.add_argument("--no-block-cache", action="store_true", help="search every block again, ignoring and not updating the block cache")
+    args = parser.parse_args()
+    LOG_LEVEL = args.log_level
+    configureLogging()
+    log.info(f"Loading Swaps")
+    table = getInternTable()
+    swaps = streamSwapHistory(table)
+    cache = BlockCache(detectorParameters(), BLOCK_CACHE_PATH, table) if BLOCK_CACHE and not args.no_block_cache else None
+    if (args.output_format == "jsonl"):
+        with ArbitrageWriter(ARBITRAGE_STREAM_PATH, table) as writer:
+            numArbitrages = extractArbitrages(swaps, args.workers, writer, cache)
+    else:
+        arbitrages = extractArbitrages(swaps, args.workers, cache=cache)
+        dumpArbitrages(arbitrages, table)
+        numArbitrages = len(arbitrages)
+    log.info(f"There are {numArbitrages} arbitrages in total")
+    dumpMetrics(args.metrics)
+    table.save()
 
 
 if __name__=='__main__':
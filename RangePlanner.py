@@ -0,0 +1,124 @@
+
+"""
+ Block range planning for getLogs queries whose result is capped.
+
+ A query that comes back with fewer than resultCap logs covers its whole
+ range, so there is no extra request to detect the end. A full one covers
+ every block below its last returned block. The rest of its range is split
+ into disjoint pieces that can be requested at the same time: at least two,
+ more when the density seen so far says halves would come back full again.
+ Pieces that still come back full are split the same way. Ranges that are
+ already covered are never requested.
+
+ Ranges are inclusive [fromBlock, toBlock] pairs, like getLogs.
+"""
+
+import math
+
+
+GETLOGS_RESULT_CAP = 1000           # Etherscan returns at most 1000 logs per getLogs call
+SPLIT_FILL = 0.75                   # Aim sub-ranges at this fraction of the cap
+MAX_SPLIT = 16
+
+
+def addRange(ranges, fromBlock, toBlock):
+    """ Add [fromBlock, toBlock] to a sorted list of disjoint ranges, merging neighbours. """
+    merged = []
+    for curr in sorted(ranges + [[fromBlock, toBlock]]):
+        if (len(merged) and curr[0] <= merged[-1][1] + 1):
+            merged[-1][1] = max(merged[-1][1], curr[1])
+        else:
+            merged.append(list(curr))
+    return merged
+
+
+def missingRanges(ranges, fromBlock, toBlock):
+    """ The parts of [fromBlock, toBlock] not covered by ranges. """
+    missing = []
+    curr = fromBlock
+    for start, end in sorted(ranges):
+        if (end < curr):
+            continue
+        if (start > toBlock):
+            break
+        if (start > curr):
+            missing.append([curr, start - 1])
+        curr = max(curr, end + 1)
+    if (curr <= toBlock):
+        missing.append([curr, toBlock])
+    return missing
+
+
+def splitRange(fromBlock, toBlock, pieces=2):
+    pieces = min(pieces, toBlock - fromBlock + 1)
+    bounds = [fromBlock + ((toBlock - fromBlock + 1) * i) // pieces for i in range(pieces + 1)]
+    return [[bounds[i], bounds[i+1] - 1] for i in range(pieces)]
+
+
+class RangePlanner:
+    def __init__(self, fromBlock, toBlock, resultCap=GETLOGS_RESULT_CAP, covered=None):
+        self.fromBlock = fromBlock
+        self.toBlock = toBlock
+        self.resultCap = resultCap
+        self.covered = [list(x) for x in (covered or [])]
+        self.pending = []
+        self.requests = 0
+        self.truncated = []                          # Single blocks with more logs than resultCap
+
+    def start(self, window=None, shards=None):
+        """
+         Ranges to request first: everything in [fromBlock, toBlock] not yet
+         covered, cut into pieces of at most window blocks if given, or into
+         about shards pieces of the same length.
+        """
+        ranges = missingRanges(self.covered, self.fromBlock, self.toBlock)
+        if (shards is not None and len(ranges)):
+            window = max(1, math.ceil(sum(end - start + 1 for start, end in ranges) / shards))
+        if (window is not None):
+            ranges = [[start, min(start + window - 1, end)] for fromBlock, end in ranges for start in range(fromBlock, end + 1, window)]
+        self.pending += ranges
+        return ranges
+
+    def done(self):
+        return not len(self.pending)
+
+    def split(self, fromBlock, toBlock):
+        """ The [fromBlock, toBlock] query was rejected as too large. Returns the halves to issue instead. """
+        self.pending.remove([fromBlock, toBlock])
+        self.requests += 1
+        assert(fromBlock < toBlock), f"Block {fromBlock} alone is too large for the provider"
+        ranges = splitRange(fromBlock, toBlock)
+        self.pending += ranges
+        return ranges
+
+    def complete(self, fromBlock, toBlock, blocks):
+        """
+         Record the result of the [fromBlock, toBlock] query, given the block
+         number of each returned log. Returns (keepBelow, ranges): only logs
+         from blocks below keepBelow are complete and should be kept (None
+         keeps all of them), and ranges are the follow-up queries to issue.
+        """
+        self.pending.remove([fromBlock, toBlock])
+        self.requests += 1
+        if (len(blocks) < self.resultCap):
+            self.covered = addRange(self.covered, fromBlock, toBlock)
+            return None, []
+        lastBlock = max(blocks)
+        if (fromBlock == toBlock):
+            ## Can't split a single block any further
+            print(f"Block {fromBlock} has at least {len(blocks)} logs, results are truncated")
+            self.truncated.append(fromBlock)
+            self.covered = addRange(self.covered, fromBlock, toBlock)
+            return None, []
+        if (lastBlock > fromBlock):
+            self.covered = addRange(self.covered, fromBlock, lastBlock - 1)
+            remaining = [lastBlock, toBlock]
+            density = len(blocks) / (lastBlock - fromBlock + 1)
+            expected = density * (toBlock - lastBlock + 1)
+            pieces = min(MAX_SPLIT, max(2, math.ceil(expected / (self.resultCap * SPLIT_FILL))))
+        else:
+            remaining = [fromBlock, toBlock]
+            pieces = 2
+        ranges = splitRange(remaining[0], remaining[1], pieces) if remaining[0] < remaining[1] else [remaining]
+        self.pending += ranges
+        return lastBlock, ranges
@@ -0,0 +1,160 @@
+
+"""
+ Content-addressed cache of raw getLogs responses.
+
+ Every answered query is stored as it came from the provider, gzip
+ compressed, under the sha256 of its (endpoint, addresses, topic0, fromBlock,
+ toBlock) key:
+
+   data/raw_logs/ab/ab12....json.gz     { "key" : {...}, "logs" : [...] }
+   data/raw_logs/index.jsonl            one { "hash", "key", "logs" } line per entry
+
+ The same query is never sent twice, and ExtractSwaps --redecode can rebuild
+ every decoded cache from these files without the network. API keys are not
+ part of the key, so all keys of an endpoint share the cache. Queries the
+ provider refused as too large are not cached.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from LogSources import LogSource
+
+
+RAW_LOG_CACHE_PATH = 'data/raw_logs'
+COMPRESSION_LEVEL = 6
+
+
+def cacheKey(endpoint, addresses, topic0, fromBlock, toBlock):
+    addresses = sorted(x.lower() for x in addresses) if addresses is not None else None
+    key = { "endpoint" : endpoint, "addresses" : addresses, "topic0" : topic0.lower(), "fromBlock" : fromBlock, "toBlock" : toBlock }
+    return key, hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def entryPath(path, h):
+    return os.path.join(path, h[:2], f"{h}.json.gz")
+
+def loadEntry(path, h):
+    """ The logs of a cached entry. Needs no RawLogCache, so worker processes can read entries directly. """
+    with gzip.open(entryPath(path, h), 'rt') as f:
+        return json.load(f)["logs"]
+
+
+class RawLogCache:
+    def __init__(self, path=RAW_LOG_CACHE_PATH):
+        self.path = path
+        self.indexPath = os.path.join(path, "index.jsonl")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hashes = set()
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(self.indexPath, 'r') as f:
+                for line in f:
+                    try:
+                        self.hashes.add(json.loads(line)["hash"])
+                    except json.JSONDecodeError:
+                        ## A crash in the middle of an append leaves a partial last line
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def entryPath(self, h):
+        return entryPath(self.path, h)
+
+    def load(self, h):
+        return loadEntry(self.path, h)
+
+    def get(self, endpoint, addresses, topic0, fromBlock, toBlock):
+        """ The cached logs of the query, None if it was never answered. """
+        _, h = cacheKey(endpoint, addresses, topic0, fromBlock, toBlock)
+        if (h in self.hashes):
+            try:
+                logs = self.load(h)
+                with self.lock:
+                    self.hits += 1
+                return logs
+            except (OSError, EOFError, json.JSONDecodeError):
+                pass
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, endpoint, addresses, topic0, fromBlock, toBlock, logs):
+        key, h = cacheKey(endpoint, addresses, topic0, fromBlock, toBlock)
+        path = self.entryPath(h)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, 'wt', compresslevel=COMPRESSION_LEVEL) as f:
+            json.dump({ "key" : key, "logs" : logs }, f)
+        os.replace(tmp, path)
+        with self.lock:
+            if (h not in self.hashes):
+                self.hashes.add(h)
+                with open(self.indexPath, 'a') as f:
+                    f.write(json.dumps({ "hash" : h, "key" : key, "logs" : len(logs) }) + "\n")
+
+    def entries(self):
+        """ The index lines of every cached query. """
+        seen = set()
+        try:
+            with open(self.indexPath, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if (entry["hash"] not in seen):
+                        seen.add(entry["hash"])
+                        yield entry
+        except FileNotFoundError:
+            return
+
+    def printStats(self):
+        print(f"Raw log cache: {self.hits} hits, {self.misses} misses, {len(self.hashes)} entries")
+
+
+class CachedLogSource(LogSource):
+    """ A LogSource answering from a RawLogCache and asking the wrapped source only on a miss. """
+    def __init__(self, source, endpoint, cache):
+        self.source = source
+        self.endpoint = endpoint
+        self.cache = cache
+        self.resultCap = source.resultCap
+        self.maxAddresses = source.maxAddresses
+
+    @property
+    def requests(self):
+        return self.source.requests
+
+    def getLogs(self, addresses, topic0, fromBlock, toBlock):
+        logs = self.cache.get(self.endpoint, addresses, topic0, fromBlock, toBlock)
+        if (logs is None):
+            logs = self.source.getLogs(addresses, topic0, fromBlock, toBlock)
+            self.cache.put(self.endpoint, addresses, topic0, fromBlock, toBlock, logs)
+        return logs
+
+    def getLogsBatch(self, queries):
+        results = [self.cache.get(self.endpoint, *query) for query in queries]
+        misses = [i for i, logs in enumerate(results) if logs is None]
+        if (len(misses)):
+            for i, logs in zip(misses, self.source.getLogsBatch([queries[i] for i in misses])):
+                if (logs is not None):
+                    self.cache.put(self.endpoint, *queries[i], logs)
+                results[i] = logs
+        return results
+
+
+CACHES = dict()
+CACHES_LOCK = threading.Lock()
+
+def getRawLogCache(path=RAW_LOG_CACHE_PATH):
+    """ One shared cache per directory, like Checkpoints.getManifest. """
+    path = os.path.abspath(path)
+    with CACHES_LOCK:
+        if (path not in CACHES):
+            CACHES[path] = RawLogCache(path)
+        return CACHES[path]
@@ -0,0 +1,170 @@
+
+"""
+ Batch decoder for the Swap events of a getLogs page.
+
+ Every log's data is converted once with bytes.fromhex and cut into 32-byte
+ words. Both legs of the swap come from the same words: the token going into
+ the pool is "from", the one going out is "to". UniSwapV3's extra words
+ (sqrtPriceX96, liquidity, tick) are kept on the swap. A leg whose sign
+ doesn't make sense is recorded as (-1, token0 + token1), like the per-leg
+ functions in ExtractSwaps, and counted in ANOMALIES instead of printed.
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import threading
+import time
+
+
+WORD = 32
+
+ANOMALIES = collections.Counter()            # (dex, "from" or "to") -> swaps with a broken leg
+ANOMALIES_LOCK = threading.Lock()
+
+V3_DEXES = { "uniswapv3" }
+
+
+def quantity(value):
+    ## Etherscan writes zero as "0x"
+    return int(value, 16) if len(value) > 2 else 0
+
+
+def decodeSwapLogs(dex, token0, token1, logs):
+    """ Decode a page of raw Swap logs. Returns the swaps keyed by "block-tx-log", like ExtractSwaps.decodeSwaps. """
+    isV3 = dex in V3_DEXES
+    anomaly = (-1, token0 + token1)
+    fromAnomalies, toAnomalies = 0, 0
+    fromBytes = int.from_bytes
+    ret = dict()
+    for x in logs:
+        data = bytes.fromhex(x["data"][2:])
+        if (isV3):
+            amount0 = fromBytes(data[0:WORD], 'big', signed=True)
+            amount1 = fromBytes(data[WORD:2*WORD], 'big', signed=True)
+        else:
+            amount0 = fromBytes(data[0:WORD], 'big') - fromBytes(data[2*WORD:3*WORD], 'big')
+            amount1 = fromBytes(data[WORD:2*WORD], 'big') - fromBytes(data[3*WORD:4*WORD], 'big')
+        ## Each leg is checked on its own, exactly as the from_/to_ functions do
+        if ((amount0 > 0) == (amount1 > 0)):
+            swapFrom = anomaly
+            fromAnomalies += 1
+        else:
+            swapFrom = (amount0, token0) if amount0 > 0 else (amount1, token1)
+        if ((amount0 < 0) == (amount1 < 0)):
+            swapTo = anomaly
+            toAnomalies += 1
+        else:
+            swapTo = (-amount0, token0) if amount0 < 0 else (-amount1, token1)
+        topics = x["topics"]
+        blockNumber, transactionIndex, logIndex = quantity(x["blockNumber"]), quantity(x["transactionIndex"]), quantity(x["logIndex"])
+        swap = {
+            "blockNumber" : blockNumber,
+            "transactionIndex" : transactionIndex,
+            "logIndex" : logIndex,
+            "transactionHash" : x["transactionHash"],
+            "sender" : "0x" + topics[1][-40:],
+            "recipient" : "0x" + topics[2][-40:],
+            "timeStamp" : x["timeStamp"],
+            "gasPrice" : x["gasPrice"],
+            "gasUsed" : x["gasUsed"],
+            "from" : swapFrom,
+            "to" : swapTo,
+        }
+        if (isV3):
+            swap["sqrtPriceX96"] = fromBytes(data[2*WORD:3*WORD], 'big')
+            swap["liquidity"] = fromBytes(data[3*WORD:4*WORD], 'big')
+            swap["tick"] = fromBytes(data[4*WORD:5*WORD], 'big', signed=True)
+        ret[f'{blockNumber}-{transactionIndex}-{logIndex}'] = swap
+    if (fromAnomalies or toAnomalies):
+        with ANOMALIES_LOCK:
+            ANOMALIES[(dex, "from")] += fromAnomalies
+            ANOMALIES[(dex, "to")] += toAnomalies
+    return ret
+
+
+def printAnomalies():
+    for (dex, leg), count in sorted(ANOMALIES.items()):
+        if (count):
+            print(f"{dex}: {count} swaps with a broken {leg} leg")
+
+
+def recordedPages(path):
+    """ Raw getLogs pages saved as [{ "dex", "token0", "token1", "logs" }, ...]. """
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+
+def syntheticPages(seed=0, numPools=20, numBlocks=500, swapsPerBlock=20, anomalyRate=0.01):
+    """ One page per pool from MockChain, with some logs made to look like broken swaps. """
+    import random
+    import MockChain
+    pools, logs = MockChain.generateChain(seed, numPools, fromBlock=14020000, toBlock=14020000 + numBlocks - 1,
+                                          swapsPerBlock=swapsPerBlock, foreignPools=0)
+    rng = random.Random(seed)
+    byPool = collections.defaultdict(list)
+    for log in logs:
+        if (rng.random() < anomalyRate):
+            ## Same word for both amounts: the two legs point the same way
+            log = dict(log, data=log["data"][:2+64] + log["data"][2:2+64] + log["data"][2+2*64:])
+        byPool[log["address"]].append(log)
+    return [{ "dex" : pool["dex"], "token0" : pool["token0"], "token1" : pool["token1"], "logs" : byPool[pool["poolContract"]] }
+            for pool in pools if len(byPool[pool["poolContract"]])]
+
+
+def benchmark(pages, repeat=3):
+    """ Time decodeSwapLogs against ExtractSwaps' per-leg functions on the same pages and check they agree. """
+    import ExtractSwaps
+
+    def legacy(page):
+        ## ExtractSwaps.decodeSwaps before the batch decoder
+        dex, token0, token1 = page["dex"], page["token0"], page["token1"]
+        getInt = ExtractSwaps.getInt
+        r = [ { "blockNumber" : getInt(x["blockNumber"]),
+                "transactionIndex" : getInt(x["transactionIndex"]),
+                "logIndex" : getInt(x["logIndex"]),
+                "transactionHash" : x["transactionHash"],
+                "sender" : "0x" + x["topics"][1][-40:],
+                "recipient" : "0x" + x["topics"][2][-40:],
+                "timeStamp" : x["timeStamp"],
+                "gasPrice" : x["gasPrice"],
+                "gasUsed" : x["gasUsed"],
+                "from" : ExtractSwaps.POOL_SWAP_FROM[dex](token0, token1, x),
+                "to" : ExtractSwaps.POOL_SWAP_TO[dex](token0, token1, x),
+                } for x in page["logs"]]
+        return { f'{x["blockNumber"]}-{x["transactionIndex"]}-{x["logIndex"]}' : x for x in r }
+
+    numLogs = sum(len(page["logs"]) for page in pages)
+    times = { "legacy" : [], "batch" : [] }
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = [legacy(page) for page in pages]
+        times["legacy"].append(time.perf_counter() - start)
+        ANOMALIES.clear()
+        start = time.perf_counter()
+        decoded = [decodeSwapLogs(page["dex"], page["token0"], page["token1"], page["logs"]) for page in pages]
+        times["batch"].append(time.perf_counter() - start)
+    same = all(e.keys() == d.keys() and all(e[k].items() <= d[k].items() for k in e) for e, d in zip(expected, decoded))
+    print(f"{numLogs} logs in {len(pages)} pages")
+    for name, t in times.items():
+        print(f"{name}: {min(t):.3f}s, {numLogs / min(t):.0f} logs per second")
+    print(f"Speedup: {min(times['legacy']) / min(times['batch']):.2f}x")
+    print(f"Same swaps as the per-leg functions: {same}")
+    printAnomalies()
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batch Swap decoder against the per-leg functions")
+    parser.add_argument("--pages", default=None, help="JSON file of recorded getLogs pages, synthetic pages if not given")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    pages = recordedPages(args.pages) if args.pages else syntheticPages()
+    benchmark(pages, args.repeat)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,502 @@
+
+"""
+ Columnar swap store, the binary counterpart of data/swap_history.json.
+ Also the readers of the history in any of its forms: the store, the JSON
+ file, and swap_history.jsonl, which has one block of the JSON file per line.
+
+ The store is a directory with one raw little-endian file per column, one row
+ per swap, rows ordered by (blockNumber, transactionIndex, logIndex):
+   - block, tx, log                       uint32
+   - dex, pool, fromToken, toToken        uint32 ids into the tables of meta.json
+   - fromAmount, toAmount                 32 bytes, big-endian two's complement
+   - sender, recipient                    20 bytes
+   - transactionHash                      32 bytes
+   - timeStamp, gasPrice, gasUsed         uint64
+   - hasPoolState                         uint8, 1 for the UniSwapV3 swaps that carry the three below
+   - sqrtPriceX96, liquidity              32 bytes, big-endian unsigned
+   - tick                                 int32
+ blocks and block_offsets map each block with swaps to its first row, so a
+ block range is a slice of every column. Readers memory-map only the columns
+ they ask for.
+"""
+
+import argparse
+import collections.abc
+import json
+import os
+import shutil
+import numpy as np
+from Interning import internSwap
+
+
+SWAP_STORE_PATH = 'data/swap_store'
+SWAP_HISTORY_PATH = 'data/swap_history.json'
+SWAP_HISTORY_JSONL_PATH = 'data/swap_history.jsonl'
+READ_CHUNK = 1 << 20
+
+COLUMNS = {
+    "block"           : ("<u4", 1),
+    "tx"              : ("<u4", 1),
+    "log"             : ("<u4", 1),
+    "dex"             : ("<u4", 1),
+    "pool"            : ("<u4", 1),
+    "fromToken"       : ("<u4", 1),
+    "fromAmount"      : ("u1", 32),
+    "toToken"         : ("<u4", 1),
+    "toAmount"        : ("u1", 32),
+    "sender"          : ("u1", 20),
+    "recipient"       : ("u1", 20),
+    "transactionHash" : ("u1", 32),
+    "timeStamp"       : ("<u8", 1),
+    "gasPrice"        : ("<u8", 1),
+    "gasUsed"         : ("<u8", 1),
+    "hasPoolState"    : ("u1", 1),
+    "sqrtPriceX96"    : ("u1", 32),
+    "liquidity"       : ("u1", 32),
+    "tick"            : ("<i4", 1),
+}
+STORE_VERSION = 2                   # 1 had no pool state columns
+
+## Swap fields in swap_history.json order, and the columns each one is read from
+FIELDS = {
+    "blockNumber"      : ["block"],
+    "transactionIndex" : ["tx"],
+    "logIndex"         : ["log"],
+    "transactionHash"  : ["transactionHash"],
+    "sender"           : ["sender"],
+    "recipient"        : ["recipient"],
+    "timeStamp"        : ["timeStamp"],
+    "gasPrice"         : ["gasPrice"],
+    "gasUsed"          : ["gasUsed"],
+    "from"             : ["fromAmount", "fromToken"],
+    "to"               : ["toAmount", "toToken"],
+    "sqrtPriceX96"     : ["hasPoolState", "sqrtPriceX96"],
+    "liquidity"        : ["hasPoolState", "liquidity"],
+    "tick"             : ["hasPoolState", "tick"],
+    "dex"              : ["dex"],
+    "poolAddress"      : ["pool"],
+}
+POOL_STATE_FIELDS = ["sqrtPriceX96", "liquidity", "tick"]      # Only on the swaps with hasPoolState
+
+
+def hexQuantity(value):
+    ## Etherscan writes zero as "0x"
+    return hex(value) if value else "0x"
+
+def fromHexQuantity(value):
+    return int(value, 16) if value != "0x" else 0
+
+
+class IdTable:
+    """ Strings to dense ids, in order of first appearance. """
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.ids = { x : i for i, x in enumerate(self.values) }
+
+    def id(self, value):
+        if (value not in self.ids):
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+        return self.ids[value]
+
+
+class SwapStoreWriter:
+    """
+     Build a store from blocks of swaps in the swap_history.json format. The
+     store is written next to path and only replaces it on close().
+    """
+    def __init__(self, path=SWAP_STORE_PATH):
+        self.path = path
+        self.tmpPath = f"{path}.tmp"
+        shutil.rmtree(self.tmpPath, ignore_errors=True)
+        os.makedirs(self.tmpPath)
+        self.files = { name : open(os.path.join(self.tmpPath, f"{name}.bin"), 'wb') for name in COLUMNS }
+        self.dexes, self.pools, self.tokens = IdTable(), IdTable(), IdTable()
+        self.segments = []                           # (blockNum, firstRow, numRows) in write order
+        self.count = 0
+
+    def appendBlock(self, blockNum, swaps):
+        """ All swaps of one block, in any order. Every block may be appended once. """
+        swaps = sorted(swaps, key=lambda x: (x["transactionIndex"], x["logIndex"]))
+        if (not len(swaps)):
+            return
+        rows = {
+            "block" : [int(blockNum)] * len(swaps),
+            "tx" : [x["transactionIndex"] for x in swaps],
+            "log" : [x["logIndex"] for x in swaps],
+            "dex" : [self.dexes.id(x["dex"]) for x in swaps],
+            "pool" : [self.pools.id(x["poolAddress"]) for x in swaps],
+            "fromToken" : [self.tokens.id(x["from"][1]) for x in swaps],
+            "fromAmount" : b"".join(x["from"][0].to_bytes(32, 'big', signed=True) for x in swaps),
+            "toToken" : [self.tokens.id(x["to"][1]) for x in swaps],
+            "toAmount" : b"".join(x["to"][0].to_bytes(32, 'big', signed=True) for x in swaps),
+            "sender" : b"".join(bytes.fromhex(x["sender"][2:]) for x in swaps),
+            "recipient" : b"".join(bytes.fromhex(x["recipient"][2:]) for x in swaps),
+            "transactionHash" : b"".join(bytes.fromhex(x["transactionHash"][2:]) for x in swaps),
+            "timeStamp" : [fromHexQuantity(x["timeStamp"]) for x in swaps],
+            "gasPrice" : [fromHexQuantity(x["gasPrice"]) for x in swaps],
+            "gasUsed" : [fromHexQuantity(x["gasUsed"]) for x in swaps],
+            "hasPoolState" : ["tick" in x for x in swaps],
+            "sqrtPriceX96" : b"".join(x.get("sqrtPriceX96", 0).to_bytes(32, 'big') for x in swaps),
+            "liquidity" : b"".join(x.get("liquidity", 0).to_bytes(32, 'big') for x in swaps),
+            "tick" : [x.get("tick", 0) for x in swaps],
+        }
+        for name, (dtype, width) in COLUMNS.items():
+            if (width == 1):
+                self.files[name].write(np.asarray(rows[name], dtype=dtype).tobytes())
+            else:
+                assert(len(rows[name]) == width * len(swaps)), name
+                self.files[name].write(rows[name])
+        self.segments.append((int(blockNum), self.count, len(swaps)))
+        self.count += len(swaps)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        order = sorted(range(len(self.segments)), key=lambda i: self.segments[i][0])
+        blocks = [self.segments[i][0] for i in order]
+        assert(len(set(blocks)) == len(blocks)), "A block was appended twice"
+        if (order != list(range(len(order)))):
+            self.reorder(order)
+        offsets = [0]
+        for i in order:
+            offsets.append(offsets[-1] + self.segments[i][2])
+        np.asarray(blocks, dtype="<u4").tofile(os.path.join(self.tmpPath, "blocks.bin"))
+        np.asarray(offsets, dtype="<u8").tofile(os.path.join(self.tmpPath, "block_offsets.bin"))
+        meta = {
+            "version" : STORE_VERSION,
+            "count" : self.count,
+            "blocks" : len(blocks),
+            "columns" : { name : { "dtype" : dtype, "width" : width } for name, (dtype, width) in COLUMNS.items() },
+            "dexes" : self.dexes.values,
+            "pools" : self.pools.values,
+            "tokens" : self.tokens.values,
+        }
+        with open(os.path.join(self.tmpPath, "meta.json"), 'w') as json_file:
+            json.dump(meta, json_file)
+        ## Swap the directories so readers never see a half written store
+        oldPath = f"{self.path}.old"
+        shutil.rmtree(oldPath, ignore_errors=True)
+        if (os.path.exists(self.path)):
+            os.replace(self.path, oldPath)
+        os.replace(self.tmpPath, self.path)
+        shutil.rmtree(oldPath, ignore_errors=True)
+
+    def reorder(self, order):
+        """ Blocks came out of order: rewrite every column with the block segments sorted. """
+        for name, (dtype, width) in COLUMNS.items():
+            src = os.path.join(self.tmpPath, f"{name}.bin")
+            dst = os.path.join(self.tmpPath, f"{name}.sorted")
+            rowSize = np.dtype(dtype).itemsize * width
+            with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+                for i in order:
+                    _, first, numRows = self.segments[i]
+                    fin.seek(first * rowSize)
+                    fout.write(fin.read(numRows * rowSize))
+            os.replace(dst, src)
+
+
+class SwapStore:
+    def __init__(self, path=SWAP_STORE_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), 'r') as json_file:
+            self.meta = json.load(json_file)
+        assert(self.meta["version"] in [1, STORE_VERSION]), self.meta["version"]
+        self.count = self.meta["count"]
+        self.dexes = self.meta["dexes"]
+        self.pools = self.meta["pools"]
+        self.tokens = self.meta["tokens"]
+        self.blocks = self.mapFile("blocks.bin", "<u4", (self.meta["blocks"],))
+        self.offsets = self.mapFile("block_offsets.bin", "<u8", (self.meta["blocks"] + 1,))
+        self.columns = dict()
+
+    def mapFile(self, name, dtype, shape):
+        if (not shape[0]):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=shape)
+
+    def column(self, name):
+        """ The whole column, memory-mapped. Byte columns have one row of width bytes per swap. """
+        if (name not in self.columns):
+            info = self.meta["columns"][name]
+            shape = (self.count,) if info["width"] == 1 else (self.count, info["width"])
+            self.columns[name] = self.mapFile(f"{name}.bin", info["dtype"], shape)
+        return self.columns[name]
+
+    def blockSlice(self, fromBlock=None, toBlock=None):
+        """ Indexes into blocks of the blocks in [fromBlock, toBlock]. """
+        start = 0 if fromBlock is None else int(np.searchsorted(self.blocks, fromBlock, 'left'))
+        end = len(self.blocks) if toBlock is None else int(np.searchsorted(self.blocks, toBlock, 'right'))
+        return start, end
+
+    def rows(self, fromBlock=None, toBlock=None):
+        """ The row slice holding the swaps of blocks in [fromBlock, toBlock]. """
+        start, end = self.blockSlice(fromBlock, toBlock)
+        return slice(int(self.offsets[start]), int(self.offsets[end]))
+
+    def numBlocks(self, fromBlock=None, toBlock=None):
+        start, end = self.blockSlice(fromBlock, toBlock)
+        return end - start
+
+    def interned(self, table):
+        """ The store's dex, pool and token tables as ids of an Interning.InternTable. """
+        if (getattr(self, "internedFor", None) is not table):
+            self.internedFor = table
+            self.internedIds = { name : [table.id(x) for x in values]
+                                 for name, values in [("dexes", self.dexes), ("pools", self.pools), ("tokens", self.tokens)] }
+        return self.internedIds
+
+    def readRows(self, rows, fields=None, table=None):
+        """
+         Swap dicts for a row slice, with only the given fields (all of them by default).
+         With an intern table, addresses, pools, tokens and dexes come as its ids.
+        """
+        if (table is not None):
+            ids = self.interned(table)
+            dexes, pools, tokens, address = ids["dexes"], ids["pools"], ids["tokens"], lambda x: table.id("0x" + x.hex())
+        else:
+            dexes, pools, tokens, address = self.dexes, self.pools, self.tokens, lambda x: "0x" + x.hex()
+        fields = [x for x in FIELDS if fields is None or x in fields]
+        if ("hasPoolState" not in self.meta["columns"]):
+            fields = [x for x in fields if x not in POOL_STATE_FIELDS]
+        data = dict()
+        for name in { c for field in fields for c in FIELDS[field] }:
+            info = self.meta["columns"][name]
+            values = self.column(name)[rows]
+            if (info["width"] == 1):
+                data[name] = values.tolist()
+            else:
+                raw = values.tobytes()
+                data[name] = [raw[i:i+info["width"]] for i in range(0, len(raw), info["width"])]
+        decode = {
+            "blockNumber" : lambda i: data["block"][i],
+            "transactionIndex" : lambda i: data["tx"][i],
+            "logIndex" : lambda i: data["log"][i],
+            "transactionHash" : lambda i: "0x" + data["transactionHash"][i].hex(),
+            "sender" : lambda i: address(data["sender"][i]),
+            "recipient" : lambda i: address(data["recipient"][i]),
+            "timeStamp" : lambda i: hexQuantity(data["timeStamp"][i]),
+            "gasPrice" : lambda i: hexQuantity(data["gasPrice"][i]),
+            "gasUsed" : lambda i: hexQuantity(data["gasUsed"][i]),
+            "from" : lambda i: [int.from_bytes(data["fromAmount"][i], 'big', signed=True), tokens[data["fromToken"][i]]],
+            "to" : lambda i: [int.from_bytes(data["toAmount"][i], 'big', signed=True), tokens[data["toToken"][i]]],
+            "sqrtPriceX96" : lambda i: int.from_bytes(data["sqrtPriceX96"][i], 'big'),
+            "liquidity" : lambda i: int.from_bytes(data["liquidity"][i], 'big'),
+            "tick" : lambda i: data["tick"][i],
+            "dex" : lambda i: dexes[data["dex"][i]],
+            "poolAddress" : lambda i: pools[data["pool"][i]],
+        }
+        hasPoolState = data.get("hasPoolState")
+        return [{ field : decode[field](i) for field in fields if field not in POOL_STATE_FIELDS or hasPoolState[i] }
+                for i in range(rows.stop - rows.start)]
+
+    def iterBlocks(self, fromBlock=None, toBlock=None, fields=None, table=None):
+        """ Yield (blockNum, { txIndex : [swaps] }) for every block with swaps in [fromBlock, toBlock]. """
+        start, end = self.blockSlice(fromBlock, toBlock)
+        for i in range(start, end):
+            yield int(self.blocks[i]), self.readBlock(i, fields, table)
+
+    def readBlock(self, i, fields=None, table=None):
+        rows = slice(int(self.offsets[i]), int(self.offsets[i+1]))
+        txs = self.column("tx")[rows].tolist()
+        transactions = dict()
+        for tx, swap in zip(txs, self.readRows(rows, fields, table)):
+            transactions.setdefault(str(tx), []).append(swap)
+        return transactions
+
+    def history(self, fromBlock=None, toBlock=None, fields=None, table=None):
+        return SwapHistory(self, fromBlock, toBlock, fields, table)
+
+
+class SwapHistory(collections.abc.Mapping):
+    """
+     Read-only view shaped like json.load(swap_history.json): block number
+     strings to transaction index strings to swap lists. Blocks are decoded
+     when accessed, interned into table if one is given.
+    """
+    def __init__(self, store, fromBlock=None, toBlock=None, fields=None, table=None):
+        self.store = store
+        self.start, self.end = store.blockSlice(fromBlock, toBlock)
+        self.fields = fields
+        self.table = table
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        for i in range(self.start, self.end):
+            yield str(int(self.store.blocks[i]))
+
+    def __getitem__(self, blockNum):
+        i = int(np.searchsorted(self.store.blocks, int(blockNum), 'left'))
+        if (not (self.start <= i < self.end) or self.store.blocks[i] != int(blockNum)):
+            raise KeyError(blockNum)
+        return self.store.readBlock(i, self.fields, self.table)
+
+    def items(self):
+        for i in range(self.start, self.end):
+            yield str(int(self.store.blocks[i])), self.store.readBlock(i, self.fields, self.table)
+
+
+def iterJsonObject(json_file, chunkSize=READ_CHUNK):
+    """
+     Yield the (key, value) pairs of the JSON object in json_file one at a
+     time, so only one value has to fit in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = json_file.read(chunkSize)
+        eof = not len(chunk)
+        buf = buf[pos:] + chunk
+        pos = 0
+        return not eof
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if (pos < len(buf)):
+                assert(buf[pos] in chars), f"Expected one of {chars!r}, got {buf[pos]!r}"
+                pos += 1
+                return buf[pos-1]
+            assert(fill()), "Unexpected end of JSON"
+
+    def value():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            try:
+                ## A value cut off by the chunk boundary either fails or, for numbers, stops early
+                x, end = decoder.raw_decode(buf, pos)
+                if (end < len(buf) or eof):
+                    pos = end
+                    return x
+            except json.JSONDecodeError:
+                if (eof):
+                    raise
+            fill()
+
+    skip("{")
+    if (skip('}"') == '}'):
+        return
+    pos -= 1
+    while True:
+        key = value()
+        skip(":")
+        yield key, value()
+        if (skip(",}") == '}'):
+            return
+
+
+def iterJsonLines(json_file):
+    """ Yield the (blockNum, transactions) of a swap_history.jsonl, each line being { blockNum : transactions }. """
+    for line in json_file:
+        if (line.strip()):
+            yield from json.loads(line).items()
+
+
+def iterHistoryFile(json_file):
+    """ Yield the (blockNum, transactions) of an open swap_history.json or .jsonl, one block at a time. """
+    if (json_file.name.endswith(".jsonl")):
+        return iterJsonLines(json_file)
+    return iterJsonObject(json_file)
+
+
+def historyFile(jsonPath=SWAP_HISTORY_PATH, jsonlPath=SWAP_HISTORY_JSONL_PATH):
+    """ The newer of the two history files, jsonPath if neither exists. """
+    existing = [x for x in [jsonlPath, jsonPath] if os.path.exists(x)]
+    return max(existing, key=os.path.getmtime) if len(existing) else jsonPath
+
+
+def storeIsCurrent(path=SWAP_STORE_PATH, jsonPath=SWAP_HISTORY_PATH, jsonlPath=SWAP_HISTORY_JSONL_PATH):
+    """ Whether there is a store at least as new as the newer history file, which is read instead otherwise. """
+    meta = os.path.join(path, "meta.json")
+    if (not os.path.exists(meta)):
+        return False
+    history = historyFile(jsonPath, jsonlPath)
+    if (os.path.exists(history) and os.path.getmtime(history) > os.path.getmtime(meta)):
+        print(f"{history} is newer than the swap store in {path}, reading it instead. Run SwapStore.py to convert it")
+        return False
+    return True
+
+
+def convertSwapHistory(jsonPath=SWAP_HISTORY_PATH, path=SWAP_STORE_PATH):
+    """ Stream swap_history.json or .jsonl into a store, one block at a time. """
+    writer = SwapStoreWriter(path)
+    with open(jsonPath, 'r') as json_file:
+        for blockNum, transactions in iterHistoryFile(json_file):
+            writer.appendBlock(blockNum, [swap for swaps in transactions.values() for swap in swaps])
+            if (len(writer.segments) % 1000 == 0):
+                print(f"Converted {len(writer.segments)} blocks, {writer.count} swaps")
+    writer.close()
+    print(f"Wrote {writer.count} swaps in {len(writer.segments)} blocks to {path}")
+
+
+def iterSwapHistory(fromBlock=None, toBlock=None, fields=None, path=SWAP_STORE_PATH, jsonPath=SWAP_HISTORY_PATH,
+                    jsonlPath=SWAP_HISTORY_JSONL_PATH, table=None):
+    """
+     Yield the swap history as (blockNum, transactions), one block at a time,
+     from the store when it is at least as new as the newer history file and
+     from that file otherwise. Only the current block is held in memory. With an intern
+     table the swaps carry its ids instead of strings.
+    """
+    if (storeIsCurrent(path, jsonPath, jsonlPath)):
+        for blockNum, transactions in SwapStore(path).iterBlocks(fromBlock, toBlock, fields, table):
+            yield str(blockNum), transactions
+        return
+    yield from iterHistoryFileRange(fromBlock, toBlock, jsonPath, jsonlPath, table)
+
+
+def iterHistoryFileRange(fromBlock, toBlock, jsonPath, jsonlPath, table):
+    with open(historyFile(jsonPath, jsonlPath), 'r') as json_file:
+        for k, v in iterHistoryFile(json_file):
+            if ((fromBlock is None or int(k) >= fromBlock) and (toBlock is None or int(k) <= toBlock)):
+                if (table is not None):
+                    v = { tx : [internSwap(swap, table) for swap in swapsList] for tx, swapsList in v.items() }
+                yield k, v
+
+
+def loadSwapHistory(fromBlock=None, toBlock=None, fields=None, path=SWAP_STORE_PATH, jsonPath=SWAP_HISTORY_PATH,
+                    jsonlPath=SWAP_HISTORY_JSONL_PATH, table=None):
+    """
+     The swap history as a block -> transaction -> swaps mapping, read from
+     the store when it is at least as new as the newer history file and from
+     that file otherwise.
+     With an intern table the swaps carry its ids instead of strings.
+    """
+    if (storeIsCurrent(path, jsonPath, jsonlPath)):
+        return SwapStore(path).history(fromBlock, toBlock, fields, table)
+    if (table is not None or historyFile(jsonPath, jsonlPath) != jsonPath):
+        ## One block at a time, so no block's strings outlive their interning
+        return dict(iterHistoryFileRange(fromBlock, toBlock, jsonPath, jsonlPath, table))
+    with open(jsonPath, 'r') as json_file:
+        swaps = json.load(json_file)
+    if (fromBlock is None and toBlock is None):
+        return swaps
+    return { k : v for k, v in swaps.items()
+             if (fromBlock is None or int(k) >= fromBlock) and (toBlock is None or int(k) <= toBlock) }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert data/swap_history.json (or .jsonl) to the columnar swap store")
+    parser.add_argument("--json", default=None, help="the history file, the newer of swap_history.json and .jsonl by default")
+    parser.add_argument("--store", default=SWAP_STORE_PATH)
+    parser.add_argument("--info", action="store_true", help="describe an existing store instead")
+    args = parser.parse_args()
+    if (not args.info):
+        convertSwapHistory(args.json or historyFile(), args.store)
+    store = SwapStore(args.store)
+    print(f"{store.count} swaps in {len(store.blocks)} blocks, {len(store.pools)} pools, {len(store.tokens)} tokens")
+    if (len(store.blocks)):
+        print(f"Blocks {int(store.blocks[0])} to {int(store.blocks[-1])}")
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,116 @@
+
+"""
+ Token metadata for data/token_info.json, which AnalyzeArbitrages reads.
+
+ The tokens of every DEX's {dex}_tokens.json are resolved through a node:
+ symbol() and decimals() are sent as eth_call entries of JSON-RPC batch
+ arrays, so thousands of tokens take a handful of requests. Answers are
+ cached by address in data/token_cache.json and only new tokens are ever
+ requested. Reverted calls are cached too, other errors are retried on the
+ next run. USD prices are not on chain: the ones already in token_info.json
+ are kept, new tokens get None.
+"""
+
+import argparse
+import json
+from Checkpoints import atomicDumpJson
+from LogSources import JsonRpcLogSource
+
+
+TOKEN_CACHE_PATH = 'data/token_cache.json'
+TOKEN_INFO_PATH = 'data/token_info.json'
+DEFAULT_RPC_URL = "http://127.0.0.1:8545"
+
+SYMBOL_SELECTOR = "0x95d89b41"              # symbol()
+DECIMALS_SELECTOR = "0x313ce567"            # decimals()
+
+DEXES = ["uniswapv3", "uniswapv2", "sushiswap"]
+
+
+def decodeString(result):
+    """ symbol() returns an ABI encoded string, or a bytes32 on old tokens like MKR. """
+    data = bytes.fromhex(result[2:])
+    if (len(data) >= 64):
+        offset = int.from_bytes(data[0:32], 'big')
+        if (offset + 32 <= len(data)):
+            length = int.from_bytes(data[offset:offset+32], 'big')
+            if (offset + 32 + length <= len(data)):
+                return data[offset+32:offset+32+length].decode('utf-8', errors='replace').rstrip("\0")
+    if (len(data) == 32):
+        return data.rstrip(b"\0").decode('utf-8', errors='replace')
+    return None
+
+def decodeUint(result):
+    data = bytes.fromhex(result[2:])
+    if (len(data) < 32):
+        return None
+    return int.from_bytes(data[0:32], 'big')
+
+
+def isReverted(error):
+    return error.get("code") == 3 or "revert" in str(error.get("message", "")).lower()
+
+
+def loadTokenCache(path=TOKEN_CACHE_PATH):
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return dict()
+
+
+def resolveTokens(addresses, url=DEFAULT_RPC_URL, cachePath=TOKEN_CACHE_PATH):
+    """ Map each address to { "symbol", "decimals" }, None where the token doesn't tell. """
+    cache = loadTokenCache(cachePath)
+    missing = sorted({ x.lower() for x in addresses } - cache.keys())
+    if (len(missing)):
+        source = JsonRpcLogSource(url)
+        calls = [("eth_call", [{ "to" : address, "data" : selector }, "latest"])
+                 for address in missing for selector in [SYMBOL_SELECTOR, DECIMALS_SELECTOR]]
+        results = source.call(calls)
+        failed = 0
+        for i, address in enumerate(missing):
+            symbol, decimals = results[2*i], results[2*i+1]
+            if (any("error" in r and not isReverted(r["error"]) for r in [symbol, decimals])):
+                failed += 1
+                continue
+            cache[address] = {
+                "symbol" : decodeString(symbol["result"]) if "result" in symbol else None,
+                "decimals" : decodeUint(decimals["result"]) if "result" in decimals else None
+            }
+        atomicDumpJson(cachePath, cache)
+        print(f"Resolved {len(missing) - failed} new tokens in {source.requests} requests, {failed} failed")
+    return { x : cache.get(x.lower(), { "symbol" : None, "decimals" : None }) for x in addresses }
+
+
+def buildTokenInfo(dexes=DEXES, url=DEFAULT_RPC_URL, path=TOKEN_INFO_PATH, cachePath=TOKEN_CACHE_PATH):
+    """ Resolve the union of the DEXes' tokens and write token_info.json. """
+    addresses = set()
+    for dex in dexes:
+        with open(f'data/{dex}_tokens.json', 'r') as json_file:
+            addresses.update(json.load(json_file))
+    metadata = resolveTokens(sorted(addresses), url, cachePath)
+    try:
+        with open(path, 'r') as json_file:
+            tokens = json.load(json_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        tokens = dict()
+    for address, curr in metadata.items():
+        token = tokens.setdefault(address, { "symbol" : None, "decimals" : None, "USD" : None })
+        ## Don't lose what an earlier run or a manual edit already knew
+        token.update({ k : v for k, v in curr.items() if v is not None })
+    atomicDumpJson(path, tokens)
+    print(f"Token info has {len(tokens)} tokens, {sum(x['symbol'] is None for x in tokens.values())} without a symbol")
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve the symbol and decimals of every pool token into data/token_info.json")
+    parser.add_argument("--url", default=DEFAULT_RPC_URL, help="JSON-RPC endpoint")
+    parser.add_argument("--dexes", nargs="+", default=DEXES)
+    args = parser.parse_args()
+    buildTokenInfo(args.dexes, args.url)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,213 @@
+
+"""
+ Sliding window search for arbitrage cycles spanning adjacent blocks.
+
+ ProcessSwaps looks at one block at a time, so a cycle whose swaps are in
+ different blocks is never found. Here the swaps of the last WINDOW_BLOCKS
+ blocks are kept, indexed by the token each swap pays out:
+
+   (to-token, sender)                    the swaps that may precede a swap of the same sender
+   (to-token, blockNumber, tx)           the swaps that may precede a swap of their own transaction
+
+ A swap can follow another when canExtend allows it inside a block, or,
+ across blocks, when it is by the same sender in a later block of the
+ window. MAX_CROSS_TRANSACTION doesn't apply across blocks, the window does.
+
+ A cycle's swaps go forward in time, so a cycle reaching into an earlier
+ block ends with a swap of the latest block it touches. When a block comes
+ in, the search walks back from each of its swaps through the index, and
+ only reports cycles that start in an earlier block: cycles inside a single
+ block are ProcessSwaps', and every cross block cycle is found exactly once,
+ when its last block arrives. Evicting a block pops its swaps off the front
+ of the index lists, so memory and the work per block stay the same however
+ long the run is. The cycle length and a SearchBudget bound the search.
+
+ The profitable cycles of a block are reduced to non-overlapping ones,
+ shorter and spanning fewer blocks first, and appended to
+ data/cross_block_arbitrages.jsonl with an ArbitrageWriter as soon as the
+ block is done, so a run keeps none of them; loadArbitrages reads them back
+ given that path.
+
+   python WindowSearch.py --window 3
+"""
+
+import argparse
+import collections
+import itertools
+import time
+import ProcessSwaps
+import SwapStore
+from CycleSearch import SearchBudget, BudgetExceeded
+from ArbitrageStream import ArbitrageWriter
+from CoverSearch import packRows
+from Interning import getInternTable
+
+
+WINDOW_BLOCKS = 3                   # Blocks in the window, the newest included
+WINDOW_MAX_LENGTH = 4               # Swaps per cross block cycle
+WINDOW_CYCLE_BUDGET = 100000        # Per block limits of the search, None for no limit
+WINDOW_NODE_BUDGET = 2000000
+WINDOW_TIME_BUDGET = 10
+CROSS_BLOCK_ARBITRAGES_PATH = 'data/cross_block_arbitrages.jsonl'
+
+
+def swapKey(swap):
+    return (swap["blockNumber"], swap["transactionIndex"], swap["logIndex"])
+
+
+class BlockWindow:
+    def __init__(self, size=WINDOW_BLOCKS, maxCross=None, maxLength=WINDOW_MAX_LENGTH):
+        self.size = size
+        self.maxCross = ProcessSwaps.MAX_CROSS_TRANSACTION if maxCross is None else maxCross
+        self.maxLength = maxLength
+        self.blocks = collections.deque()   # (blockNum, swaps) oldest first
+        self.bySender = dict()              # (to-token, sender) -> swaps, oldest first
+        self.byTransaction = dict()         # (to-token, blockNumber, tx) -> swaps
+        self.degraded = dict()              # blockNum -> the budget it ran out of
+        self.numSwaps = 0                   # Swaps in the window
+
+    def evict(self, blockNum):
+        """ Drop the blocks that are WINDOW_BLOCKS or more before blockNum. """
+        while self.blocks and self.blocks[0][0] <= blockNum - self.size:
+            oldNum, swaps = self.blocks.popleft()
+            for swap in swaps:
+                for index, key in [(self.bySender, (swap["to"][1], swap["sender"])),
+                                   (self.byTransaction, (swap["to"][1], oldNum, swap["transactionIndex"]))]:
+                    assert(index[key][0] is swap)
+                    index[key].popleft()
+                    if (not len(index[key])):
+                        del index[key]
+            self.numSwaps -= len(swaps)
+
+    def canPrecede(self, swapL, swapR):
+        """ canExtend(swapL, swapR) across the window's blocks. """
+        if (swapL is swapR or swapL["to"][0] < swapR["from"][0]):
+            return False
+        if (swapL["blockNumber"] == swapR["blockNumber"]):
+            return swapL["transactionIndex"] <= swapR["transactionIndex"] <= swapL["transactionIndex"] + self.maxCross and \
+                   (swapL["sender"] == swapR["sender"] or swapL["transactionIndex"] == swapR["transactionIndex"])
+        return swapL["blockNumber"] < swapR["blockNumber"] and swapL["sender"] == swapR["sender"]
+
+    def predecessors(self, swapR):
+        token = swapR["from"][1]
+        sameTx = self.byTransaction.get((token, swapR["blockNumber"], swapR["transactionIndex"]), ())
+        sameSender = self.bySender.get((token, swapR["sender"]), ())
+        ret = [x for x in sameTx if self.canPrecede(x, swapR)]
+        ## Swaps of the same transaction were just taken from sameTx
+        ret += [x for x in sameSender if (x["blockNumber"], x["transactionIndex"]) != (swapR["blockNumber"], swapR["transactionIndex"])
+                and self.canPrecede(x, swapR)]
+        return ret
+
+    def cycles(self, blockNum, swaps, budget):
+        """ Yield the cycles ending with one of swaps, the newest block's, and starting in an earlier block. """
+        for last in swaps:
+            token = last["to"][1]
+            path = [last]
+            used = { id(last) }
+            stack = [iter(self.predecessors(last)) if self.maxLength > 1 else iter(())]
+            while stack:
+                for swap in stack[-1]:
+                    if (id(swap) not in used):
+                        budget.node()
+                        path.append(swap)
+                        used.add(id(swap))
+                        if (swap["from"][1] == token and swap["blockNumber"] < blockNum):
+                            budget.cycle()
+                            yield path[::-1]
+                        stack.append(iter(self.predecessors(swap)) if len(path) < self.maxLength else iter(()))
+                        break
+                else:
+                    stack.pop()
+                    used.discard(id(path.pop()))
+
+    def add(self, blockNum, transactions):
+        """ Add the next block of the history and return its cross block arbitrages. """
+        blockNum = int(blockNum)
+        assert(not self.blocks or self.blocks[-1][0] < blockNum), f"Block {blockNum} came after block {self.blocks[-1][0]}"
+        swaps = sorted((swap for swapsList in transactions.values() for swap in swapsList),
+                       key=lambda x : (x["transactionIndex"], x["logIndex"]))
+        self.evict(blockNum)
+        self.blocks.append((blockNum, swaps))
+        for swap in swaps:
+            self.bySender.setdefault((swap["to"][1], swap["sender"]), collections.deque()).append(swap)
+            self.byTransaction.setdefault((swap["to"][1], blockNum, swap["transactionIndex"]), collections.deque()).append(swap)
+        self.numSwaps += len(swaps)
+        if (len(self.blocks) < 2):
+            return []
+        arbitrages = []
+        budget = SearchBudget(WINDOW_CYCLE_BUDGET, WINDOW_NODE_BUDGET, WINDOW_TIME_BUDGET)
+        try:
+            for cycle in self.cycles(blockNum, swaps, budget):
+                balance = ProcessSwaps.isProfitableArbitrageCycle(cycle)
+                if (balance):
+                    arbitrages.append((cycle, balance))
+        except BudgetExceeded as e:
+            self.degraded[blockNum] = e.budget
+            print(f"Block {blockNum} ran out of its {e.budget} budget, keeping the {len(arbitrages)} cross block arbitrages found")
+        return self.reduce(arbitrages)
+
+    def reduce(self, arbitrages):
+        """ Non-overlapping arbitrages, in the arbitrages.json shape with their blocks. """
+        rows = [{ swapKey(swap) for swap in cycle } for cycle, _ in arbitrages]
+        weights = [cycle[0]["blockNumber"] - cycle[-1]["blockNumber"] for cycle, _ in arbitrages]
+        ret = []
+        for i in packRows(rows, weights):
+            cycle, balance = arbitrages[i]
+            ret.append({ "blocks" : sorted({ swap["blockNumber"] for swap in cycle }),
+                         "transactions" : sorted({ (swap["blockNumber"], swap["transactionIndex"]) for swap in cycle }),
+                         "balance" : balance, "cycle" : cycle })
+        return ret
+
+
+def extractCrossBlockArbitrages(blocks, size=WINDOW_BLOCKS, writer=None):
+    """
+     blocks is an iterable of (blockNum, transactions) in block order. Each block's arbitrages are
+     handed to writer, an ArbitrageWriter, as soon as the block is done. Returns the arbitrages, or
+     with a writer only their number.
+    """
+    window = BlockWindow(size)
+    arbitrages = [] if writer is None else None
+    numArbitrages = 0
+    start = time.perf_counter()
+    numBlocks, numSwaps, peakSwaps = 0, 0, 0
+    blocks = iter(blocks)
+    if (writer is not None):
+        ## The stream's records from the run's first block on are replaced, the earlier ones kept
+        first = next(blocks, None)
+        if (first is not None):
+            writer.truncate(int(first[0]))
+            blocks = itertools.chain([first], blocks)
+    for blockNum, transactions in blocks:
+        found = window.add(blockNum, transactions)
+        numBlocks += 1
+        numSwaps += sum(len(x) for x in transactions.values())
+        peakSwaps = max(peakSwaps, window.numSwaps)
+        for arbitrage in found:
+            print(f"Found cross block arbitrage in blocks {arbitrage['blocks']} with: #swaps({len(arbitrage['cycle'])}), "
+                  f"#transactions({len(arbitrage['transactions'])})")
+        if (writer is None):
+            arbitrages += found
+        elif (len(found)):
+            writer.write(found)
+        numArbitrages += len(found)
+    seconds = time.perf_counter() - start
+    print(f"{numBlocks} blocks, {numSwaps} swaps in {seconds:.1f}s, at most {peakSwaps} swaps in a {size} block window")
+    print(f"There are {numArbitrages} cross block arbitrages in total")
+    if (len(window.degraded)):
+        print(f"{len(window.degraded)} blocks ran out of budget: {', '.join(str(x) for x in sorted(window.degraded)[:20])}")
+    return arbitrages if writer is None else numArbitrages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the arbitrages spanning adjacent blocks of the swap history")
+    parser.add_argument("--window", type=int, default=WINDOW_BLOCKS, help="blocks in the window, the newest included")
+    parser.add_argument("--output", default=CROSS_BLOCK_ARBITRAGES_PATH)
+    args = parser.parse_args()
+    table = getInternTable()
+    with ArbitrageWriter(args.output, table) as writer:
+        extractCrossBlockArbitrages(SwapStore.iterSwapHistory(table=table), args.window, writer)
+    table.save()
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+from ArbitrageStream import ArbitrageWriter, readIndex, iterRecords, indexPath
+
+
+def arbitrage(block, tx, balance=1):
+    cycle = [{ "blockNumber" : block, "transactionIndex" : tx, "logIndex" : i } for i in range(2)]
+    return { "transactions" : [tx], "balance" : { "X" : balance }, "cycle" : cycle }
+
+
+def written(path):
+    return [(record["block"], record["transactions"][0], record["balance"]["X"]) for record in iterRecords(path=path)]
+
+
+def checkIndex(path):
+    """ Every index entry points at its block's first record. """
+    index = readIndex(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    blocks = []
+    for blockNum, offset in index:
+        assert offset == 0 or data[offset - 1:offset] == b"\n"
+        assert data[offset:].startswith(f'{{"block":{blockNum},'.encode())
+        blocks.append(blockNum)
+    assert blocks == sorted({ x[0] for x in written(path) })
+
+
+def test_reopening_appends(tmp_path):
+    path = str(tmp_path / "arbitrages.jsonl")
+    with ArbitrageWriter(path) as writer:
+        writer.write([arbitrage(10, 1), arbitrage(10, 2)])
+        writer.write([arbitrage(12, 0)])
+    with ArbitrageWriter(path) as writer:
+        writer.write([arbitrage(15, 3)])
+    assert written(path) == [(10, 1, 1), (10, 2, 1), (12, 0, 1), (15, 3, 1)]
+    checkIndex(path)
+
+
+def test_rewritten_blocks_replace_the_later_ones(tmp_path):
+    path = str(tmp_path / "arbitrages.jsonl")
+    with ArbitrageWriter(path) as writer:
+        writer.write([arbitrage(block, 0) for block in [10, 11, 12, 13]])
+    with ArbitrageWriter(path) as writer:
+        writer.write([arbitrage(12, 5, 2)])
+    assert written(path) == [(10, 0, 1), (11, 0, 1), (12, 5, 2)]
+    checkIndex(path)
+    with ArbitrageWriter(path) as writer:
+        writer.truncate(11)
+        writer.write([arbitrage(14, 0, 3)])
+    assert written(path) == [(10, 0, 1), (14, 0, 3)]
+    checkIndex(path)
+
+
+def test_a_crashed_write_is_recovered(tmp_path):
+    path = str(tmp_path / "arbitrages.jsonl")
+    with ArbitrageWriter(path) as writer:
+        writer.write([arbitrage(10, 0), arbitrage(11, 0), arbitrage(11, 1)])
+    ## A partial record, and an index that never saw block 11
+    with open(path, 'ab') as f:
+        f.write(b'{"block":12,"transac')
+    with open(indexPath(path), 'w') as f:
+        f.write("10 0\n")
+    with ArbitrageWriter(path) as writer:
+        writer.write([arbitrage(12, 0)])
+    assert written(path) == [(10, 0, 1), (11, 0, 1), (11, 1, 1), (12, 0, 1)]
+    checkIndex(path)
+
+
+def test_a_lost_index_is_rebuilt(tmp_path):
+    path = str(tmp_path / "arbitrages.jsonl")
+    with ArbitrageWriter(path) as writer:
+        writer.write([arbitrage(block, 0) for block in [10, 11, 12]])
+    os.remove(indexPath(path))
+    ArbitrageWriter(path).close()
+    assert [blockNum for blockNum, _ in readIndex(path)] == [10, 11, 12]
+    assert [record["block"] for record in iterRecords(11, 11, path=path)] == [11]
+    checkIndex(path)
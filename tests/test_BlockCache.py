@@ -0,0 +1,54 @@
+import BlockCache as BlockCacheModule
+from BlockCache import BlockCache
+
+
+def swaps(block, amount):
+    return [{ "blockNumber" : block, "transactionIndex" : 0, "logIndex" : i, "from" : [amount, "X"], "to" : [amount, "Y"] } for i in range(2)]
+
+
+def fill(cache, blocks, amount):
+    keys = dict()
+    for block in blocks:
+        keys[block] = cache.key(swaps(block, amount))
+        cache.put(keys[block], block, [], { "swaps" : 2 })
+    return keys
+
+
+def numLines(path):
+    with open(path, 'r') as f:
+        return sum(1 for _ in f)
+
+
+def test_superseded_entries_are_compacted(tmp_path):
+    path = str(tmp_path / "block_cache.jsonl")
+    old = fill(BlockCache({ "version" : 1 }, path), range(10), 1)
+    ## The same blocks searched with other parameters, then refetched differently
+    cache = BlockCache({ "version" : 2 }, path)
+    assert len(cache.entries) == 10
+    new = fill(cache, range(10), 1)
+    assert len(cache.entries) == 10
+    fill(cache, range(3), 2)
+    assert numLines(path) == 23
+    cache = BlockCache({ "version" : 2 }, path)
+    assert numLines(path) == 10
+    assert all(cache.get(old[block]) is None for block in range(10))
+    assert all(cache.get(new[block]) is None for block in range(3))
+    assert all(cache.get(new[block])["block"] == block for block in range(3, 10))
+    assert all(cache.get(cache.key(swaps(block, 2))) is not None for block in range(3))
+
+
+def test_compaction_waits_for_the_threshold(tmp_path, monkeypatch):
+    path = str(tmp_path / "block_cache.jsonl")
+    cache = BlockCache({ "version" : 1 }, path)
+    fill(cache, range(10), 1)
+    fill(cache, range(4), 2)
+    with open(path, 'a') as f:
+        f.write('{"key" : "partial')
+    BlockCache({ "version" : 1 }, path)
+    assert numLines(path) == 15
+    monkeypatch.setattr(BlockCacheModule, "COMPACT_SHARE", 0.2)
+    cache = BlockCache({ "version" : 1 }, path)
+    assert numLines(path) == 10
+    assert not cache.partial
+    fill(cache, [10], 1)
+    assert numLines(path) == 11
@@ -0,0 +1,12 @@
+from CoverSearch import bestCover, packRows
+
+
+def test_unsolved_components_keep_the_solved_covers():
+    ## {a} and {b, c} / {c, d} / {d} share nothing, only the second has no exact cover
+    rows = [{"a"}, {"b", "c"}, {"c", "d"}, {"d"}]
+    weights = [-1.0, -2.0, -3.0, -4.0]
+    assert bestCover(rows, weights) == ([0, 1, 3], True, [])
+    assert bestCover(rows[:3], weights[:3]) == ([0], True, [1, 2])
+    ## The budget runs out in the second component, the first one's cover is kept
+    assert bestCover(rows, weights, nodes=1) == ([0], False, [1, 2, 3])
+    assert packRows(rows, weights, [1, 2, 3]) == [1, 3]
@@ -0,0 +1,89 @@
+import random
+import pytest
+import ProcessSwaps
+from CycleSearch import generateCycles, syntheticBlock, rotationKey, SearchBudget, BudgetExceeded
+from GenerateSwaps import SwapHistoryGenerator
+
+
+def generatedBlocks(seed, **parameters):
+    """ The blocks of a seeded GenerateSwaps history, each sorted like findInBlockArbitrages sorts them. """
+    blocks = dict()
+    for dex, pools in SwapHistoryGenerator(seed, **parameters).history():
+        for poolAddress, swaps in pools.items():
+            for swap in swaps:
+                blocks.setdefault(swap["blockNumber"], []).append(dict(swap, dex=dex, poolAddress=poolAddress))
+    return [sorted(swaps, key=lambda x : (x["transactionIndex"], x["logIndex"])) for _, swaps in sorted(blocks.items())]
+
+
+def searchedBlocks():
+    blocks = generatedBlocks(0, blocks=40, pools=20, tokens=8, swapsPerBlock=10, fanout=3, cyclesPerBlock=0.5)
+    rng = random.Random(0)
+    blocks += [syntheticBlock(rng, 14) for _ in range(10)]
+    return blocks
+
+
+BLOCKS = searchedBlocks()
+
+
+def ids(cycles):
+    return [[id(x) for x in cycle] for cycle in cycles]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_same_cycles_as_generateLegalCycles(seed):
+    numCycles = 0
+    for swaps in generatedBlocks(seed, blocks=30, pools=15, tokens=6, swapsPerBlock=12, fanout=3, cyclesPerBlock=0.5):
+        expected = ids(ProcessSwaps.generateLegalCycles(swaps, []))
+        assert ids(generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION, canonical=False)) == expected
+        numCycles += len(expected)
+    assert numCycles > 0
+
+
+def test_same_cycles_on_dense_blocks():
+    numCycles = 0
+    for swaps in BLOCKS:
+        expected = ids(ProcessSwaps.generateLegalCycles(swaps, []))
+        assert ids(generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION)) == expected
+        numCycles += len(expected)
+    assert numCycles > 0
+
+
+def test_canonical_keeps_one_rotation_of_each_cycle():
+    suppressed = 0
+    for swaps in BLOCKS:
+        position = { id(x) : i for i, x in enumerate(swaps) }
+        stats = dict()
+        canonical = list(generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION, canonical=True, stats=stats))
+        keys = [rotationKey(cycle, position) for cycle in canonical]
+        assert len(keys) == len(set(keys))
+        assert set(keys) == { rotationKey(cycle, position) for cycle in ProcessSwaps.generateLegalCycles(swaps, []) }
+        assert len(canonical) + stats["suppressed"] == sum(1 for _ in ProcessSwaps.generateLegalCycles(swaps, []))
+        suppressed += stats["suppressed"]
+    assert suppressed > 0
+
+
+def test_canonical_rotation_starts_at_the_earliest_swap():
+    swaps = [
+        { "transactionIndex" : 0, "logIndex" : 0, "sender" : "0x1", "from" : [100, "A"], "to" : [100, "B"] },
+        { "transactionIndex" : 0, "logIndex" : 1, "sender" : "0x1", "from" : [100, "B"], "to" : [100, "C"] },
+        { "transactionIndex" : 0, "logIndex" : 2, "sender" : "0x1", "from" : [100, "C"], "to" : [100, "A"] },
+    ]
+    assert len(list(ProcessSwaps.generateLegalCycles(swaps, []))) == 3
+    assert ids(generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION, canonical=True)) == [[id(x) for x in swaps]]
+
+
+def test_balances_match_isProfitableArbitrageCycle():
+    for swaps in BLOCKS:
+        for prune in [False, True]:
+            found = [(ids([cycle])[0], list(balance.items())) for cycle, balance in
+                     generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION, canonical=True, balances=True, prune=prune) if balance]
+            expected = [(ids([cycle])[0], list(balance.items())) for cycle in generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION, canonical=True)
+                        for balance in [ProcessSwaps.isProfitableArbitrageCycle(cycle)] if balance]
+            assert found == expected
+
+
+def test_node_budget():
+    swaps = max(BLOCKS, key=len)
+    with pytest.raises(BudgetExceeded) as e:
+        list(generateCycles(swaps, ProcessSwaps.MAX_CROSS_TRANSACTION, budget=SearchBudget(nodes=1)))
+    assert e.value.budget == "nodes"
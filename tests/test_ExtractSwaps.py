@@ -0,0 +1,101 @@
+import contextlib
+import functools
+import io
+import sys
+import pytest
+import ExtractSwaps
+import LogSources
+import MockChain
+import SwapStore
+from LogFetcher import LogFetcher, MAX_RETRIES
+
+
+FROM_BLOCK, TO_BLOCK = 14020000, 14020099
+POOLS, LOGS = MockChain.generateChain(0, numPools=10, numTokens=10, fromBlock=FROM_BLOCK, toBlock=TO_BLOCK, swapsPerBlock=5)
+## Swaps of the factories' pools, the ones of the foreign pools are dropped
+CATALOG_SWAPS = sum(1 for log in LOGS if log["topics"][0] in ExtractSwaps.POOL_SWAP_EVENT.values()
+                    and log["address"].lower() in { pool["poolContract"].lower() for pool in POOLS })
+
+
+def extract(workdir, monkeypatch, logSource="etherscan", engine="async", mode="pools",
+            resultCap=MockChain.RESULT_CAP, rpcResultCap=MockChain.RPC_RESULT_CAP, rateLimit=None, maxRetries=MAX_RETRIES):
+    """ Run ExtractSwaps.main against a fresh MockChain in workdir. Returns the swap history and the chain. """
+    chain = MockChain.MockChain(LOGS, resultCap=resultCap, rpcResultCap=rpcResultCap, rateLimit=rateLimit)
+    server, url = MockChain.startMockChain(chain)
+    monkeypatch.setattr(ExtractSwaps, "ETHERSCAN_API_URL", url + "/api")
+    monkeypatch.setattr(ExtractSwaps, "JSON_RPC_URL", url)
+    monkeypatch.setattr(ExtractSwaps, "LOG_SOURCE", logSource)
+    monkeypatch.setattr(ExtractSwaps, "EXTRACTION_ENGINE", engine)
+    monkeypatch.setattr(ExtractSwaps, "EXTRACTION_MODE", mode)
+    monkeypatch.setattr(ExtractSwaps, "LOG_SOURCES", dict())
+    ## The planner has to know the provider's cap, a short page is taken as the end of its range
+    monkeypatch.setattr(LogSources.EtherscanLogSource, "resultCap", resultCap)
+    ## The fetcher doesn't wait for the mock's rate limit, it has none unless a test sets one
+    monkeypatch.setattr(ExtractSwaps, "LogFetcher", functools.partial(LogFetcher, rate=1000, maxRetries=maxRetries))
+    for name in ["SWAPS_START_BLOCK", "SWAPS_END_BLOCK", "HISTORY_END_BLOCK"]:
+        monkeypatch.setattr(ExtractSwaps, name, getattr(ExtractSwaps, name))
+    monkeypatch.setattr(sys, "argv", ["ExtractSwaps.py", "--start-block", str(FROM_BLOCK), "--end-block", str(TO_BLOCK)])
+    (workdir / "data").mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            ExtractSwaps.main()
+        history = { block : dict(transactions) for block, transactions in SwapStore.loadSwapHistory().items() }
+    finally:
+        server.shutdown()
+    return history, chain
+
+
+def numSwaps(history):
+    return sum(len(swaps) for transactions in history.values() for swaps in transactions.values())
+
+
+@pytest.fixture(scope="module")
+def reference(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        history, chain = extract(tmp_path_factory.mktemp("reference"), monkeypatch)
+    assert numSwaps(history) == CATALOG_SWAPS
+    return history, chain.requests
+
+
+MODES = [("etherscan", "threads", "pools"), ("etherscan", "async", "topic"), ("etherscan", "threads", "topic"),
+         ("jsonrpc", "threads", "pools"), ("jsonrpc", "threads", "topic")]
+
+@pytest.mark.parametrize("logSource,engine,mode", MODES)
+def test_every_mode_finds_the_same_swaps(tmp_path, monkeypatch, reference, logSource, engine, mode):
+    history, _ = extract(tmp_path, monkeypatch, logSource, engine, mode)
+    assert history == reference[0]
+
+
+@pytest.mark.parametrize("engine,mode", [("async", "pools"), ("threads", "pools"), ("async", "topic")])
+def test_full_pages_are_split(tmp_path, monkeypatch, reference, engine, mode):
+    history, chain = extract(tmp_path, monkeypatch, "etherscan", engine, mode, resultCap=20)
+    assert history == reference[0]
+    if (mode == "pools"):
+        assert chain.requests > reference[1]
+
+
+@pytest.mark.parametrize("mode", ["pools", "topic"])
+def test_refused_queries_are_bisected(tmp_path, monkeypatch, reference, mode):
+    _, chain = extract(tmp_path / "uncapped", monkeypatch, "jsonrpc", "threads", mode)
+    history, capped = extract(tmp_path / "capped", monkeypatch, "jsonrpc", "threads", mode, rpcResultCap=20)
+    assert history == reference[0]
+    assert capped.requests > chain.requests
+
+
+def test_rerun_sends_no_requests(tmp_path, monkeypatch, reference):
+    extract(tmp_path, monkeypatch)
+    history, chain = extract(tmp_path, monkeypatch)
+    assert history == reference[0]
+    assert chain.requests == 0
+
+
+def test_failed_jobs_stop_before_the_history(tmp_path, monkeypatch, reference):
+    with pytest.raises(SystemExit):
+        extract(tmp_path, monkeypatch, rateLimit=1, maxRetries=1)
+    assert not (tmp_path / "data" / "swap_store").exists()
+    assert not [x for x in (tmp_path / "data").iterdir() if x.name.startswith("swap_history")]
+    ## What the failed run fetched is kept for the rerun
+    assert (tmp_path / "data" / "manifest.json").exists()
+    history, _ = extract(tmp_path, monkeypatch)
+    assert history == reference[0]
@@ -0,0 +1,32 @@
+import contextlib
+import io
+import json
+import FollowChain
+import MockChain
+import ProcessSwaps
+
+
+FROM_BLOCK, TO_BLOCK = 14020000, 14020019
+
+
+def test_failed_blocks_are_counted_and_skipped(tmp_path, monkeypatch):
+    pools, logs = MockChain.generateChain(0, numPools=10, numTokens=6, fromBlock=FROM_BLOCK, toBlock=TO_BLOCK, swapsPerBlock=4)
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    for dex in FollowChain.DEXES:
+        with open(f"data/{dex}_pools.json", 'w') as f:
+            json.dump([pool for pool in pools if pool["dex"] == dex], f)
+    monkeypatch.setattr(FollowChain, "FETCH_BACKOFF", 0)
+    ## The node refuses the blocks with more than 3 swaps of one Swap event, every try
+    chain = MockChain.MockChain(logs, rpcResultCap=3)
+    server, url = MockChain.startMockChain(chain)
+    try:
+        follower = FollowChain.ChainFollower(url)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            follower.follow(FROM_BLOCK, TO_BLOCK - FROM_BLOCK + 1)
+    finally:
+        server.shutdown()
+    assert follower.numBlocks == TO_BLOCK - FROM_BLOCK + 1
+    assert 0 < follower.degraded["failed"] < follower.numBlocks
+    assert follower.numSwaps > 0
+    assert not any(FROM_BLOCK <= block <= TO_BLOCK for block in ProcessSwaps.BLOCK_METRICS)
@@ -0,0 +1,93 @@
+import contextlib
+import io
+import pytest
+import LogFetcher as LogFetcherModule
+import MockChain
+from ExtractSwaps import POOL_SWAP_EVENT
+from LogFetcher import LogFetcher, LogJob
+from RawLogCache import RawLogCache
+
+
+FROM_BLOCK, TO_BLOCK = 14020000, 14020049
+POOLS, LOGS = MockChain.generateChain(1, numPools=10, numTokens=10, fromBlock=FROM_BLOCK, toBlock=TO_BLOCK, swapsPerBlock=5)
+KEYS = ["KEY1", "KEY2", "KEY3"]
+
+
+@pytest.fixture
+def mockChain(request):
+    chain = MockChain.MockChain(LOGS, **getattr(request, "param", dict()))
+    server, url = MockChain.startMockChain(chain)
+    yield chain, url + "/api"
+    server.shutdown()
+
+
+def poolJobs():
+    return [LogJob(pool["dex"], pool["poolContract"], POOL_SWAP_EVENT[pool["dex"]], FROM_BLOCK, TO_BLOCK) for pool in POOLS]
+
+
+def run(fetcher, jobs, onResult=None):
+    results = dict()
+    def collect(job, logs):
+        results[job] = logs
+        return onResult(job, logs) if onResult else []
+    with contextlib.redirect_stdout(io.StringIO()):
+        failed = fetcher.run(jobs, collect)
+    return results, failed
+
+
+def test_every_job_gets_its_logs(mockChain):
+    chain, url = mockChain
+    fetcher = LogFetcher(KEYS, url, rate=1000)
+    results, failed = run(fetcher, poolJobs())
+    assert failed == []
+    assert results == { job : chain.getLogs(job.address, job.topic0, job.fromBlock, job.toBlock) for job in poolJobs() }
+    assert sum(len(x) for x in results.values()) > 0
+    ## One shared queue: every key takes part
+    assert all(stats.requests > 0 for stats in fetcher.stats.values())
+    assert sum(stats.requests for stats in fetcher.stats.values()) == chain.requests == len(POOLS)
+
+
+def test_follow_up_jobs_go_on_the_queue(mockChain):
+    chain, url = mockChain
+    job = poolJobs()[0]
+    middle = (FROM_BLOCK + TO_BLOCK) // 2
+    first, second = job._replace(toBlock=middle), job._replace(fromBlock=middle + 1)
+    results, failed = run(LogFetcher(KEYS, url, rate=1000), [first], lambda x, logs : [second] if x == first else [])
+    assert failed == []
+    assert list(results) == [first, second]
+    assert results[first] + results[second] == chain.getLogs(job.address, job.topic0, FROM_BLOCK, TO_BLOCK)
+
+
+@pytest.mark.parametrize("mockChain", [{ "rateLimit" : 1 }], indirect=True)
+def test_rate_limited_requests_are_retried(mockChain, monkeypatch):
+    chain, url = mockChain
+    monkeypatch.setattr(LogFetcherModule, "RETRY_BACKOFF", 0.3)
+    fetcher = LogFetcher(KEYS[:1], url, rate=1000)
+    jobs = poolJobs()[:2]
+    results, failed = run(fetcher, jobs)
+    assert failed == []
+    assert len(results) == len(jobs)
+    assert fetcher.stats[KEYS[0]].failures > 0
+
+
+@pytest.mark.parametrize("mockChain", [{ "rateLimit" : 1 }], indirect=True)
+def test_jobs_fail_after_the_last_retry(mockChain):
+    chain, url = mockChain
+    fetcher = LogFetcher(KEYS[:1], url, rate=1000, connectionsPerKey=1, maxRetries=1)
+    jobs = poolJobs()[:3]
+    results, failed = run(fetcher, jobs)
+    assert len(results) + len(failed) == len(jobs)
+    assert len(failed) > 0
+
+
+def test_cached_jobs_send_no_requests(mockChain, tmp_path):
+    chain, url = mockChain
+    cache = RawLogCache(str(tmp_path / "raw_logs"))
+    first, _ = run(LogFetcher(KEYS, url, rate=1000, cache=cache), poolJobs())
+    requests = chain.requests
+    fetcher = LogFetcher(KEYS, url, rate=1000, cache=cache)
+    second, failed = run(fetcher, poolJobs())
+    assert failed == []
+    assert second == first
+    assert chain.requests == requests
+    assert sum(stats.requests for stats in fetcher.stats.values()) == 0
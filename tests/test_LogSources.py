@@ -0,0 +1,98 @@
+import math
+import pytest
+import MockChain
+from ExtractSwaps import POOL_SWAP_EVENT
+from LogSources import EtherscanLogSource, JsonRpcLogSource, TooManyResults, isTooManyResults
+
+
+FROM_BLOCK, TO_BLOCK = 14020000, 14020049
+POOLS, LOGS = MockChain.generateChain(2, numPools=10, numTokens=10, fromBlock=FROM_BLOCK, toBlock=TO_BLOCK, swapsPerBlock=5)
+SWAP_TOPIC = POOL_SWAP_EVENT["uniswapv2"]
+
+
+@pytest.fixture
+def mockChain(request):
+    chain = MockChain.MockChain(LOGS, **getattr(request, "param", dict()))
+    server, url = MockChain.startMockChain(chain)
+    yield chain, url
+    server.shutdown()
+
+
+def fields(log):
+    """ What the decoders read of a log, with Etherscan's and the node's hex spellings made equal. """
+    return (log["address"].lower(), tuple(log["topics"]), log["data"], log["transactionHash"],
+            *(MockChain.fromHex(log[key]) for key in ["blockNumber", "transactionIndex", "logIndex", "timeStamp", "gasPrice", "gasUsed"]))
+
+
+def swapPools():
+    """ The pools emitting uniswapv2's Swap event, busiest first. """
+    counts = dict()
+    for log in LOGS:
+        if (log["topics"][0] == SWAP_TOPIC):
+            counts[log["address"]] = counts.get(log["address"], 0) + 1
+    return sorted(counts, key=lambda x : -counts[x])
+
+
+def test_both_sources_give_the_same_logs(mockChain):
+    chain, url = mockChain
+    etherscan, jsonrpc = EtherscanLogSource("KEY1", url + "/api"), JsonRpcLogSource(url)
+    pools = swapPools()
+    assert len(pools) > 1
+    for pool in pools:
+        logs = etherscan.getLogs([pool], SWAP_TOPIC, FROM_BLOCK, TO_BLOCK)
+        assert len(logs) > 0
+        assert [fields(x) for x in jsonrpc.getLogs([pool], SWAP_TOPIC, FROM_BLOCK, TO_BLOCK)] == [fields(x) for x in logs]
+
+
+def test_one_filter_for_many_addresses(mockChain):
+    chain, url = mockChain
+    etherscan, jsonrpc = EtherscanLogSource("KEY1", url + "/api"), JsonRpcLogSource(url)
+    pools = swapPools()
+    expected = sorted((fields(x) for pool in pools for x in etherscan.getLogs([pool], SWAP_TOPIC, FROM_BLOCK, TO_BLOCK)),
+                      key=lambda x : (x[4], x[6]))
+    requests = chain.requests
+    assert [fields(x) for x in jsonrpc.getLogs(pools, SWAP_TOPIC, FROM_BLOCK, TO_BLOCK)] == expected
+    ## The getLogs batch, then one batch of block and receipt lookups
+    assert jsonrpc.requests == 2
+    assert chain.requests - requests == 1 + len({ x[4] for x in expected }) + len({ x[3] for x in expected })
+
+
+def test_queries_share_a_batch(mockChain):
+    chain, url = mockChain
+    jsonrpc = JsonRpcLogSource(url, requestsPerBatch=10)
+    queries = [([pool], SWAP_TOPIC, FROM_BLOCK, TO_BLOCK) for pool in swapPools()]
+    results = jsonrpc.getLogsBatch(queries)
+    assert [[fields(x) for x in logs] for logs in results] == [[fields(x) for x in JsonRpcLogSource(url).getLogs(*query)] for query in queries]
+    lookups = len(jsonrpc.blockTimes) + len(jsonrpc.receipts)
+    assert jsonrpc.requests == math.ceil(len(queries) / 10) + math.ceil(lookups / 10)
+
+
+@pytest.mark.parametrize("mockChain", [{ "rpcResultCap" : 5 }], indirect=True)
+def test_too_many_results(mockChain):
+    chain, url = mockChain
+    jsonrpc = JsonRpcLogSource(url)
+    busiest = swapPools()[0]
+    with pytest.raises(TooManyResults):
+        jsonrpc.getLogs(None, SWAP_TOPIC, FROM_BLOCK, TO_BLOCK)
+    few = jsonrpc.getLogs([busiest], SWAP_TOPIC, FROM_BLOCK, FROM_BLOCK)
+    results = jsonrpc.getLogsBatch([(None, SWAP_TOPIC, FROM_BLOCK, TO_BLOCK), ([busiest], SWAP_TOPIC, FROM_BLOCK, FROM_BLOCK)])
+    assert results[0] is None
+    assert [fields(x) for x in results[1]] == [fields(x) for x in few]
+
+
+@pytest.mark.parametrize("mockChain", [{ "resultCap" : 5 }], indirect=True)
+def test_etherscan_pages(mockChain):
+    chain, url = mockChain
+    etherscan = EtherscanLogSource("KEY1", url + "/api")
+    assert len(etherscan.getLogs(None, SWAP_TOPIC, FROM_BLOCK, TO_BLOCK)) == 5
+    ## An empty range is an empty page, not an error
+    assert etherscan.getLogs(None, SWAP_TOPIC, 0, 100) == []
+    assert etherscan.requests == 2
+
+
+def test_only_refusals_are_too_many_results():
+    assert isTooManyResults({ "code" : -32005, "message" : "limit exceeded" })
+    assert isTooManyResults({ "code" : -32602, "message" : "query returned more than 10000 results" })
+    assert isTooManyResults({ "code" : -32000, "message" : "Block range is too large" })
+    assert not isTooManyResults({ "code" : -32000, "message" : "invalid block range params" })
+    assert not isTooManyResults({ "code" : -32602, "message" : "fromBlock is after toBlock, bad range" })
@@ -0,0 +1,52 @@
+import contextlib
+import io
+import pytest
+import ExtractSwaps
+import ProcessSwaps
+import SwapStore
+from ArbitrageStream import ArbitrageWriter, loadArbitrages
+from GenerateSwaps import SwapHistoryGenerator
+from Interning import getInternTable, externArbitrage
+
+
+@pytest.fixture
+def table(tmp_path, monkeypatch):
+    """ The intern table of a seeded history written to tmp_path/data, with the detector's state reset around the test. """
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    for name in ["BLOCK_METRICS", "TOTAL_METRICS", "DEGRADED_BLOCKS"]:
+        monkeypatch.setattr(ProcessSwaps, name, dict())
+    monkeypatch.setattr(ProcessSwaps, "BLOCK_STATS", dict.fromkeys(ProcessSwaps.METRIC_KEYS, 0))
+    generator = SwapHistoryGenerator(0, blocks=60, pools=30, tokens=10, swapsPerBlock=8, fanout=3, cyclesPerBlock=0.5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ExtractSwaps.createSwapsHistory(generator.history())
+    return getInternTable()
+
+
+def test_streamed_run_keeps_no_arbitrages(table):
+    arbitrages = ProcessSwaps.extractArbitrages(SwapStore.iterSwapHistory(table=table), 1)
+    assert len(arbitrages) > 0
+    with ArbitrageWriter(table=table) as writer:
+        numArbitrages = ProcessSwaps.extractArbitrages(SwapStore.iterSwapHistory(table=table), 1, writer)
+    assert numArbitrages == writer.numRecords == len(arbitrages)
+    assert loadArbitrages() == [externArbitrage(x, table) for x in arbitrages]
+
+
+def test_rerun_replaces_the_streamed_blocks(table):
+    arbitrages = [externArbitrage(x, table) for x in ProcessSwaps.extractArbitrages(SwapStore.iterSwapHistory(table=table), 1)]
+    blocks = sorted({ x["cycle"][-1]["blockNumber"] for x in arbitrages })
+    middle = blocks[len(blocks) // 2]
+    for fromBlock in [None, None, middle]:
+        with ArbitrageWriter(table=table) as writer:
+            ProcessSwaps.extractArbitrages(SwapStore.iterSwapHistory(fromBlock, table=table), 1, writer)
+        assert loadArbitrages() == arbitrages
+
+
+def test_workers_log_at_the_parent_level(table, capsys):
+    level = ProcessSwaps.log.level
+    ProcessSwaps.configureLogging("WARNING")
+    try:
+        ProcessSwaps.extractArbitrages(SwapStore.iterSwapHistory(table=table), 2)
+    finally:
+        ProcessSwaps.log.setLevel(level)
+    assert "Found arbitrage" not in capsys.readouterr().out
@@ -0,0 +1,29 @@
+import contextlib
+import io
+import json
+import os
+import ExtractSwaps
+import SwapStore
+from GenerateSwaps import SwapHistoryGenerator
+
+
+def test_a_newer_history_file_wins_over_the_store(tmp_path, monkeypatch):
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ExtractSwaps.createSwapsHistory(SwapHistoryGenerator(0, blocks=20, pools=10, tokens=6, swapsPerBlock=4).history())
+    history = { k : dict(v) for k, v in SwapStore.loadSwapHistory().items() }
+    assert SwapStore.storeIsCurrent()
+    assert dict(SwapStore.iterSwapHistory()) == history
+    ## A history file replaced by hand, without the store being rebuilt
+    kept = dict(list(history.items())[:5])
+    path = SwapStore.historyFile()
+    with open(path, 'w') as f:
+        for blockNum, transactions in kept.items():
+            f.write(json.dumps({ blockNum : { str(tx) : swaps for tx, swaps in transactions.items() } }) + "\n")
+    meta = os.path.join(SwapStore.SWAP_STORE_PATH, "meta.json")
+    os.utime(path, (os.path.getmtime(meta) + 10,) * 2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not SwapStore.storeIsCurrent()
+        assert list(SwapStore.loadSwapHistory()) == list(kept)
+        assert [k for k, _ in SwapStore.iterSwapHistory()] == list(kept)
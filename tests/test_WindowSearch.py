@@ -0,0 +1,63 @@
+from ArbitrageStream import ArbitrageWriter, iterRecords
+from WindowSearch import BlockWindow, extractCrossBlockArbitrages
+
+
+def swap(block, tx, log, sender, amountFrom, tokenFrom, amountTo, tokenTo):
+    return { "blockNumber" : block, "transactionIndex" : tx, "logIndex" : log, "transactionHash" : f"0x{block:x}{tx:02x}",
+             "sender" : sender, "from" : [amountFrom, tokenFrom], "to" : [amountTo, tokenTo] }
+
+
+def transactions(*swaps):
+    ret = dict()
+    for x in swaps:
+        ret.setdefault(x["transactionHash"], []).append(x)
+    return ret
+
+
+def test_cycle_across_two_blocks():
+    window = BlockWindow(size=2)
+    first = swap(100, 0, 0, "0xa", 100, "X", 110, "Y")
+    assert window.add(100, transactions(first, swap(100, 1, 1, "0xb", 50, "Z", 60, "Y"))) == []
+    second = swap(101, 3, 0, "0xa", 105, "Y", 101, "X")
+    ## Another sender's swap back to X, and a cycle inside block 101, aren't cross block arbitrages
+    other = swap(101, 4, 1, "0xb", 60, "Y", 70, "X")
+    inBlock = [swap(101, 5, 2, "0xc", 10, "V", 11, "W"), swap(101, 5, 3, "0xc", 11, "W", 12, "V")]
+    found = window.add(101, transactions(second, other, *inBlock))
+    assert len(found) == 1
+    arbitrage = found[0]
+    assert arbitrage["cycle"] == [first, second]
+    assert arbitrage["blocks"] == [100, 101]
+    assert arbitrage["transactions"] == [(100, 0), (101, 3)]
+    assert arbitrage["balance"] == { "X" : 1, "Y" : 5 }
+
+
+def test_unprofitable_and_short_cycles_are_left_out():
+    window = BlockWindow(size=2)
+    window.add(100, transactions(swap(100, 0, 0, "0xa", 100, "X", 110, "Y")))
+    ## Pays back less X than was put in
+    assert window.add(101, transactions(swap(101, 0, 0, "0xa", 105, "Y", 99, "X"))) == []
+    ## Needs more Y than the first swap paid out, so it can't follow it
+    assert window.add(102, transactions(swap(102, 0, 0, "0xa", 200, "Y", 300, "X"))) == []
+
+
+def test_evicted_blocks_are_out_of_reach():
+    window = BlockWindow(size=2)
+    window.add(100, transactions(swap(100, 0, 0, "0xa", 100, "X", 110, "Y")))
+    window.add(101, transactions(swap(101, 0, 0, "0xb", 1, "V", 1, "W")))
+    assert window.add(102, transactions(swap(102, 0, 0, "0xa", 105, "Y", 101, "X"))) == []
+    assert [blockNum for blockNum, _ in window.blocks] == [101, 102]
+    assert window.numSwaps == 2
+    assert all(x["blockNumber"] != 100 for swaps in window.bySender.values() for x in swaps)
+
+
+def test_streamed_run_keeps_no_arbitrages(tmp_path, capsys):
+    blocks = [(100, transactions(swap(100, 0, 0, "0xa", 100, "X", 110, "Y"))),
+              (101, transactions(swap(101, 3, 0, "0xa", 105, "Y", 101, "X")))]
+    arbitrages = extractCrossBlockArbitrages(blocks, 2)
+    path = str(tmp_path / "cross_block_arbitrages.jsonl")
+    ## A rerun replaces the blocks it goes over
+    for _ in range(2):
+        with ArbitrageWriter(path) as writer:
+            assert extractCrossBlockArbitrages(blocks, 2, writer) == len(arbitrages) == 1
+    assert list(iterRecords(path=path)) == [{ "block" : 101, "blocks" : [100, 101], "transactions" : [[100, 0], [101, 3]],
+                                              "balance" : { "X" : 1, "Y" : 5 }, "cycle" : [[100, 0, 0], [101, 3, 0]] }]